@@ -7,7 +7,8 @@ from autogen_agentchat.teams import RoundRobinGroupChat
 from autogen_core.models import ChatCompletionClient
 from dotenv import load_dotenv
 
-from settings import llm_config
+from budgets import BudgetTermination
+from settings import llm_config, run_budget
 
 
 async def team_2_agents():
@@ -48,10 +49,13 @@ async def team_2_agents():
 
     # Joey should finalize the conversation after 2 jokes of Chandler.
     text_termination = TextMentionTermination("FINISH")
+    # Stop a round that goes on for too long (see settings.run_budget).
+    budget_termination = BudgetTermination(**run_budget)
 
     # Create a team with the primary and critic agents.
     team = RoundRobinGroupChat(
-        [chandler_agent, joey_agent], termination_condition=text_termination
+        [chandler_agent, joey_agent],
+        termination_condition=text_termination | budget_termination,
     )
     result = await team.run(task="Start the conversation")
     print(result)
@@ -68,6 +72,7 @@ async def team_2_agents():
             print("Stop Reason:", message.stop_reason)
         else:
             print(message)
+    print(budget_termination.report())
 
 
 asyncio.run(team_2_agents())
@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import random
 
@@ -8,15 +9,17 @@ from autogen_agentchat.teams import RoundRobinGroupChat
 from autogen_core.models import ChatCompletionClient
 from dotenv import load_dotenv
 
-from settings import llm_config
+from budgets import BudgetTermination
+from guessing_game import RefereeAgent
+from settings import llm_config, run_budget
 
 
-async def team_2_agents_guessing_game():
-    """	
+async def team_2_agents_guessing_game(referee: bool = False):
+    """
     Simulates a guessing game between two agents using an OpenAI model client.
-    The function sets up two agents: a guesser and a player. The guesser tries to 
-    guess a random number between 1 and 100, while the player provides feedback 
-    on whether the guess is too high, too low, or correct. The game continues 
+    The function sets up two agents: a guesser and a player. The guesser tries to
+    guess a random number between 1 and 100, while the player provides feedback
+    on whether the guess is too high, too low, or correct. The game continues
     until the correct number is guessed, at which point the player says 'FINISH'.
     The function uses the following components:
     - `load_dotenv()`: Loads environment variables from a .env file.
@@ -25,8 +28,11 @@ async def team_2_agents_guessing_game():
     - `AssistantAgent`: Represents the guesser and player agents.
     - `TextMentionTermination("FINISH")`: Defines the termination condition for the game.
     - `RoundRobinGroupChat`: Manages the interaction between the two agents.
-    The function prints the random number to be guessed and the messages exchanged 
+    The function prints the random number to be guessed and the messages exchanged
     between the agents during the game. It also prints the stop reason when the game ends.
+    With `referee=True`, a RefereeAgent (see guessing_game.py) takes the
+    guesser's place: it compares the guesses with the number without calling
+    the model and says 'FINISH' itself, which halves the model calls per game.
     Returns:
         None
     """
@@ -40,13 +46,17 @@ async def team_2_agents_guessing_game():
     # Create an OpenAI model client.
 
     # Create the guesser agent.
-    guesser = AssistantAgent(
-        "guesser",
-        model_client=client,
-        system_message="You are playing a game of guess-my-number. You have the "
-        f"number {randomNumber} in your mind, and I will try to guess it. "
-        "If I guess too high, say 'too high', if I guess too low, say 'too low'. ",
-    )
+    if referee:
+        guesser = RefereeAgent("guesser", randomNumber)
+    else:
+        guesser = AssistantAgent(
+            "guesser",
+            model_client=client,
+            system_message="You are playing a game of guess-my-number. "
+            f"You have the number {randomNumber} in your mind, and I will try "
+            "to guess it. If I guess too high, say 'too high', if I guess too "
+            "low, say 'too low'. ",
+        )
 
     # Create the player agent.
     player = AssistantAgent(
@@ -58,10 +68,13 @@ async def team_2_agents_guessing_game():
     )
 
     text_termination = TextMentionTermination("FINISH")
+    # Stop a game that goes on for too long (see settings.run_budget).
+    budget_termination = BudgetTermination(**run_budget)
 
     # Create a team with the two agents.
     team = RoundRobinGroupChat(
-        [player, guesser], termination_condition=text_termination
+        [player, guesser],
+        termination_condition=text_termination | budget_termination,
     )
 
     async for message in team.run_stream(
@@ -71,6 +84,16 @@ async def team_2_agents_guessing_game():
             print("Stop Reason:", message.stop_reason)
         else:
             print(message)
+    print(budget_termination.report())
 
 
-asyncio.run(team_2_agents_guessing_game())
+parser = argparse.ArgumentParser(
+    description="Two agents play guess-my-number."
+)
+parser.add_argument(
+    "--referee",
+    action="store_true",
+    help="Answer the guesses with a deterministic referee instead of the "
+    "model.",
+)
+asyncio.run(team_2_agents_guessing_game(parser.parse_args().referee))
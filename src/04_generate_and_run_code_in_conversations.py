@@ -1,14 +1,29 @@
 import asyncio
+import contextlib
+from typing import ContextManager
 
 from autogen_agentchat.agents import AssistantAgent, CodeExecutorAgent
 from autogen_agentchat.conditions import TextMentionTermination
 from autogen_agentchat.teams import RoundRobinGroupChat
 from autogen_agentchat.ui import Console
+from autogen_core.code_executor import CodeExecutor
 from autogen_core.models import ChatCompletionClient
 from autogen_ext.code_executors.local import LocalCommandLineCodeExecutor
 from dotenv import load_dotenv
 
-from settings import generated_directory, llm_config
+from budgets import BudgetTermination
+from loop_detection import LoopTermination
+from settings import (
+    code_cache,
+    code_executor,
+    fork_server,
+    generated_directory,
+    kernel_pool,
+    live_output,
+    llm_config,
+    loop_detection,
+    run_budget,
+)
 
 
 async def coding_agents():
@@ -50,11 +65,49 @@ async def coding_agents():
     # Create a local command line code executor.
     # You would normally prefer to run the commands in a different venv, but for simplicity, we will run them in
     # the same environment.
-    executor = LocalCommandLineCodeExecutor(
+    executor: CodeExecutor = LocalCommandLineCodeExecutor(
         timeout=10,  # Timeout for each code execution in seconds.
         # Use the temporary directory to store the code files.
         work_dir=generated_directory,
     )
+    # With CODE_EXECUTOR=kernel, the code runs in a Python kernel that is kept
+    # alive between code blocks, so a retry does not start a new interpreter.
+    pool = None
+    fork_server_executor = None
+    live_executor = None
+    if code_executor == "kernel":
+        from kernel_pool import KernelPool
+
+        pool = KernelPool(
+            timeout=10, work_dir=generated_directory, **kernel_pool
+        )
+        executor = pool.executor("code_executor_agent")
+    # With CODE_EXECUTOR=forkserver, every block runs in a fresh process forked
+    # from a server that has already imported the usual libraries.
+    elif code_executor == "forkserver":
+        from fork_server import ForkServerCodeExecutor
+
+        executor = fork_server_executor = ForkServerCodeExecutor(
+            timeout=10, work_dir=generated_directory, **fork_server
+        )
+    # With LIVE_OUTPUT=1, the output of a block is printed while it runs, and
+    # with LIVE_OUTPUT_FAIL_FAST=1 the block is stopped at its first
+    # traceback.
+    elif live_output is not None:
+        from live_output import LiveCommandLineCodeExecutor
+
+        executor = live_executor = LiveCommandLineCodeExecutor(
+            timeout=10, work_dir=generated_directory, **live_output
+        )
+    # With CODE_CACHE_PATH, code that is pure and ran before is not run again.
+    agent_executor = executor
+    cache = None
+    if code_cache is not None and code_executor != "kernel":
+        from code_cache import CachedCodeExecutor
+
+        agent_executor = cache = CachedCodeExecutor(
+            executor, work_dir=generated_directory, **code_cache
+        )
 
     # Get the client for chat completion.
     client = ChatCompletionClient.load_component(llm_config)
@@ -63,7 +116,7 @@ async def coding_agents():
     # This ensures that model-generated code is executed in an isolated environment.
     # But in this example, we will use the LocalCommandLineCodeExecutor for simplicity.
     code_executor_agent = CodeExecutorAgent(
-        "code_executor_agent", code_executor=executor
+        "code_executor_agent", code_executor=agent_executor
     )
 
     # Create the code writer agent.
@@ -74,15 +127,43 @@ async def coding_agents():
     )
 
     text_termination = TextMentionTermination("FINISH")
+    # Stop a run that goes on for too long (see settings.run_budget).
+    budget_termination = BudgetTermination(**run_budget)
+    # Stop when the agents keep sending the same code and errors.
+    loop_termination = LoopTermination(**loop_detection)
 
     team = RoundRobinGroupChat(
         [code_writer_agent, code_executor_agent],
-        termination_condition=text_termination,
+        termination_condition=text_termination
+        | budget_termination
+        | loop_termination,
     )
     stream = team.run_stream(
         task="Write Python code to calculate the 14th Fibonacci number."
     )
-    await Console(stream)
+
+    output: ContextManager[None] = contextlib.nullcontext()
+    if live_output is not None:
+        from live_output import streaming_output
+
+        async def print_output(text: str) -> None:
+            print(text, end="", flush=True)
+
+        output = streaming_output(print_output)
+    with output:
+        await Console(stream)
+    print(budget_termination.report())
+    print(f"Loop detection: {loop_termination.detector.stats}")
+    if pool is not None:
+        print(f"Kernel pool: {pool.stats}")
+        await pool.close()
+    if fork_server_executor is not None:
+        print(f"Fork server: {fork_server_executor.stats}")
+        await fork_server_executor.stop()
+    if live_executor is not None:
+        print(f"Live output: {live_executor.stats}")
+    if cache is not None:
+        print(f"Code cache: {cache.stats}")
 
 
 asyncio.run(coding_agents())
@@ -1,9 +1,11 @@
 # Slightly modified Code from https://github.com/microsoft/autogen/blob/main/python/packages/autogen-core/docs/src/user-guide/core-user-guide/design-patterns/code-execution-groupchat.ipynb
 
 import asyncio
+import contextlib
 import re
+import uuid
 from dataclasses import dataclass
-from typing import List
+from typing import TYPE_CHECKING, ContextManager, List, Optional
 
 from autogen_core import (
     DefaultTopicId,
@@ -14,6 +16,7 @@ from autogen_core import (
     message_handler,
 )
 from autogen_core.code_executor import CodeBlock, CodeExecutor
+from autogen_core.model_context import ChatCompletionContext
 from autogen_core.models import (
     AssistantMessage,
     ChatCompletionClient,
@@ -24,20 +27,58 @@ from autogen_core.models import (
 from autogen_ext.code_executors.local import LocalCommandLineCodeExecutor
 from dotenv import load_dotenv
 
-from settings import generated_directory, llm_config
+from budgets import Budget, BudgetGuard
+from chat_context import SummarizingChatCompletionContext
+from code_stream import CodeBlockMessage
+from interventions import InterventionChain
+from loop_detection import LoopGuard
+from settings import (
+    chat_context,
+    code_cache,
+    code_executor,
+    code_streaming,
+    fork_server,
+    generated_directory,
+    kernel_pool,
+    live_output,
+    llm_config,
+    loop_detection,
+    output_reducer,
+    parallel_blocks,
+    run_budget,
+)
+
+# The optional executors and wrappers are imported where the settings enable
+# them, so a run does not load what it does not use.
+if TYPE_CHECKING:
+    from code_stream import StreamedCodeRunner
+    from output_reducer import OutputReducer
 
 
 @dataclass
 class Message:
     content: str
+    # Not empty when the code blocks of the message were published while it
+    # was generated (see code_stream.py).
+    stream_id: str = ""
 
 
 @default_subscription
 class Assistant(RoutedAgent):
-    def __init__(self, model_client: ChatCompletionClient) -> None:
+    def __init__(
+        self,
+        model_client: ChatCompletionClient,
+        budget_guard: BudgetGuard,
+        model_context: ChatCompletionContext,
+        stream_code: bool = False,
+    ) -> None:
         super().__init__("An assistant agent.")
         self._model_client = model_client
-        self._chat_history: List[LLMMessage] = [
+        self._budget_guard = budget_guard
+        self._stream_code = stream_code
+        # The chat history, without the system message.
+        self._model_context = model_context
+        self._system_messages: List[LLMMessage] = [
             SystemMessage(
                 content="""Write Python script in markdown block, and it will be executed.
                         Always save figures to file in the current directory. Do not use plt.show().
@@ -50,16 +91,49 @@ class Assistant(RoutedAgent):
     async def handle_message(
         self, message: Message, ctx: MessageContext
     ) -> None:
-        self._chat_history.append(
-            UserMessage(content=message.content, source="user")
+        await self._model_context.add_message(
+            UserMessage(
+                content=message.content,
+                source=ctx.sender.type if ctx.sender else "user",
+            )
+        )
+        messages = (
+            self._system_messages + await self._model_context.get_messages()
         )
-        result = await self._model_client.create(self._chat_history)
+        stream_id = ""
+        if self._stream_code:
+            # Publish every code block as soon as its fence is closed, so the
+            # Executor runs it while the rest of the message is generated.
+            from code_stream import create_streaming
+
+            stream_id = uuid.uuid4().hex
+
+            async def publish_code_block(
+                index: int, code_block: CodeBlock
+            ) -> None:
+                await self.publish_message(
+                    CodeBlockMessage(
+                        stream_id, index, code_block.code, code_block.language
+                    ),
+                    DefaultTopicId(),
+                )
+
+            result = await create_streaming(
+                self._model_client,
+                messages,
+                publish_code_block,
+                ctx.cancellation_token,
+            )
+        else:
+            result = await self._model_client.create(messages)
+        self._budget_guard.record(self.id.type, result.usage)
         print(f"\n{'-' * 80}\nAssistant:\n{result.content}")
-        self._chat_history.append(
+        await self._model_context.add_message(
             AssistantMessage(content=result.content, source="assistant")
         )  # type: ignore
         await self.publish_message(
-            Message(content=result.content), DefaultTopicId()
+            Message(content=result.content, stream_id=stream_id),
+            DefaultTopicId(),
         )  # type: ignore
 
 
@@ -76,9 +150,51 @@ def extract_markdown_code_blocks(markdown_text: str) -> List[CodeBlock]:
 
 @default_subscription
 class Executor(RoutedAgent):
-    def __init__(self, code_executor: CodeExecutor) -> None:
+    def __init__(
+        self,
+        code_executor: CodeExecutor,
+        code_runner: Optional["StreamedCodeRunner"] = None,
+        publish_output: bool = False,
+        reducer: Optional["OutputReducer"] = None,
+    ) -> None:
         super().__init__("An executor agent.")
         self._code_executor = code_executor
+        self._code_runner = code_runner
+        self._publish_output = publish_output
+        self._reducer = reducer
+
+    def _streaming_output(self, run_id: str) -> ContextManager[None]:
+        """Prints and publishes the output of code run within while it runs."""
+        if not self._publish_output:
+            return contextlib.nullcontext()
+        from live_output import OutputMessage, streaming_output
+
+        started = False
+
+        async def publish_output(text: str) -> None:
+            nonlocal started
+            if not started:
+                started = True
+                print(f"\n{'-' * 80}\nExecutor (live):")
+            print(text, end="", flush=True)
+            await self.publish_message(
+                OutputMessage(run_id, text), DefaultTopicId()
+            )
+
+        return streaming_output(publish_output)
+
+    @message_handler
+    async def handle_code_block(
+        self, message: CodeBlockMessage, ctx: MessageContext
+    ) -> None:
+        if self._code_runner is not None:
+            with self._streaming_output(message.stream_id):
+                self._code_runner.submit(
+                    message.stream_id,
+                    message.index,
+                    CodeBlock(code=message.code, language=message.language),
+                    ctx.cancellation_token,
+                )
 
     @message_handler
     async def handle_message(
@@ -86,12 +202,24 @@ class Executor(RoutedAgent):
     ) -> None:
         code_blocks = extract_markdown_code_blocks(message.content)
         if code_blocks:
-            result = await self._code_executor.execute_code_blocks(
-                code_blocks, cancellation_token=ctx.cancellation_token
-            )
-            print(f"\n{'-' * 80}\nExecutor:\n{result.output}")
+            run_id = message.stream_id or uuid.uuid4().hex
+            with self._streaming_output(run_id):
+                if self._code_runner is not None and message.stream_id:
+                    # Wait for the blocks that started while the message
+                    # streamed.
+                    result = await self._code_runner.collect(
+                        message.stream_id, code_blocks, ctx.cancellation_token
+                    )
+                else:
+                    result = await self._code_executor.execute_code_blocks(
+                        code_blocks, cancellation_token=ctx.cancellation_token
+                    )
+            output = result.output
+            if self._reducer is not None:
+                output = self._reducer.reduce(output).text
+            print(f"\n{'-' * 80}\nExecutor:\n{output}")
             await self.publish_message(
-                Message(content=result.output), DefaultTopicId()
+                Message(content=output), DefaultTopicId()
             )
 
 
@@ -102,34 +230,132 @@ async def coding_agents():
     1. Loads environment variables from a .env file.
     2. Creates a local embedded runtime using SingleThreadedAgentRuntime.
     3. Loads a ChatCompletionClient component with the provided LLM configuration.
-    4. Initializes a LocalCommandLineCodeExecutor with a specified timeout and working directory.
+    4. Initializes a LocalCommandLineCodeExecutor with a specified timeout and working directory,
+       or with CODE_EXECUTOR=kernel a persistent Python kernel (see kernel_pool.py),
+       or with CODE_EXECUTOR=forkserver a fork server with preloaded modules (see fork_server.py).
+       With LIVE_OUTPUT=1 the output of a block is shown while it runs (see live_output.py).
     5. Registers an Assistant agent with the runtime.
     6. Registers an Executor agent with the runtime.
+       The Assistant keeps a bounded, summarized chat history (see chat_context.py).
+       With CODE_STREAMING=1 the Assistant streams its response and the Executor starts each
+       code block as soon as its closing fence arrives (see code_stream.py).
+       With OUTPUT_REDUCER=1 the Executor shortens long output to a token budget and stores
+       the full output in generated/outputs (see output_reducer.py).
     7. Starts the runtime and publishes a message to the assistant to create a plot of NVIDIA vs TSLA stock.
+    The Assistant and Executor would otherwise go back and forth without end, so a BudgetGuard
+    stops the runtime once the run exceeds settings.run_budget, and a LoopGuard nudges, then
+    stops, an agent that keeps sending the same message.
     Returns:
         None
     """
 
     load_dotenv()
     # Create an local embedded runtime.
-    runtime = SingleThreadedAgentRuntime()
+    budget_guard = BudgetGuard(Budget(**run_budget))
+    loop_guard = LoopGuard(
+        nudge=lambda message, note: Message(
+            f"{message.content}\n\n{note}", message.stream_id
+        ),
+        model_agents=["assistant"],
+        **loop_detection,
+    )
+    runtime = SingleThreadedAgentRuntime(
+        intervention_handlers=[InterventionChain(budget_guard, loop_guard)]
+    )
     client = ChatCompletionClient.load_component(llm_config)
 
-    executor = LocalCommandLineCodeExecutor(
+    executor: CodeExecutor = LocalCommandLineCodeExecutor(
         timeout=60,  # Timeout for each code execution in seconds.
         # Use the temporary directory to store the code files.
         work_dir=generated_directory,
     )
+    # With CODE_EXECUTOR=kernel, the code runs in a Python kernel that is kept
+    # alive between code blocks, so a retry does not import pandas and
+    # matplotlib again.
+    pool = None
+    fork_server_executor = None
+    live_executor = None
+    if code_executor == "kernel":
+        from kernel_pool import KernelPool
+
+        pool = KernelPool(
+            timeout=60, work_dir=generated_directory, **kernel_pool
+        )
+        executor = pool.executor("coding_agents")
+    # With CODE_EXECUTOR=forkserver, every block runs in a fresh process forked
+    # from a server that has already imported the usual libraries.
+    elif code_executor == "forkserver":
+        from fork_server import ForkServerCodeExecutor
 
+        executor = fork_server_executor = ForkServerCodeExecutor(
+            timeout=60, work_dir=generated_directory, **fork_server
+        )
+    # With LIVE_OUTPUT=1, the output of a block is shown and published while
+    # it runs, and with LIVE_OUTPUT_FAIL_FAST=1 the block is stopped at its
+    # first traceback.
+    elif live_output is not None:
+        from live_output import LiveCommandLineCodeExecutor
+
+        executor = live_executor = LiveCommandLineCodeExecutor(
+            timeout=60, work_dir=generated_directory, **live_output
+        )
+
+    model_context = SummarizingChatCompletionContext(
+        summary_client=client,
+        on_summary_usage=lambda usage: budget_guard.record("summary", usage),
+        **chat_context,
+    )
     (
         await Assistant.register(
             runtime,
             "assistant",
-            lambda: Assistant(client),
+            lambda: Assistant(
+                client, budget_guard, model_context, code_streaming
+            ),
         ),
     )
 
-    await Executor.register(runtime, "executor", lambda: Executor(executor))
+    # With CODE_PARALLEL_BLOCKS > 1, independent code blocks of a message run
+    # at the same time; the output of each block starts with its run time.
+    agent_executor: CodeExecutor = executor
+    parallel = None
+    if parallel_blocks["max_workers"] > 1 and code_executor != "kernel":
+        from parallel_blocks import ParallelCodeExecutor
+
+        agent_executor = parallel = ParallelCodeExecutor(
+            executor, **parallel_blocks
+        )
+    # With CODE_CACHE_PATH, code that is pure and ran before is not run again.
+    cache = None
+    if code_cache is not None and code_executor != "kernel":
+        from code_cache import CachedCodeExecutor
+
+        agent_executor = cache = CachedCodeExecutor(
+            agent_executor, work_dir=generated_directory, **code_cache
+        )
+    # With CODE_STREAMING=1, the Assistant streams its response and each
+    # code block starts running as soon as its closing fence arrives.
+    code_runner = None
+    if code_streaming:
+        from code_stream import StreamedCodeRunner
+
+        code_runner = StreamedCodeRunner(agent_executor)
+    # With OUTPUT_REDUCER=1, long output is shortened before it enters the
+    # chat history, and the full output is stored in generated/outputs.
+    reducer = None
+    if output_reducer is not None:
+        from output_reducer import OutputReducer
+
+        reducer = OutputReducer(
+            work_dir=generated_directory, **output_reducer
+        )
+    await Executor.register(
+        runtime,
+        "executor",
+        lambda: Executor(
+            agent_executor, code_runner, live_output is not None, reducer
+        ),
+    )
 
     # Start the runtime and publish a message to the assistant.
     runtime.start()
@@ -140,6 +366,28 @@ async def coding_agents():
         DefaultTopicId(),
     )
     await runtime.stop_when_idle()
+    print(f"\n{'-' * 80}\n{budget_guard.report()}")
+    for reason in [budget_guard.reason, *loop_guard.reasons]:
+        if reason is not None:
+            print(f"Stopped: {reason}")
+    print(f"Loop detection: {loop_guard.stats}")
+    print(f"Chat context: {model_context.stats}")
+    if pool is not None:
+        print(f"Kernel pool: {pool.stats}")
+        await pool.close()
+    if fork_server_executor is not None:
+        print(f"Fork server: {fork_server_executor.stats}")
+        await fork_server_executor.stop()
+    if live_executor is not None:
+        print(f"Live output: {live_executor.stats}")
+    if parallel is not None:
+        print(f"Parallel blocks: {parallel.stats}")
+    if cache is not None:
+        print(f"Code cache: {cache.stats}")
+    if code_runner is not None:
+        print(f"Code streaming: {code_runner.stats}")
+    if reducer is not None:
+        print(f"Output reducer: {reducer.stats}")
 
 
 asyncio.run(coding_agents())
@@ -1,8 +1,10 @@
 import asyncio
+import contextlib
 import os
 import re
+import uuid
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, ContextManager, List, Optional
 
 from autogen_core import (
     DefaultTopicId,
@@ -12,7 +14,8 @@ from autogen_core import (
     default_subscription,
     message_handler,
 )
-from autogen_core.code_executor import CodeBlock, CodeExecutor, CodeResult
+from autogen_core.code_executor import CodeBlock, CodeExecutor
+from autogen_core.model_context import ChatCompletionContext
 from autogen_core.models import (
     AssistantMessage,
     ChatCompletionClient,
@@ -21,115 +24,30 @@ from autogen_core.models import (
     UserMessage,
 )
 from dotenv import load_dotenv
-from langchain_azure_dynamic_sessions import SessionsPythonREPLTool
 
-from settings import llm_config
+from chat_context import SummarizingChatCompletionContext
+from code_stream import CodeBlockMessage
+from dynamic_sessions import DynamicSessionsPool, static_token_provider
+from settings import (
+    chat_context,
+    code_streaming,
+    live_output,
+    llm_config,
+    remote_batching,
+)
+
+# The optional features are imported where the settings enable them, so a
+# run does not load what it does not use.
+if TYPE_CHECKING:
+    from code_stream import StreamedCodeRunner
 
 
 @dataclass
 class Message:
     content: str
-
-
-class RemoteExecutor(CodeExecutor):
-    """
-    A code executor that runs code blocks in a remote Azure Container Apps instance.
-    This allows for secure execution in an isolated environment with appropriate resources.
-
-    Requirements for ACA ingress configuration:
-    1. Your ACA container must have ingress enabled with an external endpoint
-    2. The endpoint should be HTTPS for production use
-    3. IP restrictions should be configured if needed for security
-    4. Authentication should be enabled (API key is used in this code)
-    """
-
-    def __init__(
-        self,
-        timeout: Optional[int] = 60,
-        pool_management_endpoint: Optional[str] = None,
-        additional_session_config: Optional[Dict[str, Any]] = None,
-    ) -> None:
-        """
-        Initialize the RemoteExecutor with connection details for Azure Container Apps.
-
-        Args:
-            timeout: Maximum time in seconds to wait for code execution
-            pool_management_endpoint: Endpoint for the Azure Container Apps session pool
-            additional_session_config: Additional configuration parameters for the session
-        """
-        super().__init__()
-        self.timeout = timeout
-
-        # Get the pool management endpoint from environment variable if not provided
-        self.pool_management_endpoint = (
-            pool_management_endpoint
-            or os.environ.get(
-                "ACA_POOL_MANAGEMENT_ENDPOINT",
-                "<TODO: Set your Azure Container Apps session pool endpoint in environment variables>",
-            )
-        )
-
-        # Additional configuration parameters for the session
-        self.additional_session_config = additional_session_config or {}
-
-    async def execute_code_blocks(
-        self, code_blocks: List[CodeBlock], cancellation_token=None
-    ) -> CodeResult:
-        """
-        Execute a list of code blocks in the remote Azure Container Apps instance.
-
-        Args:
-            code_blocks: List of CodeBlock objects to execute
-            cancellation_token: Optional token for cancellation
-
-        Returns:
-            CodeResult with execution output and status
-        """
-        # Initialize logs to collect execution results
-        logs = []
-        exit_code = 0
-
-        try:
-            # Create a tool to interact with the remote Python REPL
-            tool = SessionsPythonREPLTool(
-                pool_management_endpoint=self.pool_management_endpoint,
-                timeout=self.timeout,
-                **self.additional_session_config,
-            )
-
-            # Execute each code block in sequence
-            for i, code_block in enumerate(code_blocks):
-                try:
-                    # Log which block is being executed
-                    block_header = f"\n--- Executing code block {i + 1}/{len(code_blocks)} ---\n"
-                    logs.append(block_header)
-
-                    # Execute the code in the remote session
-                    result = tool.invoke(code_block.code)
-
-                    # Append the result to logs
-                    logs.append(result)
-                except Exception as e:
-                    # If execution fails, log the error and set exit code to failure
-                    error_msg = (
-                        f"Error executing code block {i + 1}: {str(e)}\n"
-                    )
-                    logs.append(error_msg)
-                    exit_code = 1
-                    break
-
-            # Combine all logs into a single string
-            log_output = "".join(logs)
-
-            # Return the combined result
-            return CodeResult(exit_code=exit_code, output=log_output)
-
-        except Exception as e:
-            # Handle any errors in setting up the remote execution
-            return CodeResult(
-                exit_code=1,
-                output=f"Failed to execute code in remote container: {str(e)}",
-            )
+    # Not empty when the code blocks of the message were published while it
+    # was generated (see code_stream.py).
+    stream_id: str = ""
 
 
 def extract_markdown_code_blocks(markdown_text: str) -> List[CodeBlock]:
@@ -145,10 +63,18 @@ def extract_markdown_code_blocks(markdown_text: str) -> List[CodeBlock]:
 
 @default_subscription
 class Assistant(RoutedAgent):
-    def __init__(self, model_client: ChatCompletionClient) -> None:
+    def __init__(
+        self,
+        model_client: ChatCompletionClient,
+        model_context: ChatCompletionContext,
+        stream_code: bool = False,
+    ) -> None:
         super().__init__("An assistant agent.")
         self._model_client = model_client
-        self._chat_history: List[LLMMessage] = [
+        self._stream_code = stream_code
+        # The chat history, without the system message.
+        self._model_context = model_context
+        self._system_messages: List[LLMMessage] = [
             SystemMessage(
                 content="""Write Python script in markdown block, and it will be executed in a remote container.
                         Always save figures to file in the current directory. Do not use plt.show().
@@ -160,24 +86,96 @@ class Assistant(RoutedAgent):
     async def handle_message(
         self, message: Message, ctx: MessageContext
     ) -> None:
-        self._chat_history.append(
-            UserMessage(content=message.content, source="user")
+        await self._model_context.add_message(
+            UserMessage(
+                content=message.content,
+                source=ctx.sender.type if ctx.sender else "user",
+            )
         )
-        result = await self._model_client.create(self._chat_history)
+        messages = (
+            self._system_messages + await self._model_context.get_messages()
+        )
+        stream_id = ""
+        if self._stream_code:
+            # Publish every code block as soon as its fence is closed, so the
+            # Executor runs it while the rest of the message is generated.
+            from code_stream import create_streaming
+
+            stream_id = uuid.uuid4().hex
+
+            async def publish_code_block(
+                index: int, code_block: CodeBlock
+            ) -> None:
+                await self.publish_message(
+                    CodeBlockMessage(
+                        stream_id, index, code_block.code, code_block.language
+                    ),
+                    DefaultTopicId(),
+                )
+
+            result = await create_streaming(
+                self._model_client,
+                messages,
+                publish_code_block,
+                ctx.cancellation_token,
+            )
+        else:
+            result = await self._model_client.create(messages)
         print(f"\n{'-' * 80}\nAssistant:\n{result.content}")
-        self._chat_history.append(
+        await self._model_context.add_message(
             AssistantMessage(content=result.content, source="assistant")
         )  # type: ignore
         await self.publish_message(
-            Message(content=result.content), DefaultTopicId()
+            Message(content=result.content, stream_id=stream_id),
+            DefaultTopicId(),
         )  # type: ignore
 
 
 @default_subscription
 class Executor(RoutedAgent):
-    def __init__(self, code_executor: CodeExecutor) -> None:
+    def __init__(
+        self,
+        code_executor: CodeExecutor,
+        code_runner: Optional["StreamedCodeRunner"] = None,
+        publish_output: bool = False,
+    ) -> None:
         super().__init__("A remote executor agent.")
         self._code_executor = code_executor
+        self._code_runner = code_runner
+        self._publish_output = publish_output
+
+    def _streaming_output(self, run_id: str) -> ContextManager[None]:
+        """Prints and publishes the output of code run within while it runs."""
+        if not self._publish_output:
+            return contextlib.nullcontext()
+        from live_output import OutputMessage, streaming_output
+
+        started = False
+
+        async def publish_output(text: str) -> None:
+            nonlocal started
+            if not started:
+                started = True
+                print(f"\n{'-' * 80}\nRemote Executor (live):")
+            print(text, end="", flush=True)
+            await self.publish_message(
+                OutputMessage(run_id, text), DefaultTopicId()
+            )
+
+        return streaming_output(publish_output)
+
+    @message_handler
+    async def handle_code_block(
+        self, message: CodeBlockMessage, ctx: MessageContext
+    ) -> None:
+        if self._code_runner is not None:
+            with self._streaming_output(message.stream_id):
+                self._code_runner.submit(
+                    message.stream_id,
+                    message.index,
+                    CodeBlock(code=message.code, language=message.language),
+                    ctx.cancellation_token,
+                )
 
     @message_handler
     async def handle_message(
@@ -185,9 +183,18 @@ class Executor(RoutedAgent):
     ) -> None:
         code_blocks = extract_markdown_code_blocks(message.content)
         if code_blocks:
-            result = await self._code_executor.execute_code_blocks(
-                code_blocks, cancellation_token=ctx.cancellation_token
-            )
+            run_id = message.stream_id or uuid.uuid4().hex
+            with self._streaming_output(run_id):
+                if self._code_runner is not None and message.stream_id:
+                    # Wait for the blocks that started while the message
+                    # streamed.
+                    result = await self._code_runner.collect(
+                        message.stream_id, code_blocks, ctx.cancellation_token
+                    )
+                else:
+                    result = await self._code_executor.execute_code_blocks(
+                        code_blocks, cancellation_token=ctx.cancellation_token
+                    )
             print(f"\n{'-' * 80}\nRemote Executor:\n{result.output}")
             await self.publish_message(
                 Message(content=result.output), DefaultTopicId()
@@ -205,32 +212,55 @@ async def run_remote_coding_agents():
     runtime = SingleThreadedAgentRuntime()
     client = ChatCompletionClient.load_component(llm_config)
 
-    # Create the remote executor with appropriate settings
-    executor = RemoteExecutor(
+    # Create the remote executor. The conversation keeps one session of the
+    # Azure Container Apps session pool (see dynamic_sessions.py), so state
+    # persists between code blocks, and requests do not block the runtime.
+    # ACA_ACCESS_TOKEN replaces the Microsoft Entra token, e.g. for the
+    # offline stand-in of fake_sessions_server.py.
+    access_token = os.environ.get("ACA_ACCESS_TOKEN")
+    sessions = DynamicSessionsPool(
+        pool_management_endpoint=os.environ.get(
+            "ACA_POOL_MANAGEMENT_ENDPOINT",
+            "<TODO: Set your Azure Container Apps session pool endpoint in environment variables>",
+        ),
         timeout=60,  # Timeout for each code execution in seconds
-        additional_session_config={
-            # Add any additional configuration for the ACA session
-            "api_key": os.environ.get(
-                "ACA_API_KEY",
-                "<TODO: Set your API key in environment variables>",
-            ),
-            "session_options": {
-                "keep_alive": True,  # Keep the session alive between code blocks
-                "memory_gb": 4,  # Allocate 4GB of memory to the session
-                "cpu_count": 2,  # Allocate 2 CPUs to the session
-            },
-        },
+        access_token_provider=static_token_provider(access_token)
+        if access_token
+        else None,
     )
+    # With REMOTE_BATCHING=1, the blocks of a message go in one request.
+    executor = sessions.executor("remote_coding_agents", batch=remote_batching)
+
+    # No CachedCodeExecutor (CODE_CACHE_PATH): the session keeps the state
+    # of earlier blocks, so the result of a block depends on them too.
+    agent_executor: CodeExecutor = executor
 
-    # Register the assistant agent
+    # Register the assistant agent with a bounded, summarized chat history
+    # (see chat_context.py)
+    model_context = SummarizingChatCompletionContext(
+        summary_client=client, **chat_context
+    )
     await Assistant.register(
         runtime,
         "assistant",
-        lambda: Assistant(client),
+        lambda: Assistant(client, model_context, code_streaming),
     )
 
-    # Register the executor agent that uses the remote executor
-    await Executor.register(runtime, "executor", lambda: Executor(executor))
+    # Register the executor agent that uses the remote executor. With
+    # CODE_STREAMING=1, each code block is sent to the container as soon as
+    # its closing fence arrives.
+    code_runner = None
+    if code_streaming:
+        from code_stream import StreamedCodeRunner
+
+        code_runner = StreamedCodeRunner(agent_executor)
+    # With LIVE_OUTPUT=1, the log of each block is shown and published as
+    # soon as it arrives.
+    await Executor.register(
+        runtime,
+        "executor",
+        lambda: Executor(agent_executor, code_runner, live_output is not None),
+    )
 
     # Start the runtime and publish a message to the assistant
     runtime.start()
@@ -239,6 +269,11 @@ async def run_remote_coding_agents():
         DefaultTopicId(),
     )
     await runtime.stop_when_idle()
+    print(f"\n{'-' * 80}\nChat context: {model_context.stats}")
+    print(f"Dynamic sessions: {sessions.stats}")
+    if code_runner is not None:
+        print(f"Code streaming: {code_runner.stats}")
+    await sessions.close()
 
 
 if __name__ == "__main__":
@@ -10,9 +10,6 @@ from azure.identity import DefaultAzureCredential
 from semantic_kernel.agents import AgentGroupChat, ChatCompletionAgent
 from semantic_kernel.agents.agent import Agent
 from semantic_kernel.agents.group_chat.agent_group_chat import AgentGroupChat
-from semantic_kernel.connectors.ai.open_ai.services.azure_chat_completion import (
-    AzureChatCompletion,
-)
 from semantic_kernel.contents import (
     AuthorRole,
     ChatHistory,
@@ -26,12 +23,14 @@ from semantic_kernel.exceptions.function_exceptions import (
 )
 from semantic_kernel.kernel import Kernel
 
-from settings import llm_config
+from chat_services import connection_metrics, setup_chat_service
 
 dotenv.load_dotenv()
 
 azure_openai_endpoint = os.getenv("AZURE_OPENAI_URL")
 pool_management_endpoint = os.getenv("ACA_POOL_MANAGEMENT_ENDPOINT")
+# A fixed token instead of Microsoft Entra, e.g. for fake_sessions_server.py
+access_token = os.getenv("ACA_ACCESS_TOKEN")
 
 
 def auth_callback_factory(scope):
@@ -40,6 +39,8 @@ def auth_callback_factory(scope):
     async def auth_callback() -> str:
         """Auth callback for the SessionsPythonTool."""
         nonlocal auth_token
+        if access_token:
+            return access_token
         current_utc_timestamp = int(
             datetime.datetime.now(datetime.timezone.utc).timestamp()
         )
@@ -60,25 +61,6 @@ def auth_callback_factory(scope):
     return auth_callback
 
 
-def setup_chat_service(kernel: Kernel, service_id: str) -> None:
-    """Set up a chat completion service for the kernel."""
-    deployment_name = llm_config.get("config", {}).get("model", "gpt-4o")
-    endpoint = llm_config.get("config", {}).get(
-        "azure_endpoint", azure_openai_endpoint
-    )
-    api_key = llm_config.get("config", {}).get("api_key", None)
-    api_version = llm_config.get("config", {}).get("api_version", "2024-06-01")
-
-    chat_service = AzureChatCompletion(
-        service_id=service_id,
-        endpoint=endpoint,
-        api_key=api_key,
-        api_version=api_version,
-        deployment_name=deployment_name,
-    )
-    kernel.add_service(chat_service)
-
-
 async def create_code_agent() -> Agent:
     """Create an agent specialized in executing Python code."""
     kernel = Kernel()
@@ -197,6 +179,9 @@ async def main():
             print(f"Message details: {message}")
 
     print("\n--- Group chat completed ---\n")
+    # Both kernels share one connection pool, so most requests reuse a
+    # connection that is already open.
+    print(f"Connection pool: {connection_metrics()}")
 
 
 if __name__ == "__main__":
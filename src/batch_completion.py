@@ -0,0 +1,358 @@
+"""
+Bounded-concurrency batch completions with rate limiting.
+
+BatchCompletion runs many independent prompts through one
+ChatCompletionClient without firing them all at once. Requests are paced by
+two token buckets sized from the deployment's quota (requests per minute and
+tokens per minute) and run by a pool of workers whose concurrency adapts
+AIMD-style: it grows by one slot per window of successful requests and is
+halved on a 429, once per overload: 429s of requests that started before the
+last decrease do not halve it again. When the service sends `retry-after` /
+`retry-after-ms` headers, all workers pause for that long before trying
+again.
+
+Results are streamed back as they finish, not in input order:
+
+    batch = BatchCompletion(client, tokens_per_minute=30000)
+    async for item in batch.stream(message_lists):
+        print(item.index, item.result.content if item.result else item.error)
+
+The openai SDK retries 429s on its own (`max_retries`, default 2). Set
+`"max_retries": 0` in the client config to let BatchCompletion see every
+throttled request and adapt sooner.
+"""
+
+import asyncio
+import email.utils
+import time
+from dataclasses import dataclass
+from typing import (
+    Any,
+    AsyncGenerator,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+
+from settings import deployment_tokens_per_minute
+
+# Azure OpenAI grants 6 requests per minute for every 1000 tokens per minute.
+REQUESTS_PER_1000_TOKENS = 6
+
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at `per_minute` tokens a minute.
+
+    `acquire` may take more than the bucket holds (a large prompt); the bucket
+    then goes into debt and later callers wait until it is paid back.
+    """
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self._rate = per_minute / 60.0
+        self._tokens = per_minute
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+
+    async def acquire(self, amount: float) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill()
+                # Never wait for more than a full bucket.
+                if self._tokens >= min(amount, self.capacity):
+                    self._tokens -= amount
+                    return
+                needed = min(amount, self.capacity) - self._tokens
+                await asyncio.sleep(needed / self._rate)
+
+    def available(self) -> float:
+        """Tokens that can be taken right now without waiting."""
+        self._refill()
+        if time.monotonic() < self._paused_until:
+            return 0.0
+        return self._tokens
+
+    def adjust(self, amount: float) -> None:
+        """Correct an earlier estimate; positive amounts take tokens."""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - amount)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller for `seconds`, e.g. after a 429."""
+        self._paused_until = max(
+            self._paused_until, time.monotonic() + seconds
+        )
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    A semaphore whose limit follows AIMD (additive increase, multiplicative
+    decrease) between 1 and `max_limit`.
+
+    `acquire` returns the number of decreases so far; pass it to `release`
+    so that a burst of throttled requests that were already in flight when
+    the limit was decreased counts as one overload.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        initial_limit: Optional[int] = None,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        self.max_limit = max_limit
+        self.limit = float(initial_limit or max_limit)
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.decreases = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> int:
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self.in_flight < int(self.limit)
+            )
+            self.in_flight += 1
+            return self.decreases
+
+    async def release(
+        self, throttled: bool = False, acquired_at: Optional[int] = None
+    ) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                # The limit was already decreased for this overload.
+                if acquired_at is None or acquired_at == self.decreases:
+                    self.limit = max(1.0, self.limit * self.decrease_factor)
+                    self.decreases += 1
+            else:
+                # One extra slot after `limit` consecutive successes.
+                self.limit = min(
+                    float(self.max_limit), self.limit + 1.0 / self.limit
+                )
+            self._condition.notify_all()
+
+
+@dataclass
+class BatchItemResult:
+    index: int
+    result: Optional[CreateResult]
+    error: Optional[BaseException]
+    attempts: int
+    latency: float
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Read `retry-after-ms` or `retry-after` from a throttled response."""
+    response = getattr(error, "response", None)
+    headers: Mapping[str, str] = getattr(response, "headers", None) or {}
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        # Neither seconds nor an HTTP date; back off exponentially.
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class BatchCompletion:
+    """
+    Run many independent prompts through one model client.
+
+    Args:
+        client: The model client used for every request.
+        max_concurrency: Upper bound for requests in flight.
+        requests_per_minute: Request quota of the deployment. Derived from
+            `tokens_per_minute` when not given.
+        tokens_per_minute: Token quota of the deployment. Defaults to
+            AZURE_OPENAI_TPM from settings; no token pacing when unset.
+        expected_completion_tokens: Completion tokens charged up front for
+            each request; corrected with the real usage afterwards.
+        max_retries: Attempts per prompt after a 429 before giving up.
+        create_args: Extra arguments passed to `client.create`.
+    """
+
+    def __init__(
+        self,
+        client: ChatCompletionClient,
+        max_concurrency: int = 16,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = deployment_tokens_per_minute,
+        expected_completion_tokens: int = 256,
+        max_retries: int = 5,
+        create_args: Optional[Mapping[str, Any]] = None,
+    ) -> None:
+        self._client = client
+        self._max_concurrency = max_concurrency
+        if requests_per_minute is None and tokens_per_minute:
+            requests_per_minute = (
+                tokens_per_minute / 1000 * REQUESTS_PER_1000_TOKENS
+            )
+        self._request_bucket = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self._token_bucket = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        )
+        self._expected_completion_tokens = expected_completion_tokens
+        self._max_retries = max_retries
+        self._create_args = dict(create_args or {})
+        self.limiter = AdaptiveConcurrencyLimiter(max_concurrency)
+        self.throttled_requests = 0
+
+    async def stream(
+        self, message_lists: Iterable[Sequence[LLMMessage]]
+    ) -> AsyncGenerator[BatchItemResult, None]:
+        """Yield one BatchItemResult per message list as each one finishes."""
+        prompts: Iterator[Tuple[int, Sequence[LLMMessage]]] = enumerate(
+            message_lists
+        )
+        results: asyncio.Queue[Optional[BatchItemResult]] = asyncio.Queue()
+
+        async def worker() -> None:
+            try:
+                # The iterator is shared, so prompts are pulled lazily and
+                # only as fast as the workers can send them.
+                for index, messages in prompts:
+                    started = time.monotonic()
+                    try:
+                        item = await self._complete(index, messages)
+                    except Exception as error:
+                        # Report the prompt instead of losing the worker.
+                        item = BatchItemResult(
+                            index,
+                            None,
+                            error,
+                            1,
+                            time.monotonic() - started,
+                        )
+                    await results.put(item)
+            finally:
+                await results.put(None)
+
+        workers = [
+            asyncio.create_task(worker()) for _ in range(self._max_concurrency)
+        ]
+        running = len(workers)
+        try:
+            while running:
+                item = await results.get()
+                if item is None:
+                    running -= 1
+                else:
+                    yield item
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def run(
+        self, message_lists: Iterable[Sequence[LLMMessage]]
+    ) -> List[BatchItemResult]:
+        """Run the whole batch and return the results in input order."""
+        items = [item async for item in self.stream(message_lists)]
+        return sorted(items, key=lambda item: item.index)
+
+    async def _complete(
+        self, index: int, messages: Sequence[LLMMessage]
+    ) -> BatchItemResult:
+        started = time.monotonic()
+        estimate = self._estimate_tokens(messages)
+        attempts = 0
+        while True:
+            attempts += 1
+            acquired_at = await self.limiter.acquire()
+            throttled = False
+            try:
+                if self._request_bucket is not None:
+                    await self._request_bucket.acquire(1)
+                if self._token_bucket is not None:
+                    await self._token_bucket.acquire(estimate)
+                result = await self._client.create(
+                    messages, extra_create_args=self._create_args
+                )
+            except Exception as error:
+                if not is_rate_limit_error(error):
+                    return BatchItemResult(
+                        index,
+                        None,
+                        error,
+                        attempts,
+                        time.monotonic() - started,
+                    )
+                throttled = True
+                self.throttled_requests += 1
+                if self._token_bucket is not None:
+                    # The retry is charged again.
+                    self._token_bucket.adjust(-estimate)
+                delay = retry_after_seconds(error)
+                if delay is None:
+                    delay = min(2.0**attempts, 60.0)
+                for bucket in (self._request_bucket, self._token_bucket):
+                    if bucket is not None:
+                        bucket.pause(delay)
+                if attempts > self._max_retries:
+                    return BatchItemResult(
+                        index,
+                        None,
+                        error,
+                        attempts,
+                        time.monotonic() - started,
+                    )
+                if self._request_bucket is None and self._token_bucket is None:
+                    await asyncio.sleep(delay)
+            else:
+                if self._token_bucket is not None:
+                    used = (
+                        result.usage.prompt_tokens
+                        + result.usage.completion_tokens
+                    )
+                    self._token_bucket.adjust(used - estimate)
+                return BatchItemResult(
+                    index, result, None, attempts, time.monotonic() - started
+                )
+            finally:
+                await self.limiter.release(throttled, acquired_at)
+
+    def _estimate_tokens(self, messages: Sequence[LLMMessage]) -> int:
+        try:
+            prompt_tokens = self._client.count_tokens(messages)
+        except Exception:
+            # Roughly four characters per token when the client cannot count.
+            prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        return prompt_tokens + self._expected_completion_tokens
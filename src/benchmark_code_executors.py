@@ -0,0 +1,144 @@
+"""
+Per-block latency of the code executors available to 04 and 05.
+
+The same Python block is run `--blocks` times on each executor:
+
+- `local`: LocalCommandLineCodeExecutor, a new interpreter per block (the
+  default of 04 and 05),
+- `forkserver`: ForkServerCodeExecutor, a child forked per block from a
+  server that has preloaded `--preload` (fork_server.py),
+- `kernel`: KernelPool, one interpreter that keeps its state between blocks
+  (kernel_pool.py), so imports are only paid by the first block.
+
+The block imports the preloaded modules that are installed and prints a
+small result, like the start of a typical block of 05. For every executor
+the benchmark reports the first block (including starting the server or
+kernel), and the median, p95 and mean of the following ones. Results are
+written as JSON Lines to stdout or `--output`, and a table to stderr:
+
+    python benchmark_code_executors.py --blocks 20 \
+        --preload numpy,pandas,matplotlib.pyplot
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from autogen_core import CancellationToken
+from autogen_core.code_executor import CodeBlock, CodeExecutor
+from autogen_ext.code_executors.local import LocalCommandLineCodeExecutor
+
+from fork_server import DEFAULT_PRELOAD, ForkServerCodeExecutor
+from kernel_pool import KernelPool
+
+EXECUTORS = ("local", "forkserver", "kernel")
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module.split(".")[0]) is not None
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(percentile * len(ordered)), len(ordered) - 1)]
+
+
+async def measure(
+    name: str, work_dir: str, preload: List[str], blocks: int
+) -> Dict[str, Any]:
+    pool = None
+    if name == "local":
+        executor: CodeExecutor = LocalCommandLineCodeExecutor(
+            work_dir=work_dir
+        )
+    elif name == "forkserver":
+        executor = ForkServerCodeExecutor(work_dir=work_dir, preload=preload)
+    else:
+        pool = KernelPool(work_dir=work_dir)
+        executor = pool.executor("benchmark")
+    imports = "".join(f"import {module}\n" for module in preload)
+    code = CodeBlock(f"{imports}print(sum(range(1000)))\n", "python")
+    timings: List[float] = []
+    try:
+        for _ in range(blocks):
+            started = time.perf_counter()
+            result = await executor.execute_code_blocks(
+                [code], CancellationToken()
+            )
+            timings.append((time.perf_counter() - started) * 1000)
+            if result.exit_code != 0:
+                raise RuntimeError(f"{name} failed: {result.output}")
+    finally:
+        if isinstance(executor, ForkServerCodeExecutor):
+            await executor.stop()
+        if pool is not None:
+            await pool.close()
+    rest = timings[1:] or timings
+    return {
+        "executor": name,
+        "blocks": blocks,
+        "preload": preload,
+        "first_ms": round(timings[0], 2),
+        "p50_ms": round(_percentile(rest, 0.5), 2),
+        "p95_ms": round(_percentile(rest, 0.95), 2),
+        "mean_ms": round(statistics.mean(rest), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare the per-block latency of the code executors."
+    )
+    parser.add_argument(
+        "--executors",
+        default=",".join(EXECUTORS),
+        help=f"Comma-separated subset of {', '.join(EXECUTORS)}.",
+    )
+    parser.add_argument("--blocks", type=int, default=20)
+    parser.add_argument(
+        "--preload",
+        default=",".join(DEFAULT_PRELOAD),
+        help="Modules the block imports and the fork server preloads; the "
+        "ones that are not installed are left out.",
+    )
+    parser.add_argument("--output", help="JSON Lines file; default stdout.")
+    args = parser.parse_args()
+
+    names = args.executors.split(",")
+    for name in names:
+        if name not in EXECUTORS:
+            parser.error(f"Unknown executor: {name}")
+    preload = [m for m in args.preload.split(",") if m and _installed(m)]
+    output = open(args.output, "w") if args.output else sys.stdout
+    print(f"preloaded modules: {', '.join(preload) or '-'}", file=sys.stderr)
+    print(
+        f"{'executor':<12} {'first ms':>9} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'mean ms':>8}",
+        file=sys.stderr,
+    )
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            for name in names:
+                record = asyncio.run(
+                    measure(name, work_dir, preload, args.blocks)
+                )
+                print(json.dumps(record), file=output, flush=True)
+                print(
+                    f"{name:<12} {record['first_ms']:>9.1f} "
+                    f"{record['p50_ms']:>8.1f} {record['p95_ms']:>8.1f} "
+                    f"{record['mean_ms']:>8.1f}",
+                    file=sys.stderr,
+                )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
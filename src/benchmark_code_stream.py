@@ -0,0 +1,180 @@
+"""
+Cost of finding the code blocks of a message, whole or while it streams.
+
+Every input is about `--size` characters and is parsed with:
+
+- `regex`: the regular expression of `extract_markdown_code_blocks` over
+  the complete message, what 05 and 08 do once the message has arrived,
+- `regex_per_delta`: the same expression over everything received so far
+  after every delta, the simple way to find blocks while streaming,
+- `parser`: FenceParser of code_stream.py fed the message in deltas of
+  `--delta-chars` characters (about one token each by default).
+
+The inputs are a typical message with prose and blocks (`message`), many
+small blocks (`many_blocks`), a fence that is never closed (`unclosed`),
+runs of backticks that never form a fence (`backticks`) and a fence
+followed by a long run of blank lines (`blank_lines`). The blocks found by
+each method are checked to be the same. `regex_per_delta` is quadratic in
+the message length, so it is skipped above `--max-rescan-size`. Results are
+written as JSON Lines to stdout or `--output`, and a table to stderr:
+
+    python benchmark_code_stream.py --size 200000 --delta-chars 4
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from code_stream import CODE_BLOCK, FenceParser
+
+INPUTS = ("message", "many_blocks", "unclosed", "backticks", "blank_lines")
+METHODS = ("regex", "regex_per_delta", "parser")
+
+PROSE = (
+    "The script below downloads the prices, computes the daily returns "
+    "and saves the plot to `returns.png`.\n\n"
+)
+CODE = (
+    "import numpy as np\n"
+    "returns = np.diff(prices) / prices[:-1]\n"
+    "print(f'mean return: {returns.mean():.4f}')\n"
+)
+
+
+def make_input(name: str, size: int) -> str:
+    if name == "message":
+        block = f"{PROSE}```python\n{CODE * 20}```\n\n"
+    elif name == "many_blocks":
+        block = f"```python\n{CODE}```\n"
+    elif name == "unclosed":
+        return f"{PROSE}```python\n" + CODE * (size // len(CODE))
+    elif name == "backticks":
+        block = "`` ``` `x` ````` "
+    else:
+        return "```" + "\n" * size + "print(1)\n```"
+    return block * max(size // len(block), 1)
+
+
+def deltas(text: str, delta_chars: int) -> List[str]:
+    return [
+        text[start : start + delta_chars]
+        for start in range(0, len(text), delta_chars)
+    ]
+
+
+def regex(text: str, delta_chars: int) -> List[Tuple[str, str]]:
+    return [(language, code) for language, code in CODE_BLOCK.findall(text)]
+
+
+def regex_per_delta(text: str, delta_chars: int) -> List[Tuple[str, str]]:
+    received = ""
+    found: List[Tuple[str, str]] = []
+    for delta in deltas(text, delta_chars):
+        received += delta
+        found = regex(received, delta_chars)
+    return found
+
+
+def parser(text: str, delta_chars: int) -> List[Tuple[str, str]]:
+    fence_parser = FenceParser()
+    found: List[Tuple[str, str]] = []
+    for delta in deltas(text, delta_chars):
+        for code_block in fence_parser.feed(delta):
+            found.append((code_block.language, code_block.code))
+    return found
+
+
+def measure(
+    method: Callable[[str, int], List[Tuple[str, str]]],
+    text: str,
+    delta_chars: int,
+    repeat: int,
+) -> Tuple[List[Tuple[str, str]], List[float]]:
+    timings: List[float] = []
+    found: List[Tuple[str, str]] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        found = method(text, delta_chars)
+        timings.append((time.perf_counter() - started) * 1000)
+    return found, timings
+
+
+def main() -> None:
+    arguments = argparse.ArgumentParser(
+        description="Compare the regex and the streaming fence parser."
+    )
+    arguments.add_argument(
+        "--inputs",
+        default=",".join(INPUTS),
+        help=f"Comma-separated subset of {', '.join(INPUTS)}.",
+    )
+    arguments.add_argument("--size", type=int, default=200_000)
+    arguments.add_argument("--delta-chars", type=int, default=4)
+    arguments.add_argument("--repeat", type=int, default=5)
+    arguments.add_argument(
+        "--max-rescan-size",
+        type=int,
+        default=50_000,
+        help="Largest input that regex_per_delta is run on.",
+    )
+    arguments.add_argument("--output", help="JSON Lines file; default stdout.")
+    args = arguments.parse_args()
+
+    names = args.inputs.split(",")
+    for name in names:
+        if name not in INPUTS:
+            arguments.error(f"Unknown input: {name}")
+    methods: Dict[str, Callable[[str, int], Any]] = {
+        "regex": regex,
+        "regex_per_delta": regex_per_delta,
+        "parser": parser,
+    }
+    output = open(args.output, "w") if args.output else sys.stdout
+    print(
+        f"{'input':<12} {'method':<16} {'blocks':>6} {'median ms':>10} "
+        f"{'MB/s':>8}",
+        file=sys.stderr,
+    )
+    try:
+        for name in names:
+            text = make_input(name, args.size)
+            expected = None
+            for method in METHODS:
+                if (
+                    method == "regex_per_delta"
+                    and len(text) > args.max_rescan_size
+                ):
+                    continue
+                found, timings = measure(
+                    methods[method], text, args.delta_chars, args.repeat
+                )
+                if expected is None:
+                    expected = found
+                elif found != expected:
+                    raise RuntimeError(f"{method} differs on {name}")
+                median = statistics.median(timings)
+                record = {
+                    "input": name,
+                    "method": method,
+                    "chars": len(text),
+                    "delta_chars": args.delta_chars,
+                    "blocks": len(found),
+                    "median_ms": round(median, 3),
+                    "mb_per_s": round(len(text) / 1000 / median, 2),
+                }
+                print(json.dumps(record), file=output, flush=True)
+                print(
+                    f"{name:<12} {method:<16} {len(found):>6} "
+                    f"{median:>10.2f} {record['mb_per_s']:>8.2f}",
+                    file=sys.stderr,
+                )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+"""
+Orchestration overhead benchmark for the three agent runtimes in this repo.
+
+Equivalent conversations are run on:
+
+- `round_robin`: autogen-agentchat RoundRobinGroupChat of AssistantAgents
+  (02/03/04),
+- `routed_agent`: autogen-core SingleThreadedAgentRuntime with RoutedAgents
+  that pass a message around a ring (05/08),
+- `sk_group_chat`: Semantic Kernel AgentGroupChat of ChatCompletionAgents
+  (09).
+
+Every agent talks to an in-process model stub that answers immediately, so
+the measured time is the cost of the orchestration itself. Each scenario
+runs in its own subprocess so that peak RSS belongs to that scenario alone.
+For every runtime, agent count and conversation length the benchmark
+reports:
+
+- `per_turn_ms`: median wall time per agent turn,
+- `messages_per_second`: agent messages produced per second,
+- `setup_ms`: time to create the runtime and agents,
+- `peak_rss_mb`: peak resident set size of the scenario process, including
+  the interpreter and imports,
+- `alloc_peak_bytes` / `alloc_bytes_per_turn`: peak Python allocations
+  during one conversation (traced in a separate run, since tracemalloc
+  slows everything down).
+
+Results are written as JSON Lines (one object per scenario) to stdout or
+`--output`, and a summary table to stderr:
+
+    python benchmark_orchestration.py --agents 2,4,8 --turns 10,50,200 \
+        --output orchestration.jsonl
+"""
+
+import argparse
+import asyncio
+import importlib.metadata
+import json
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+from dataclasses import dataclass
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+)
+
+from autogen_core import CancellationToken
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelCapabilities,  # type: ignore
+    ModelInfo,
+    RequestUsage,
+)
+from autogen_core.tools import Tool, ToolSchema
+
+RUNTIMES = ("round_robin", "routed_agent", "sk_group_chat")
+REPLY = "Noted, passing it on."
+SYSTEM_MESSAGE = "You are one of several agents taking turns."
+
+Conversation = Callable[[], Awaitable[int]]
+
+
+class StubChatCompletionClient(ChatCompletionClient):
+    """An autogen model client that answers every request immediately."""
+
+    def __init__(self, reply: str = REPLY) -> None:
+        self._reply = reply
+        self._usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        # A real client suspends on I/O; keep that scheduling point.
+        await asyncio.sleep(0)
+        usage = RequestUsage(prompt_tokens=len(messages), completion_tokens=1)
+        self._usage = RequestUsage(
+            prompt_tokens=self._usage.prompt_tokens + usage.prompt_tokens,
+            completion_tokens=self._usage.completion_tokens + 1,
+        )
+        return CreateResult(
+            finish_reason="stop",
+            content=self._reply,
+            usage=usage,
+            cached=False,
+        )
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        yield await self.create(messages)
+
+    def actual_usage(self) -> RequestUsage:
+        return self._usage
+
+    def total_usage(self) -> RequestUsage:
+        return self._usage
+
+    def count_tokens(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+    ) -> int:
+        return len(messages)
+
+    def remaining_tokens(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+    ) -> int:
+        return 128000 - len(messages)
+
+    @property
+    def capabilities(self) -> ModelCapabilities:  # type: ignore
+        warnings.warn(
+            "capabilities is deprecated, use model_info instead",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return self.model_info  # type: ignore
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return ModelInfo(
+            vision=False,
+            function_calling=False,
+            json_output=False,
+            family="unknown",
+        )
+
+
+async def round_robin(agents: int, turns: int) -> Conversation:
+    from autogen_agentchat.agents import AssistantAgent
+    from autogen_agentchat.conditions import MaxMessageTermination
+    from autogen_agentchat.teams import RoundRobinGroupChat
+
+    client = StubChatCompletionClient()
+    team = RoundRobinGroupChat(
+        [
+            AssistantAgent(
+                name=f"agent_{i}",
+                model_client=client,
+                system_message=SYSTEM_MESSAGE,
+            )
+            for i in range(agents)
+        ],
+        # The task message counts towards the limit.
+        termination_condition=MaxMessageTermination(turns + 1),
+    )
+
+    async def run() -> int:
+        result = await team.run(task="Start the conversation.")
+        return len(result.messages) - 1
+
+    return run
+
+
+async def routed_agent(agents: int, turns: int) -> Conversation:
+    from autogen_core import (
+        MessageContext,
+        RoutedAgent,
+        SingleThreadedAgentRuntime,
+        TopicId,
+        TypeSubscription,
+        message_handler,
+    )
+    from autogen_core.models import (
+        AssistantMessage,
+        SystemMessage,
+        UserMessage,
+    )
+
+    @dataclass
+    class Turn:
+        content: str
+        remaining: int
+
+    produced = [0]
+
+    class RingAgent(RoutedAgent):
+        """Answers like the Assistant in 05 and hands on to the next agent."""
+
+        def __init__(
+            self, model_client: ChatCompletionClient, next_topic: str
+        ) -> None:
+            super().__init__("A benchmark agent.")
+            self._model_client = model_client
+            self._next_topic = next_topic
+            self._chat_history: List[LLMMessage] = [
+                SystemMessage(content=SYSTEM_MESSAGE)
+            ]
+
+        @message_handler
+        async def handle_turn(
+            self, message: Turn, ctx: MessageContext
+        ) -> None:
+            self._chat_history.append(
+                UserMessage(content=message.content, source="peer")
+            )
+            result = await self._model_client.create(self._chat_history)
+            self._chat_history.append(
+                AssistantMessage(content=result.content, source=self.id.type)
+            )  # type: ignore
+            produced[0] += 1
+            if message.remaining > 1:
+                await self.publish_message(
+                    Turn(result.content, message.remaining - 1),  # type: ignore
+                    TopicId(self._next_topic, "default"),
+                )
+
+    client = StubChatCompletionClient()
+    runtime = SingleThreadedAgentRuntime()
+    for i in range(agents):
+        agent_type = f"agent_{i}"
+        next_topic = f"agent_{(i + 1) % agents}"
+        await RingAgent.register(
+            runtime,
+            agent_type,
+            lambda next_topic=next_topic: RingAgent(client, next_topic),
+        )
+        await runtime.add_subscription(
+            TypeSubscription(topic_type=agent_type, agent_type=agent_type)
+        )
+
+    async def run() -> int:
+        runtime.start()
+        await runtime.publish_message(
+            Turn("Start the conversation.", turns),
+            TopicId("agent_0", "default"),
+        )
+        await runtime.stop_when_idle()
+        return produced[0]
+
+    return run
+
+
+async def sk_group_chat(agents: int, turns: int) -> Conversation:
+    from semantic_kernel.agents import AgentGroupChat, ChatCompletionAgent
+    from semantic_kernel.agents.strategies import DefaultTerminationStrategy
+    from semantic_kernel.connectors.ai.chat_completion_client_base import (
+        ChatCompletionClientBase,
+    )
+    from semantic_kernel.contents import AuthorRole, ChatMessageContent
+    from semantic_kernel.kernel import Kernel
+
+    class StubChatCompletion(ChatCompletionClientBase):
+        """A Semantic Kernel chat service that answers immediately."""
+
+        async def _inner_get_chat_message_contents(
+            self, chat_history: Any, settings: Any
+        ) -> List[ChatMessageContent]:
+            await asyncio.sleep(0)
+            return [
+                ChatMessageContent(
+                    role=AuthorRole.ASSISTANT,
+                    content=REPLY,
+                    ai_model_id=self.ai_model_id,
+                )
+            ]
+
+    members = []
+    for i in range(agents):
+        kernel = Kernel()
+        kernel.add_service(
+            StubChatCompletion(service_id="stub", ai_model_id="stub")
+        )
+        members.append(
+            ChatCompletionAgent(
+                name=f"agent_{i}", kernel=kernel, instructions=SYSTEM_MESSAGE
+            )
+        )
+    group_chat = AgentGroupChat(
+        agents=members,
+        termination_strategy=DefaultTerminationStrategy(
+            maximum_iterations=turns
+        ),
+    )
+
+    async def run() -> int:
+        await group_chat.add_chat_message("Start the conversation.")
+        produced = 0
+        async for _ in group_chat.invoke():
+            produced += 1
+        return produced
+
+    return run
+
+
+SCENARIOS: Dict[str, Callable[[int, int], Awaitable[Conversation]]] = {
+    "round_robin": round_robin,
+    "routed_agent": routed_agent,
+    "sk_group_chat": sk_group_chat,
+}
+
+
+async def measure(
+    runtime: str, agents: int, turns: int, repeats: int
+) -> Dict[str, Any]:
+    """Run one scenario in this process and return its measurements."""
+    scenario = SCENARIOS[runtime]
+    # Warm up imports and first-call caches outside the measurement.
+    await (await scenario(agents, min(turns, agents)))()
+
+    durations: List[float] = []
+    setups: List[float] = []
+    messages = 0
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run = await scenario(agents, turns)
+        setups.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        messages = await run()
+        durations.append(time.perf_counter() - started)
+
+    run = await scenario(agents, turns)
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    await run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    duration = statistics.median(durations)
+    return {
+        "runtime": runtime,
+        "agents": agents,
+        "turns": turns,
+        "messages": messages,
+        "repeats": repeats,
+        "wall_seconds": round(duration, 6),
+        "per_turn_ms": round(duration / max(messages, 1) * 1000, 4),
+        "messages_per_second": round(messages / duration, 1),
+        "setup_ms": round(statistics.median(setups) * 1000, 3),
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+        "alloc_peak_bytes": peak - baseline,
+        "alloc_bytes_per_turn": (peak - baseline) // max(messages, 1),
+    }
+
+
+def environment() -> Dict[str, str]:
+    versions = {"python": platform.python_version()}
+    for package in ("autogen-agentchat", "autogen-core", "semantic-kernel"):
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = "missing"
+    return versions
+
+
+def run_isolated(
+    runtime: str, agents: int, turns: int, repeats: int
+) -> Dict[str, Any]:
+    """Run one scenario in a fresh interpreter."""
+    completed = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--scenario",
+            f"{runtime}:{agents}:{turns}",
+            "--repeats",
+            str(repeats),
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _ints(value: str) -> List[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark orchestration overhead per agent runtime."
+    )
+    parser.add_argument(
+        "--runtimes",
+        default=",".join(RUNTIMES),
+        help=f"Comma-separated subset of {', '.join(RUNTIMES)}.",
+    )
+    parser.add_argument("--agents", type=_ints, default=[2, 4, 8])
+    parser.add_argument("--turns", type=_ints, default=[10, 50, 200])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="JSON Lines file; default stdout.")
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Run all scenarios here; peak RSS is then cumulative.",
+    )
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    if args.scenario:
+        runtime, agents, turns = args.scenario.split(":")
+        record = asyncio.run(
+            measure(runtime, int(agents), int(turns), args.repeats)
+        )
+        print(json.dumps(record))
+        return
+
+    runtimes = args.runtimes.split(",")
+    for runtime in runtimes:
+        if runtime not in SCENARIOS:
+            parser.error(f"Unknown runtime: {runtime}")
+    output = open(args.output, "w") if args.output else sys.stdout
+    versions = environment()
+    print(
+        f"{'runtime':<14} {'agents':>6} {'turns':>6} {'ms/turn':>9} "
+        f"{'msgs/s':>9} {'rss MB':>7} {'alloc B/turn':>12}",
+        file=sys.stderr,
+    )
+    try:
+        for runtime in runtimes:
+            for agents in args.agents:
+                for turns in args.turns:
+                    if args.in_process:
+                        record = asyncio.run(
+                            measure(runtime, agents, turns, args.repeats)
+                        )
+                    else:
+                        record = run_isolated(
+                            runtime, agents, turns, args.repeats
+                        )
+                    record.update(versions)
+                    print(json.dumps(record), file=output, flush=True)
+                    print(
+                        f"{runtime:<14} {agents:>6} {turns:>6} "
+                        f"{record['per_turn_ms']:>9.3f} "
+                        f"{record['messages_per_second']:>9.1f} "
+                        f"{record['peak_rss_mb']:>7.1f} "
+                        f"{record['alloc_bytes_per_turn']:>12}",
+                        file=sys.stderr,
+                    )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
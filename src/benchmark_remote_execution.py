@@ -0,0 +1,302 @@
+"""
+Latency and throughput of remote code execution under concurrent load.
+
+Runs `--conversations` conversations at the same time, each sending
+`--messages` messages of `--blocks-per-message` code blocks one after
+another (like the fix-and-retry turns of 05), against:
+
+- `local`: LocalCommandLineCodeExecutor, a new interpreter per block (04
+  and 05),
+- `remote`: the RemoteExecutor of dynamic_sessions.py, one session per
+  conversation and one request per block (08),
+- `remote_batched`: the same with `batch=True`, one request per message
+  (REMOTE_BATCHING=1 in 08),
+- `sk`: the SessionsPythonTool of Semantic Kernel (09), one tool and one
+  session per conversation.
+
+`remote`, `remote_batched` and `sk` talk https to fake_sessions_server.py,
+which is started in the process with a self-signed certificate and the
+`--cold-start` and `--latency` distributions (see fake_model_server.py for
+their syntax), so the clients can be compared offline with the same
+simulated service delays. The first block of a conversation stores a value
+and the following ones read it back, which checks that the state of a
+session is kept. For every executor the benchmark reports the first message
+of each conversation (including the cold start), the median, p95 and mean of
+the following ones, and the blocks per second of the whole run. Results are
+written as JSON Lines to stdout or `--output`, and a table to stderr:
+
+    python benchmark_remote_execution.py --conversations 8 --messages 10 \
+        --blocks-per-message 5 --cold-start lognormal:1,0.3 \
+        --latency const:0.05
+"""
+
+import argparse
+import asyncio
+import json
+import ssl
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import httpx
+from autogen_core import CancellationToken
+from autogen_core.code_executor import CodeBlock, CodeExecutor
+from autogen_ext.code_executors.local import LocalCommandLineCodeExecutor
+from semantic_kernel.core_plugins.sessions_python_tool.sessions_python_plugin import (
+    SessionsPythonTool,
+)
+from semantic_kernel.core_plugins.sessions_python_tool.sessions_python_settings import (
+    SessionsPythonSettings,
+)
+
+from dynamic_sessions import DynamicSessionsPool, static_token_provider
+from fake_model_server import parse_distribution, running_app
+from fake_sessions_server import (
+    FakeSessionsSettings,
+    create_app,
+    self_signed_certificate,
+)
+
+EXECUTORS = ("local", "remote", "remote_batched", "sk")
+ACCESS_TOKEN = "benchmark"
+
+# Run the blocks of a message; raises if one failed.
+RunBlocks = Callable[[List[str]], Awaitable[None]]
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(percentile * len(ordered)), len(ordered) - 1)]
+
+
+def _code(conversation: int, message: int, block: int) -> str:
+    # Local blocks run in new interpreters, so they keep state in a file.
+    if message == 0 and block == 0:
+        return (
+            f"state = {conversation}\n"
+            "open('state.txt', 'w').write(str(state))\n"
+            "print(sum(range(1000)))\n"
+        )
+    return (
+        "state = int(open('state.txt').read())\n"
+        f"assert state == {conversation}, state\n"
+        "print(sum(range(1000)))\n"
+    )
+
+
+async def _conversation(
+    run_blocks: RunBlocks, conversation: int, messages: int, blocks: int
+) -> List[float]:
+    timings: List[float] = []
+    for message in range(messages):
+        code = [_code(conversation, message, block) for block in range(blocks)]
+        started = time.perf_counter()
+        await run_blocks(code)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+async def measure(
+    name: str,
+    url: str,
+    ssl_context: ssl.SSLContext,
+    work_dir: str,
+    conversations: int,
+    messages: int,
+    blocks: int,
+) -> Dict[str, Any]:
+    clients: List[httpx.AsyncClient] = []
+    runners: List[RunBlocks] = []
+    if name.startswith("remote"):
+        client = httpx.AsyncClient(
+            verify=ssl_context,
+            limits=httpx.Limits(max_connections=None),
+        )
+        clients.append(client)
+        pool = DynamicSessionsPool(
+            url,
+            access_token_provider=static_token_provider(ACCESS_TOKEN),
+            http_client=client,
+        )
+    for conversation in range(conversations):
+        if name == "local":
+            directory = Path(work_dir) / f"conversation_{conversation}"
+            directory.mkdir(exist_ok=True)
+            runners.append(_local_runner(directory))
+        elif name.startswith("remote"):
+            runners.append(
+                _remote_runner(
+                    pool, f"{name}-{conversation}", name == "remote_batched"
+                )
+            )
+        else:
+            client = httpx.AsyncClient(verify=ssl_context, timeout=60)
+            clients.append(client)
+            runners.append(_sk_runner(url, client, conversation))
+    started = time.perf_counter()
+    try:
+        results = await asyncio.gather(
+            *(
+                _conversation(run_blocks, conversation, messages, blocks)
+                for conversation, run_blocks in enumerate(runners)
+            )
+        )
+    finally:
+        for client in clients:
+            await client.aclose()
+    seconds = time.perf_counter() - started
+    first = [timings[0] for timings in results]
+    rest = [ms for timings in results for ms in timings[1:]] or first
+    return {
+        "executor": name,
+        "conversations": conversations,
+        "messages": messages,
+        "blocks_per_message": blocks,
+        "first_ms": round(statistics.median(first), 2),
+        "p50_ms": round(_percentile(rest, 0.5), 2),
+        "p95_ms": round(_percentile(rest, 0.95), 2),
+        "mean_ms": round(statistics.mean(rest), 2),
+        "blocks_per_s": round(conversations * messages * blocks / seconds, 2),
+    }
+
+
+def _executor_runner(executor: CodeExecutor) -> RunBlocks:
+    async def run_blocks(code: List[str]) -> None:
+        result = await executor.execute_code_blocks(
+            [CodeBlock(block, "python") for block in code],
+            CancellationToken(),
+        )
+        if result.exit_code != 0:
+            raise RuntimeError(f"execution failed: {result.output}")
+
+    return run_blocks
+
+
+def _local_runner(directory: Path) -> RunBlocks:
+    return _executor_runner(LocalCommandLineCodeExecutor(work_dir=directory))
+
+
+def _remote_runner(
+    pool: DynamicSessionsPool, conversation: str, batch: bool
+) -> RunBlocks:
+    return _executor_runner(pool.executor(conversation, batch))
+
+
+def _sk_runner(
+    url: str, client: httpx.AsyncClient, conversation: int
+) -> RunBlocks:
+    # The tool keeps the code and headers of a request on itself and its
+    # client, so every conversation needs its own, as in 09.
+    tool = SessionsPythonTool(
+        pool_management_endpoint=url,
+        auth_callback=lambda: ACCESS_TOKEN,
+        settings=SessionsPythonSettings(
+            identifier=f"benchmark-sk-{conversation}"
+        ),
+        http_client=client,
+    )
+
+    async def run_blocks(code: List[str]) -> None:
+        for block in code:
+            output = await tool.execute_code(block)
+            if not output.startswith("Status:\nSuccess"):
+                raise RuntimeError(f"sk failed: {output}")
+
+    return run_blocks
+
+
+def _server(
+    args: argparse.Namespace, work_dir: str
+) -> Tuple[FakeSessionsSettings, Dict[str, str], ssl.SSLContext]:
+    settings = FakeSessionsSettings(
+        cold_start=parse_distribution(args.cold_start),
+        latency=parse_distribution(args.latency),
+        max_sessions=2 * args.conversations * len(EXECUTORS),
+    )
+    cert_file, key_file = self_signed_certificate(
+        str(Path(work_dir) / "certificate")
+    )
+    ssl_context = ssl.create_default_context(cafile=cert_file)
+    return (
+        settings,
+        {"ssl_certfile": cert_file, "ssl_keyfile": key_file},
+        ssl_context,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load-test local and remote code execution."
+    )
+    parser.add_argument(
+        "--executors",
+        default=",".join(EXECUTORS),
+        help=f"Comma-separated subset of {', '.join(EXECUTORS)}.",
+    )
+    parser.add_argument("--conversations", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=10)
+    parser.add_argument("--blocks-per-message", type=int, default=1)
+    parser.add_argument(
+        "--cold-start",
+        default="0",
+        help="Distribution of the delay of a new session, in seconds.",
+    )
+    parser.add_argument(
+        "--latency",
+        default="0",
+        help="Distribution of the delay of every request, in seconds.",
+    )
+    parser.add_argument("--output", help="JSON Lines file; default stdout.")
+    args = parser.parse_args()
+
+    names = args.executors.split(",")
+    for name in names:
+        if name not in EXECUTORS:
+            parser.error(f"Unknown executor: {name}")
+    output = open(args.output, "w") if args.output else sys.stdout
+    print(
+        f"{'executor':<14} {'first ms':>9} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'mean ms':>8} {'blocks/s':>9}",
+        file=sys.stderr,
+    )
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            settings, ssl_files, ssl_context = _server(args, work_dir)
+            app = create_app(settings)
+            with running_app(app, **ssl_files) as url:
+                for name in names:
+                    record = asyncio.run(
+                        measure(
+                            name,
+                            url,
+                            ssl_context,
+                            work_dir,
+                            args.conversations,
+                            args.messages,
+                            args.blocks_per_message,
+                        )
+                    )
+                    record["cold_start"] = args.cold_start
+                    record["latency"] = args.latency
+                    print(json.dumps(record), file=output, flush=True)
+                    print(
+                        f"{name:<14} {record['first_ms']:>9.1f} "
+                        f"{record['p50_ms']:>8.1f} {record['p95_ms']:>8.1f} "
+                        f"{record['mean_ms']:>8.1f} "
+                        f"{record['blocks_per_s']:>9.1f}",
+                        file=sys.stderr,
+                    )
+                print(
+                    f"server: {json.dumps(app.state.stats.__dict__)}",
+                    file=sys.stderr,
+                )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
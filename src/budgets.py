@@ -0,0 +1,277 @@
+"""
+Token, cost and wall-clock budgets for agent runs, with per-agent usage.
+
+The teams of 02-04 stop only when "FINISH" is mentioned, and the Assistant
+and Executor of 05 have no termination at all, so a misbehaving pair of
+agents can go on for hundreds of turns. A Budget bounds a run by cumulative
+prompt, completion and total tokens, estimated cost and wall-clock time.
+Usage is aggregated per agent from `RequestUsage` in a UsageLedger.
+
+- BudgetTermination is a termination condition for autogen-agentchat teams
+  and composes with the others:
+  `TextMentionTermination("FINISH") | BudgetTermination(**run_budget)`.
+  It stops the run with the message that exceeds a token or cost budget;
+  the time budget is checked whenever a message arrives.
+- BudgetGuard is an intervention handler for the autogen-core runtime of
+  05: once the budget is exceeded, the agents' messages no longer reach
+  each other, so the runtime goes idle and `stop_when_idle()` returns.
+  Agents record their model usage in the guard's ledger.
+
+The defaults come from `settings.run_budget`; cost is estimated with
+`settings.model_price_per_1k_tokens`.
+"""
+
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Sequence
+
+from autogen_agentchat.base import TerminatedException, TerminationCondition
+from autogen_agentchat.messages import AgentEvent, ChatMessage, StopMessage
+from autogen_core import (
+    Component,
+    DefaultInterventionHandler,
+    MessageContext,
+)
+from autogen_core.models import RequestUsage
+from pydantic import BaseModel
+from typing_extensions import Self
+
+from settings import model_price_per_1k_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class Budget(BaseModel):
+    """Limits of one run; None means unlimited. Cost is in USD."""
+
+    max_prompt_tokens: Optional[int] = None
+    max_completion_tokens: Optional[int] = None
+    max_total_tokens: Optional[int] = None
+    max_cost: Optional[float] = None
+    max_seconds: Optional[float] = None
+    prompt_price_per_1k: float = model_price_per_1k_tokens["prompt"]
+    completion_price_per_1k: float = model_price_per_1k_tokens["completion"]
+
+    def cost(self, usage: RequestUsage) -> float:
+        return (
+            usage.prompt_tokens * self.prompt_price_per_1k
+            + usage.completion_tokens * self.completion_price_per_1k
+        ) / 1000
+
+
+@dataclass
+class AgentUsage:
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def usage(self) -> RequestUsage:
+        return RequestUsage(
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+        )
+
+
+@dataclass
+class UsageLedger:
+    """Model usage per agent, and the time since the first record."""
+
+    agents: Dict[str, AgentUsage] = field(default_factory=dict)
+    started: Optional[float] = None
+
+    def start(self) -> None:
+        if self.started is None:
+            self.started = time.monotonic()
+
+    def record(self, agent: str, usage: RequestUsage) -> None:
+        self.start()
+        entry = self.agents.setdefault(agent, AgentUsage())
+        entry.calls += 1
+        entry.prompt_tokens += usage.prompt_tokens
+        entry.completion_tokens += usage.completion_tokens
+
+    @property
+    def total(self) -> RequestUsage:
+        return RequestUsage(
+            prompt_tokens=sum(a.prompt_tokens for a in self.agents.values()),
+            completion_tokens=sum(
+                a.completion_tokens for a in self.agents.values()
+            ),
+        )
+
+    @property
+    def elapsed(self) -> float:
+        return 0.0 if self.started is None else time.monotonic() - self.started
+
+    def exceeded(self, budget: Budget) -> Optional[str]:
+        """Why the budget is exceeded, or None while it is not."""
+        total = self.total
+        checks = [
+            ("prompt tokens", total.prompt_tokens, budget.max_prompt_tokens),
+            (
+                "completion tokens",
+                total.completion_tokens,
+                budget.max_completion_tokens,
+            ),
+            (
+                "total tokens",
+                total.prompt_tokens + total.completion_tokens,
+                budget.max_total_tokens,
+            ),
+            ("cost", budget.cost(total), budget.max_cost),
+            ("wall-clock seconds", self.elapsed, budget.max_seconds),
+        ]
+        for name, used, limit in checks:
+            if limit is not None and used >= limit:
+                return f"Budget exceeded: {name} {used:.4g} >= {limit:.4g}."
+        return None
+
+    def report(self, budget: Budget) -> str:
+        """A table of calls, tokens and estimated cost per agent."""
+        lines = [
+            f"{'agent':<20} {'calls':>6} {'prompt':>9} {'completion':>11} "
+            f"{'cost USD':>9}"
+        ]
+        rows = [*self.agents.items(), ("total", self._total_entry())]
+        for name, entry in rows:
+            lines.append(
+                f"{name:<20} {entry.calls:>6} {entry.prompt_tokens:>9} "
+                f"{entry.completion_tokens:>11} "
+                f"{budget.cost(entry.usage):>9.4f}"
+            )
+        lines.append(f"wall clock: {self.elapsed:.1f} s")
+        return "\n".join(lines)
+
+    def _total_entry(self) -> AgentUsage:
+        total = self.total
+        return AgentUsage(
+            calls=sum(a.calls for a in self.agents.values()),
+            prompt_tokens=total.prompt_tokens,
+            completion_tokens=total.completion_tokens,
+        )
+
+
+class BudgetTermination(TerminationCondition, Component[Budget]):
+    """
+    Terminate a team run once a token, cost or time budget is exceeded.
+
+    The arguments are the limits of Budget; None means unlimited. `usage`
+    holds the ledger of the current run. Teams reset their termination
+    condition when a run ends, so the ledger of the finished run is kept as
+    `last_usage`.
+    """
+
+    component_config_schema = Budget
+
+    def __init__(
+        self,
+        max_prompt_tokens: Optional[int] = None,
+        max_completion_tokens: Optional[int] = None,
+        max_total_tokens: Optional[int] = None,
+        max_cost: Optional[float] = None,
+        max_seconds: Optional[float] = None,
+        prompt_price_per_1k: float = model_price_per_1k_tokens["prompt"],
+        completion_price_per_1k: float = model_price_per_1k_tokens[
+            "completion"
+        ],
+    ) -> None:
+        self._budget = Budget(
+            max_prompt_tokens=max_prompt_tokens,
+            max_completion_tokens=max_completion_tokens,
+            max_total_tokens=max_total_tokens,
+            max_cost=max_cost,
+            max_seconds=max_seconds,
+            prompt_price_per_1k=prompt_price_per_1k,
+            completion_price_per_1k=completion_price_per_1k,
+        )
+        self.usage = UsageLedger()
+        self.last_usage = UsageLedger()
+        self._reason: Optional[str] = None
+
+    @property
+    def budget(self) -> Budget:
+        return self._budget
+
+    @property
+    def terminated(self) -> bool:
+        return self._reason is not None
+
+    def report(self) -> str:
+        """Usage per agent of the last finished run."""
+        return self.last_usage.report(self._budget)
+
+    async def __call__(
+        self, messages: Sequence[AgentEvent | ChatMessage]
+    ) -> StopMessage | None:
+        if self.terminated:
+            raise TerminatedException(
+                "Termination condition has already been reached"
+            )
+        self.usage.start()
+        for message in messages:
+            if message.models_usage is not None:
+                self.usage.record(message.source, message.models_usage)
+        self._reason = self.usage.exceeded(self._budget)
+        if self._reason is None:
+            return None
+        return StopMessage(content=self._reason, source="BudgetTermination")
+
+    async def reset(self) -> None:
+        if self.usage.started is not None:
+            self.last_usage = self.usage
+        self.usage = UsageLedger()
+        self._reason = None
+
+    def _to_config(self) -> Budget:
+        return self._budget.model_copy()
+
+    @classmethod
+    def _from_config(cls, config: Budget) -> Self:
+        return cls(**config.model_dump())
+
+
+@dataclass
+class BudgetExceeded:
+    """Published by BudgetGuard in place of messages once over budget."""
+
+    reason: str
+
+
+class BudgetGuard(DefaultInterventionHandler):
+    """
+    Stops an autogen-core runtime once a budget is exceeded.
+
+    Agents call `record` with the usage of each model call. After the budget
+    is exceeded, every published message is replaced with a BudgetExceeded
+    notice; RoutedAgents without a handler for it ignore it, so the
+    conversation ends and `stop_when_idle()` returns. Returning DropMessage
+    would be the natural way, but autogen-core 0.4.4 never marks a dropped
+    message as done, so `stop_when_idle()` would wait forever.
+    """
+
+    def __init__(self, budget: Budget) -> None:
+        self.budget = budget
+        self.usage = UsageLedger()
+        self.reason: Optional[str] = None
+        self.stopped_messages = 0
+
+    def record(self, agent: str, usage: RequestUsage) -> None:
+        self.usage.record(agent, usage)
+
+    def report(self) -> str:
+        return self.usage.report(self.budget)
+
+    async def on_publish(
+        self, message: Any, *, message_context: MessageContext
+    ) -> Any:
+        self.usage.start()
+        if self.reason is None:
+            self.reason = self.usage.exceeded(self.budget)
+            if self.reason is not None:
+                logger.warning("%s Stopping the agents.", self.reason)
+        if self.reason is None or isinstance(message, BudgetExceeded):
+            return message
+        self.stopped_messages += 1
+        return BudgetExceeded(self.reason)
@@ -0,0 +1,349 @@
+"""
+Bounded chat history for the RoutedAgent assistants of 05 and 08.
+
+The Assistant used to keep its chat history in a list that grew with every
+turn and was re-sent in full on every `create()`, so prompt tokens, latency
+and memory grew quadratically with the length of the conversation.
+SummarizingChatCompletionContext is an autogen-core ChatCompletionContext
+that keeps it bounded:
+
+- System messages are always kept. Of the others, at most the last `window`
+  messages are kept, and fewer if they do not fit in `max_tokens`
+  (estimated at four characters per token). The latest message is always
+  kept.
+- Messages that fall out of the window are summarized in the background by
+  `summary_client`: one call folds them into a running summary, which is
+  sent after the system messages. `get_messages()` never waits for it; it
+  uses the latest finished summary. When a summary call fails, the previous
+  summary is kept and the messages are summarized with the next ones that
+  are evicted. Without a summary client they are dropped.
+- Output of the executor (user messages whose source is in
+  `output_sources`) longer than `max_output_chars` is trimmed when it is
+  added. The last traceback is kept, with its innermost and outermost
+  frames.
+
+`stats` shows the estimated prompt tokens sent, the tokens the full history
+would have cost and the tokens spent on summaries.
+"""
+
+import asyncio
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, List, Mapping, Optional, Sequence
+
+from autogen_core import Component, ComponentModel
+from autogen_core.model_context import ChatCompletionContext
+from autogen_core.models import (
+    AssistantMessage,
+    ChatCompletionClient,
+    FunctionExecutionResultMessage,
+    LLMMessage,
+    RequestUsage,
+    SystemMessage,
+    UserMessage,
+)
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+TRACEBACK_HEADER = "Traceback (most recent call last):"
+FRAME = re.compile(r'^\s*File "')
+SUMMARY_SOURCE = "summary"
+SUMMARY_PROMPT = (
+    "You maintain a concise summary of a conversation between an assistant "
+    "that writes code and an executor that runs it. Update the summary with "
+    "the new messages. Keep the task, decisions, code that worked, errors "
+    "that are still open and file names. Answer with the summary only."
+)
+
+
+def estimate_tokens(message: LLMMessage) -> int:
+    """About four characters per token, plus a few tokens per message."""
+    content = message.content
+    return len(content if isinstance(content, str) else str(content)) // 4 + 4
+
+
+def trim_traceback(traceback: str, keep_frames: int = 4) -> str:
+    """Keep the first and last frames of a long traceback."""
+    lines = traceback.splitlines()
+    frames = [index for index, line in enumerate(lines) if FRAME.match(line)]
+    if len(frames) <= keep_frames:
+        return traceback
+    first = keep_frames // 2
+    last = keep_frames - first
+    cut_start, cut_end = frames[first], frames[-last]
+    marker = f"  ... [{len(frames) - keep_frames} frames trimmed] ..."
+    return "\n".join(lines[:cut_start] + [marker] + lines[cut_end:])
+
+
+def trim_output(output: str, max_chars: int) -> str:
+    """
+    Shorten executor output to about `max_chars`, keeping the last traceback.
+    """
+    if len(output) <= max_chars:
+        return output
+    start = output.rfind(TRACEBACK_HEADER)
+    traceback = trim_traceback(output[start:]) if start >= 0 else ""
+    before = output[:start] if start >= 0 else output
+    if len(traceback) > max_chars:
+        return _head_and_tail(traceback, max_chars)
+    return _head_and_tail(before, max_chars - len(traceback)) + traceback
+
+
+def _head_and_tail(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    half = max(max_chars // 2, 0)
+    trimmed = len(text) - 2 * half
+    return (
+        f"{text[:half]}\n... [{trimmed} characters trimmed] ...\n"
+        f"{text[len(text) - half :]}"
+    )
+
+
+@dataclass
+class ChatContextStats:
+    sent_tokens: int = 0
+    full_history_tokens: int = 0
+    trimmed_output_chars: int = 0
+    summaries: int = 0
+    failed_summaries: int = 0
+    summary_prompt_tokens: int = 0
+    summary_completion_tokens: int = 0
+
+    @property
+    def saved_tokens(self) -> int:
+        """Estimated prompt tokens saved, net of the summary calls."""
+        return (
+            self.full_history_tokens
+            - self.sent_tokens
+            - self.summary_prompt_tokens
+            - self.summary_completion_tokens
+        )
+
+    def __str__(self) -> str:
+        return (
+            f"sent_tokens={self.sent_tokens} "
+            f"full_history_tokens={self.full_history_tokens} "
+            f"summaries={self.summaries} "
+            f"failed_summaries={self.failed_summaries} "
+            f"summary_tokens="
+            f"{self.summary_prompt_tokens + self.summary_completion_tokens} "
+            f"saved_tokens={self.saved_tokens} "
+            f"trimmed_output_chars={self.trimmed_output_chars}"
+        )
+
+
+class SummarizingChatCompletionContextConfig(BaseModel):
+    summary_client: Optional[ComponentModel] = None
+    window: int = 20
+    max_tokens: int = 12000
+    max_output_chars: int = 4000
+    output_sources: List[str] = ["executor"]
+    initial_messages: Optional[List[LLMMessage]] = None
+
+
+class SummarizingChatCompletionContext(
+    ChatCompletionContext, Component[SummarizingChatCompletionContextConfig]
+):
+    """
+    A chat completion context with a sliding window, a token budget and a
+    running summary of the messages that fell out of it.
+
+    Args:
+        summary_client: Model client that writes the summary; None drops old
+            messages instead.
+        window: Most recent non-system messages to keep.
+        max_tokens: Estimated token budget of the messages returned by
+            `get_messages()`.
+        max_output_chars: Executor output longer than this is trimmed.
+        output_sources: Sources of user messages that are executor output.
+        initial_messages: Messages to start with, e.g. the system message.
+        on_summary_usage: Called with the usage of every summary call, e.g.
+            to add it to a budget.
+    """
+
+    component_config_schema = SummarizingChatCompletionContextConfig
+
+    def __init__(
+        self,
+        summary_client: Optional[ChatCompletionClient] = None,
+        window: int = 20,
+        max_tokens: int = 12000,
+        max_output_chars: int = 4000,
+        output_sources: Sequence[str] = ("executor",),
+        initial_messages: Optional[List[LLMMessage]] = None,
+        on_summary_usage: Optional[Callable[[RequestUsage], None]] = None,
+    ) -> None:
+        super().__init__(initial_messages)
+        self._summary_client = summary_client
+        self._window = window
+        self._max_tokens = max_tokens
+        self._max_output_chars = max_output_chars
+        self._output_sources = list(output_sources)
+        self._on_summary_usage = on_summary_usage
+        self._summary = ""
+        self._evicted: List[LLMMessage] = []
+        self._summarizing: Optional["asyncio.Task[None]"] = None
+        self._history_tokens = sum(map(estimate_tokens, self._messages))
+        self.stats = ChatContextStats()
+
+    async def add_message(self, message: LLMMessage) -> None:
+        self._history_tokens += estimate_tokens(message)
+        if (
+            isinstance(message, UserMessage)
+            and isinstance(message.content, str)
+            and message.source in self._output_sources
+        ):
+            trimmed = trim_output(message.content, self._max_output_chars)
+            self.stats.trimmed_output_chars += len(message.content) - len(
+                trimmed
+            )
+            message = message.model_copy(update={"content": trimmed})
+        self._messages.append(message)
+        self._evict()
+
+    async def get_messages(self) -> List[LLMMessage]:
+        messages = self._system_messages()
+        if self._summary:
+            messages.append(
+                UserMessage(
+                    content="Summary of the earlier conversation:\n"
+                    + self._summary,
+                    source=SUMMARY_SOURCE,
+                )
+            )
+        messages.extend(self._recent_messages())
+        self.stats.sent_tokens += sum(map(estimate_tokens, messages))
+        self.stats.full_history_tokens += self._history_tokens
+        return messages
+
+    async def wait_for_summary(self) -> None:
+        """Wait until the messages evicted so far are summarized."""
+        if self._summarizing is not None:
+            await asyncio.shield(self._summarizing)
+
+    async def clear(self) -> None:
+        await super().clear()
+        if self._summarizing is not None:
+            self._summarizing.cancel()
+        self._summary = ""
+        self._evicted = []
+        self._history_tokens = 0
+
+    async def save_state(self) -> Mapping[str, Any]:
+        return {**await super().save_state(), "summary": self._summary}
+
+    async def load_state(self, state: Mapping[str, Any]) -> None:
+        await super().load_state(state)
+        self._summary = state.get("summary", "")
+        self._history_tokens = sum(map(estimate_tokens, self._messages))
+
+    def _system_messages(self) -> List[LLMMessage]:
+        return [m for m in self._messages if isinstance(m, SystemMessage)]
+
+    def _recent_messages(self) -> List[LLMMessage]:
+        return [m for m in self._messages if not isinstance(m, SystemMessage)]
+
+    def _evict(self) -> None:
+        """Move the oldest messages out of the window and the budget."""
+        fixed = sum(map(estimate_tokens, self._system_messages()))
+        fixed += len(self._summary) // 4 + 4 if self._summary else 0
+        recent = self._recent_messages()
+        tokens = fixed + sum(map(estimate_tokens, recent))
+        evicted = 0
+        while len(recent) - evicted > 1 and (
+            len(recent) - evicted > self._window or tokens > self._max_tokens
+        ):
+            tokens -= estimate_tokens(recent[evicted])
+            evicted += 1
+        # A tool result without its tool call is rejected by the API.
+        while len(recent) - evicted > 1 and isinstance(
+            recent[evicted], FunctionExecutionResultMessage
+        ):
+            evicted += 1
+        if not evicted:
+            return
+        dropped = recent[:evicted]
+        self._messages = self._system_messages() + recent[evicted:]
+        if self._summary_client is None:
+            return
+        self._evicted.extend(dropped)
+        if self._summarizing is None or self._summarizing.done():
+            self._summarizing = asyncio.create_task(self._summarize())
+
+    async def _summarize(self) -> None:
+        assert self._summary_client is not None
+        while self._evicted:
+            batch, self._evicted = self._evicted, []
+            transcript = "\n\n".join(
+                f"{_speaker(message)}: {message.content}" for message in batch
+            )
+            prompt: List[LLMMessage] = [
+                SystemMessage(content=SUMMARY_PROMPT),
+                UserMessage(
+                    content=f"Summary so far:\n{self._summary or '(none)'}\n\n"
+                    f"New messages:\n{transcript}",
+                    source="user",
+                ),
+            ]
+            try:
+                result = await self._summary_client.create(prompt)
+            except Exception as error:
+                # Keep the batch and the previous summary; the batch is
+                # summarized with the messages evicted next.
+                self._evicted = batch + self._evicted
+                self.stats.failed_summaries += 1
+                logger.warning(
+                    "Could not summarize %d messages, will retry: %s",
+                    len(batch),
+                    error,
+                )
+                return
+            if isinstance(result.content, str):
+                self._summary = result.content
+            self.stats.summaries += 1
+            self.stats.summary_prompt_tokens += result.usage.prompt_tokens
+            self.stats.summary_completion_tokens += (
+                result.usage.completion_tokens
+            )
+            if self._on_summary_usage is not None:
+                self._on_summary_usage(result.usage)
+
+    def _to_config(self) -> SummarizingChatCompletionContextConfig:
+        return SummarizingChatCompletionContextConfig(
+            summary_client=(
+                self._summary_client.dump_component()
+                if self._summary_client is not None
+                else None
+            ),
+            window=self._window,
+            max_tokens=self._max_tokens,
+            max_output_chars=self._max_output_chars,
+            output_sources=self._output_sources,
+            initial_messages=self._messages,
+        )
+
+    @classmethod
+    def _from_config(
+        cls, config: SummarizingChatCompletionContextConfig
+    ) -> "SummarizingChatCompletionContext":
+        return cls(
+            summary_client=(
+                ChatCompletionClient.load_component(config.summary_client)
+                if config.summary_client is not None
+                else None
+            ),
+            window=config.window,
+            max_tokens=config.max_tokens,
+            max_output_chars=config.max_output_chars,
+            output_sources=config.output_sources,
+            initial_messages=config.initial_messages,
+        )
+
+
+def _speaker(message: LLMMessage) -> str:
+    if isinstance(message, AssistantMessage):
+        return "assistant"
+    return getattr(message, "source", "tool")
@@ -0,0 +1,240 @@
+"""
+Process-wide pooled chat services.
+
+Every autogen ChatCompletionClient and Semantic Kernel AzureChatCompletion
+created through this module shares one tuned keep-alive HTTP connection pool,
+so several agents or kernels in one process reuse TCP/TLS connections to
+Azure OpenAI instead of each opening their own.
+
+HTTP/2 is used when the optional `h2` package is installed
+(`pip install "httpx[http2]"`); otherwise the pool falls back to HTTP/1.1
+keep-alive.
+
+The pool is bound to the event loop that first uses it, so create clients
+inside the same `asyncio.run(...)` that uses them.
+"""
+
+import contextvars
+import functools
+import importlib.util
+from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncGenerator,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+import httpx
+
+from settings import azure_openai_config
+
+# autogen, openai and Semantic Kernel are imported where they are used, so
+# autogen-only and Semantic Kernel-only scripts do not pay for each other.
+if TYPE_CHECKING:
+    from openai import AsyncAzureOpenAI
+    from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
+    from semantic_kernel.kernel import Kernel
+
+T = TypeVar("T")
+
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY_SECONDS = 120.0
+TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+
+@dataclass
+class ConnectionMetrics:
+    requests: int = 0
+    connections_opened: int = 0
+    tls_handshakes: int = 0
+
+    @property
+    def reused_requests(self) -> int:
+        """Requests served over an already open connection."""
+        return max(self.requests - self.connections_opened, 0)
+
+    def __str__(self) -> str:
+        return (
+            f"requests={self.requests} "
+            f"connections_opened={self.connections_opened} "
+            f"tls_handshakes={self.tls_handshakes} "
+            f"reused_requests={self.reused_requests}"
+        )
+
+
+class _MeteredTransport(httpx.AsyncHTTPTransport):
+    """An HTTP transport that counts requests, new connections and TLS."""
+
+    def __init__(self, metrics: ConnectionMetrics, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._metrics = metrics
+
+    async def handle_async_request(
+        self, request: httpx.Request
+    ) -> httpx.Response:
+        self._metrics.requests += 1
+        request.extensions = {**request.extensions, "trace": self._trace}
+        response = await super().handle_async_request(request)
+        responses = _open_responses.get()
+        if responses is not None:
+            responses.append(response)
+        return response
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self._metrics.connections_opened += 1
+        elif event_name == "connection.start_tls.complete":
+            self._metrics.tls_handshakes += 1
+
+
+_open_responses: contextvars.ContextVar[Optional[List[httpx.Response]]] = (
+    contextvars.ContextVar("open_responses", default=None)
+)
+_metrics = ConnectionMetrics()
+_http_client: Optional[httpx.AsyncClient] = None
+_openai_clients: Dict[Tuple[str, str, str], "AsyncAzureOpenAI"] = {}
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the process-wide HTTP client shared by all chat services."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        limits = httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+        )
+        http2 = http2_available()
+        _http_client = httpx.AsyncClient(
+            transport=_MeteredTransport(_metrics, http2=http2, limits=limits),
+            http2=http2,
+            limits=limits,
+            timeout=TIMEOUT,
+        )
+    return _http_client
+
+
+def connection_metrics() -> ConnectionMetrics:
+    """Counters of the shared pool; reused_requests shows connection reuse."""
+    return _metrics
+
+
+async def closing_stream(
+    stream: AsyncGenerator[T, None],
+) -> AsyncGenerator[T, None]:
+    """
+    Yield the chunks of `stream`, and close the pooled HTTP responses it
+    opened when it is done or closed.
+
+    autogen does not close the response of a stream that is abandoned half
+    way, so the service keeps generating and the connection stays busy.
+    The responses are those opened while waiting for the first chunk, when
+    the stream sends its request, so responses opened elsewhere in the same
+    task are not closed.
+    """
+    responses: List[httpx.Response] = []
+    try:
+        # Set and reset in the same step, so the generator may be finalized
+        # in another context.
+        token = _open_responses.set(responses)
+        try:
+            first_chunk = await stream.__anext__()
+        except StopAsyncIteration:
+            return
+        finally:
+            _open_responses.reset(token)
+        yield first_chunk
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await stream.aclose()
+        for response in responses:
+            await response.aclose()
+
+
+def get_openai_client(
+    endpoint: str, api_key: str, api_version: str
+) -> "AsyncAzureOpenAI":
+    """Return the shared AsyncAzureOpenAI client for one Azure resource."""
+    from openai import AsyncAzureOpenAI
+
+    key = (endpoint, api_key, api_version)
+    if key not in _openai_clients:
+        _openai_clients[key] = AsyncAzureOpenAI(
+            azure_endpoint=endpoint,
+            api_key=api_key,
+            api_version=api_version,
+            http_client=get_http_client(),
+        )
+    return _openai_clients[key]
+
+
+@functools.lru_cache(maxsize=None)
+def _pooled_client_class() -> type:
+    from autogen_ext.models.openai import AzureOpenAIChatCompletionClient
+
+    class PooledAzureOpenAIChatCompletionClient(
+        AzureOpenAIChatCompletionClient
+    ):
+        """
+        AzureOpenAIChatCompletionClient that sends requests over the shared
+        pool.
+
+        Use "chat_services.PooledAzureOpenAIChatCompletionClient" as provider
+        in a component config to get pooling through `load_component`.
+        """
+
+        component_provider_override = (
+            "chat_services.PooledAzureOpenAIChatCompletionClient"
+        )
+
+        def __init__(self, **kwargs: Any) -> None:
+            kwargs.setdefault("http_client", get_http_client())
+            super().__init__(**kwargs)
+
+    PooledAzureOpenAIChatCompletionClient.__module__ = __name__
+    PooledAzureOpenAIChatCompletionClient.__qualname__ = (
+        "PooledAzureOpenAIChatCompletionClient"
+    )
+    return PooledAzureOpenAIChatCompletionClient
+
+
+def __getattr__(name: str) -> Any:
+    # The pooled client class subclasses the autogen OpenAI client, so it is
+    # only built when something (usually `load_component`) asks for it.
+    if name == "PooledAzureOpenAIChatCompletionClient":
+        return _pooled_client_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_azure_chat_completion(service_id: str) -> "AzureChatCompletion":
+    """Create a Semantic Kernel chat service backed by the shared pool."""
+    from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
+
+    config = azure_openai_config.get("config", {})
+    api_version = config.get("api_version", "2024-06-01")
+    return AzureChatCompletion(
+        service_id=service_id,
+        deployment_name=config.get("model", "gpt-4o"),
+        api_version=api_version,
+        async_client=get_openai_client(
+            config.get("azure_endpoint", ""),
+            config.get("api_key", ""),
+            api_version,
+        ),
+    )
+
+
+def setup_chat_service(kernel: "Kernel", service_id: str) -> None:
+    """Set up a chat completion service for the kernel."""
+    kernel.add_service(get_azure_chat_completion(service_id))
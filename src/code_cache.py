@@ -0,0 +1,312 @@
+"""
+Content-addressed cache of code execution results.
+
+Deterministic tasks such as "calculate the 14th Fibonacci number" (04, 05)
+run the same code on every run and on every retry of the agents.
+CachedCodeExecutor sits in front of any CodeExecutor and returns the stored
+result when the same code has run before with the same inputs:
+
+- The key is a SHA-256 over the normalized code of all blocks (line endings,
+  trailing whitespace, blank lines and comments do not count, except the
+  `# filename:` line), their languages, the interpreter and the versions of
+  the installed packages the code imports. A stored result is only reused
+  while the files in `work_dir` that the code mentions and that existed
+  when it ran are unchanged.
+- Only Python code that looks pure is cached. Code that uses the network,
+  the clock, unseeded randomness, subprocesses or input, and every block in
+  another language, always runs. `# cache: off` in a block opts it out, and
+  `# cache: pure` opts it in regardless.
+- Only successful runs are stored. Files the run created or changed in
+  `work_dir` (e.g. plots) are stored with the result and written back on a
+  hit, as are the code files, so later blocks find them.
+- Entries larger than `max_entry_bytes` (output plus files) are not stored.
+  The store evicts the least recently used entries above `max_entries` and
+  entries older than `ttl_seconds` (SQLiteCacheStore of model_cache.py).
+
+The wrapped executor must not keep state between blocks (kernel_pool.py and
+the sessions of dynamic_sessions.py do), since the result would then depend
+on earlier blocks too.
+Enable it with CODE_CACHE_PATH (see settings.py).
+"""
+
+import base64
+import functools
+import hashlib
+import importlib.metadata
+import json
+import platform
+import re
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple, Union
+
+from autogen_core import CancellationToken
+from autogen_core.code_executor import CodeBlock, CodeExecutor, CodeResult
+from autogen_ext.code_executors._common import CommandLineCodeResult
+
+from kernel_pool import PYTHON_LANGUAGES, code_file_path, write_code_file
+from model_cache import SQLiteCacheStore
+from parallel_blocks import imported_modules, mentioned_files
+
+CACHE_OFF = re.compile(r"#\s*cache:\s*off\b")
+CACHE_PURE = re.compile(r"#\s*cache:\s*pure\b")
+# Network, clock, randomness, processes and input make a result depend on
+# more than the code.
+IMPURE = re.compile(
+    r"https?://|\b(?:requests|urllib|httpx|aiohttp|socket|http\.client"
+    r"|yfinance|pandas_datareader|smtplib|ftplib|webbrowser|subprocess"
+    r"|os\.system|os\.popen|os\.urandom|secrets|uuid"
+    r"|time\.time|time\.time_ns|time\.localtime|time\.ctime"
+    r"|datetime\.now|datetime\.utcnow|datetime\.today|date\.today)\b"
+    r"|\binput\("
+)
+RANDOM = re.compile(r"\brandom\b")
+SEED = re.compile(r"\bseed\(")
+COMMENT = re.compile(r"^\s*#")
+
+
+def is_pure(code_block: CodeBlock) -> bool:
+    """Whether the result of a block depends on its code and inputs only."""
+    if CACHE_OFF.search(code_block.code):
+        return False
+    if CACHE_PURE.search(code_block.code):
+        return True
+    if code_block.language.lower() not in PYTHON_LANGUAGES:
+        return False
+    code = code_block.code
+    if IMPURE.search(code):
+        return False
+    return not RANDOM.search(code) or bool(SEED.search(code))
+
+
+def normalize(code: str) -> str:
+    """The code without comments, trailing whitespace and blank lines."""
+    lines = code.replace("\r\n", "\n").split("\n")
+    kept = lines[:1] if lines[0].startswith("# filename:") else []
+    for line in lines[len(kept) :]:
+        line = line.rstrip()
+        if line and not COMMENT.match(line):
+            kept.append(line)
+    return "\n".join(kept)
+
+
+@functools.lru_cache(maxsize=1)
+def _distributions() -> Mapping[str, List[str]]:
+    # Scanning the installed distributions takes a while; do it once.
+    return importlib.metadata.packages_distributions()
+
+
+def package_versions(modules: List[str]) -> Dict[str, str]:
+    """Versions of the installed distributions that provide the modules."""
+    distributions = _distributions()
+    versions: Dict[str, str] = {}
+    for module in modules:
+        for distribution in distributions.get(module, []):
+            try:
+                versions[distribution] = importlib.metadata.version(
+                    distribution
+                )
+            except importlib.metadata.PackageNotFoundError:
+                pass
+    return versions
+
+
+@dataclass
+class CodeCacheStats:
+    hits: int = 0
+    misses: int = 0
+    uncacheable: int = 0
+    too_large: int = 0
+    saved_seconds: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"hits={self.hits} misses={self.misses} "
+            f"uncacheable={self.uncacheable} too_large={self.too_large} "
+            f"saved_seconds={self.saved_seconds:.2f}"
+        )
+
+
+class CachedCodeExecutor(CodeExecutor):
+    """
+    A CodeExecutor that reuses the results of pure code that ran before.
+
+    Args:
+        code_executor: The executor to wrap.
+        path: SQLite file of the cache.
+        max_entries: Most results kept; the least recently used go first.
+        ttl_seconds: Results older than this are run again.
+        max_entry_bytes: Results with more output and files are not stored.
+        work_dir: Directory the executor runs code in; files created there
+            are cached with the result. None for remote executors.
+        interpreter: Identifies the interpreter in the cache key; defaults
+            to the local Python.
+    """
+
+    def __init__(
+        self,
+        code_executor: CodeExecutor,
+        path: str = "./.code_cache/results.sqlite",
+        max_entries: Optional[int] = 1000,
+        ttl_seconds: Optional[float] = None,
+        max_entry_bytes: int = 5_000_000,
+        work_dir: Union[Path, str, None] = None,
+        interpreter: Optional[str] = None,
+    ) -> None:
+        self._code_executor = code_executor
+        self._store = SQLiteCacheStore(path, max_entries, ttl_seconds)
+        self._max_entry_bytes = max_entry_bytes
+        self._work_dir = Path(work_dir) if work_dir is not None else None
+        self._interpreter = (
+            interpreter or f"{sys.executable} {platform.python_version()}"
+        )
+        self.stats = CodeCacheStats()
+
+    async def execute_code_blocks(
+        self,
+        code_blocks: List[CodeBlock],
+        cancellation_token: CancellationToken,
+    ) -> CodeResult:
+        if not code_blocks or not all(map(is_pure, code_blocks)):
+            self.stats.uncacheable += 1
+            return await self._code_executor.execute_code_blocks(
+                code_blocks, cancellation_token
+            )
+        key = self._key(code_blocks)
+        cached = self._store.get(key)
+        inputs = self._inputs(code_blocks)
+        if cached is not None:
+            entry = json.loads(cached)
+            if all(
+                inputs.get(name) == digest
+                for name, digest in entry["inputs"].items()
+            ):
+                self.stats.hits += 1
+                self.stats.saved_seconds += entry["seconds"]
+                return self._restore(code_blocks, entry)
+
+        self.stats.misses += 1
+        before = self._snapshot()
+        started = time.perf_counter()
+        result = await self._code_executor.execute_code_blocks(
+            code_blocks, cancellation_token
+        )
+        seconds = time.perf_counter() - started
+        if result.exit_code == 0:
+            self._save(key, code_blocks, result, seconds, before, inputs)
+        return result
+
+    async def restart(self) -> None:
+        await self._code_executor.restart()
+
+    def _key(self, code_blocks: List[CodeBlock]) -> str:
+        modules = set()
+        for code_block in code_blocks:
+            modules.update(imported_modules(code_block.code))
+        payload = {
+            "blocks": [
+                [code_block.language.lower(), normalize(code_block.code)]
+                for code_block in code_blocks
+            ],
+            "interpreter": self._interpreter,
+            "packages": package_versions(sorted(modules)),
+        }
+        canonical = json.dumps(payload, sort_keys=True)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _inputs(self, code_blocks: List[CodeBlock]) -> Dict[str, str]:
+        """
+        SHA-256 of the files in `work_dir` that the code mentions.
+
+        They are checked when a result is reused rather than hashed into the
+        key, since files the code writes itself are mentioned too and only
+        exist after the first run.
+        """
+        inputs: Dict[str, str] = {}
+        if self._work_dir is None:
+            return inputs
+        files = set()
+        for code_block in code_blocks:
+            files.update(mentioned_files(code_block.code))
+        for name in sorted(files):
+            path = self._work_dir / name
+            if path.is_file():
+                inputs[name] = hashlib.sha256(path.read_bytes()).hexdigest()
+        return inputs
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        """Modification time and size of every file in `work_dir`."""
+        if self._work_dir is None or not self._work_dir.is_dir():
+            return {}
+        snapshot = {}
+        for path in self._work_dir.rglob("*"):
+            if path.is_file():
+                stat = path.stat()
+                snapshot[str(path.relative_to(self._work_dir))] = (
+                    stat.st_mtime_ns,
+                    stat.st_size,
+                )
+        return snapshot
+
+    def _save(
+        self,
+        key: str,
+        code_blocks: List[CodeBlock],
+        result: CodeResult,
+        seconds: float,
+        before: Dict[str, Tuple[int, int]],
+        inputs: Dict[str, str],
+    ) -> None:
+        code_files = set()
+        if self._work_dir is not None:
+            for code_block in self._python_blocks(code_blocks):
+                path = code_file_path(code_block.code, self._work_dir)
+                code_files.add(str(path.relative_to(self._work_dir.resolve())))
+        artifacts: Dict[str, str] = {}
+        size = len(result.output.encode())
+        for name, state in self._snapshot().items():
+            if name in code_files or before.get(name) == state:
+                continue
+            data = (self._work_dir / name).read_bytes()  # type: ignore
+            size += len(data)
+            if size > self._max_entry_bytes:
+                break
+            artifacts[name] = base64.b64encode(data).decode()
+        if size > self._max_entry_bytes:
+            self.stats.too_large += 1
+            return
+        entry = {
+            "exit_code": result.exit_code,
+            "output": result.output,
+            "code_file": getattr(result, "code_file", None),
+            "seconds": seconds,
+            "artifacts": artifacts,
+            "inputs": inputs,
+        }
+        self._store.set(key, json.dumps(entry))
+
+    def _restore(
+        self, code_blocks: List[CodeBlock], entry: Dict
+    ) -> CommandLineCodeResult:
+        if self._work_dir is not None:
+            for code_block in self._python_blocks(code_blocks):
+                write_code_file(code_block.code, self._work_dir)
+            for name, data in entry["artifacts"].items():
+                path = self._work_dir / name
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(base64.b64decode(data))
+        return CommandLineCodeResult(
+            exit_code=entry["exit_code"],
+            output=entry["output"],
+            code_file=entry["code_file"],
+        )
+
+    @staticmethod
+    def _python_blocks(code_blocks: List[CodeBlock]) -> List[CodeBlock]:
+        return [
+            code_block
+            for code_block in code_blocks
+            if code_block.language.lower() in PYTHON_LANGUAGES
+        ]
@@ -0,0 +1,361 @@
+"""
+Start running code blocks while the model is still writing its message.
+
+The Assistants of 05 and 08 wait for the whole message before the Executor
+looks for code, so the time the model spends explaining the code after its
+closing fence is added to every turn. With streaming enabled:
+
+- The Assistant streams its response and feeds the deltas to a
+  FenceParser, which returns each code block as soon as its closing fence
+  arrives. It publishes the block right away as a CodeBlockMessage.
+- The Executor starts the block in a StreamedCodeRunner, after the earlier
+  blocks of the message, and when the full message arrives it waits for
+  those runs instead of running the blocks again.
+
+FenceParser finds exactly the blocks that the regular expression of
+`extract_markdown_code_blocks` finds in the complete message, including
+what that expression makes of odd fences, and a fence that is never
+closed yields no block. Each delta is scanned once, so parsing a message
+takes time proportional to its length however it is split;
+benchmark_code_stream.py compares it with the regular expression.
+
+Enable it with CODE_STREAMING=1 (see settings.py).
+"""
+
+import asyncio
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from autogen_core import CancellationToken
+from autogen_core.code_executor import CodeBlock, CodeExecutor, CodeResult
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    RequestUsage,
+)
+from autogen_ext.code_executors._common import CommandLineCodeResult
+
+from chat_context import estimate_tokens
+from chat_services import closing_stream
+
+# The expression of `extract_markdown_code_blocks` in 05 and 08.
+CODE_BLOCK = re.compile(r"```(?:\s*([\w\+\-]+))?\n([\s\S]*?)```")
+FENCE = "```"
+SPACE = re.compile(r"\s*")
+WORD = re.compile(r"[\w\+\-]*")
+WORD_CHAR = re.compile(r"[\w\+\-]")
+
+_TEXT, _SPACE, _WORD, _CODE = range(4)
+
+
+class FenceParser:
+    """
+    Incremental version of `CODE_BLOCK.findall` over streamed text.
+
+    `feed` returns the blocks whose closing fence is in the text fed so far
+    and that were not returned before. Text is only kept while it may still
+    belong to a block.
+    """
+
+    def __init__(self) -> None:
+        self._state = _TEXT
+        # Text of the previous delta that may start a fence.
+        self._held = ""
+        # Text between the opening fence and the end of the language.
+        self._header: List[str] = []
+        self._language: List[str] = []
+        self._newline_first = False
+        self._code: List[str] = []
+        self.blocks = 0
+
+    @property
+    def in_block(self) -> bool:
+        """Whether an opening fence has not been closed yet."""
+        return self._state != _TEXT
+
+    def feed(self, delta: str) -> List[CodeBlock]:
+        text = self._held + delta
+        self._held = ""
+        blocks: List[CodeBlock] = []
+        index = 0
+        while True:
+            if self._state == _TEXT:
+                start = text.find(FENCE, index)
+                if start < 0 or start + 3 >= len(text):
+                    # Keep what may be the start of a fence.
+                    keep = start if start >= 0 else max(len(text) - 2, index)
+                    self._held = text[keep:]
+                    return blocks
+                first = text[start + 3]
+                if first == "`":
+                    # A longer run of backticks: the fence starts later.
+                    index = start + 1
+                    continue
+                self._state = _SPACE
+                self._newline_first = first == "\n"
+                self._header = []
+                self._language = []
+                index = start + 3
+            elif self._state == _SPACE:
+                # "```", optional whitespace and language, "\n"; or "```\n".
+                end = SPACE.match(text, index).end()  # type: ignore
+                self._header.append(text[index:end])
+                if end == len(text):
+                    return blocks
+                if WORD_CHAR.match(text, end):
+                    self._state = _WORD
+                    index = end
+                else:
+                    index = self._end_header(text, end)
+            elif self._state == _WORD:
+                end = WORD.match(text, index).end()  # type: ignore
+                self._header.append(text[index:end])
+                self._language.append(text[index:end])
+                if end == len(text):
+                    return blocks
+                index = self._end_header(text, end)
+            else:
+                end = text.find(FENCE, index)
+                if end < 0:
+                    # Hold back trailing backticks, which may open the fence.
+                    keep = len(text) - min(
+                        len(text) - len(text.rstrip("`")), 2, len(text) - index
+                    )
+                    self._code.append(text[index:keep])
+                    self._held = text[keep:]
+                    return blocks
+                self._code.append(text[index:end])
+                blocks.append(
+                    CodeBlock(
+                        code="".join(self._code),
+                        language="".join(self._language),
+                    )
+                )
+                self.blocks += 1
+                self._code = []
+                self._state = _TEXT
+                index = end + 3
+
+    def _end_header(self, text: str, end: int) -> int:
+        """Decide the header at the first character that ends it."""
+        language = "".join(self._language)
+        if language and text[end] == "\n":
+            self._state = _CODE
+            self._code = []
+            return end + 1
+        self._language = []
+        if self._newline_first:
+            # No language: the code starts after the newline of the fence.
+            self._state = _CODE
+            self._code = ["".join(self._header)[1:]]
+            return end
+        # Not a fence; the header holds no backticks, so go on after it.
+        self._state = _TEXT
+        return end
+
+
+@dataclass
+class CodeBlockMessage:
+    """A code block of a message that is still being generated."""
+
+    stream_id: str
+    index: int
+    code: str
+    language: str
+
+
+async def create_streaming(
+    client: ChatCompletionClient,
+    messages: Sequence[LLMMessage],
+    on_code_block: Callable[[int, CodeBlock], Awaitable[None]],
+    cancellation_token: Optional[CancellationToken] = None,
+) -> CreateResult:
+    """
+    `client.create(messages)`, streamed, calling `on_code_block` with the
+    index and block of every code block as soon as its fence is closed.
+    """
+    parser = FenceParser()
+    deltas: List[str] = []
+    result: Optional[CreateResult] = None
+    stream = closing_stream(
+        client.create_stream(messages, cancellation_token=cancellation_token)
+    )
+    try:
+        async for chunk in stream:
+            if isinstance(chunk, str):
+                deltas.append(chunk)
+                for code_block in parser.feed(chunk):
+                    await on_code_block(parser.blocks - 1, code_block)
+            else:
+                result = chunk
+    finally:
+        await stream.aclose()
+    assert result is not None
+    if deltas and not (isinstance(result.content, str) and result.content):
+        # autogen 0.4.4 mistakes a text response of one delta for an empty
+        # list of tool calls.
+        result = result.model_copy(update={"content": "".join(deltas)})
+    if deltas and result.usage.completion_tokens == 0:
+        # Streams only carry usage when the service is asked for it, which
+        # autogen 0.4.4 cannot read; count one token per delta.
+        prompt_tokens = result.usage.prompt_tokens
+        if not prompt_tokens:
+            try:
+                prompt_tokens = client.count_tokens(messages)
+            except Exception:
+                prompt_tokens = sum(map(estimate_tokens, messages))
+        result = result.model_copy(
+            update={
+                "usage": RequestUsage(
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=len(deltas),
+                )
+            }
+        )
+    return result
+
+
+@dataclass
+class CodeStreamStats:
+    messages: int = 0
+    blocks: int = 0
+    early_blocks: int = 0
+    head_start_seconds: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"messages={self.messages} blocks={self.blocks} "
+            f"early_blocks={self.early_blocks} "
+            f"head_start_seconds={self.head_start_seconds:.2f}"
+        )
+
+
+class _Run:
+    """The blocks of one streamed message, run one after another."""
+
+    def __init__(self) -> None:
+        self.results: Dict[int, "asyncio.Future[Optional[CodeResult]]"] = {}
+        self.started: Dict[int, float] = {}
+
+    def result(self, index: int) -> "asyncio.Future[Optional[CodeResult]]":
+        if index not in self.results:
+            self.results[index] = asyncio.get_running_loop().create_future()
+        return self.results[index]
+
+
+class StreamedCodeRunner:
+    """
+    Runs the code blocks of streamed messages as they arrive.
+
+    The blocks of a message run one after another in their order, and a
+    block after one that failed is not run, as with `execute_code_blocks`.
+
+    Args:
+        code_executor: Executor that runs each block.
+    """
+
+    def __init__(self, code_executor: CodeExecutor) -> None:
+        self._code_executor = code_executor
+        self._runs: Dict[str, _Run] = {}
+        self._collected: Dict[str, None] = {}
+        self._tasks: "set[asyncio.Task[Any]]" = set()
+        self.stats = CodeStreamStats()
+
+    def submit(
+        self,
+        stream_id: str,
+        index: int,
+        code_block: CodeBlock,
+        cancellation_token: CancellationToken,
+    ) -> None:
+        """Start a block once the blocks before it have run."""
+        if stream_id not in self._collected:
+            run = self._runs.setdefault(stream_id, _Run())
+            self._start(run, index, code_block, cancellation_token)
+
+    async def collect(
+        self,
+        stream_id: str,
+        code_blocks: List[CodeBlock],
+        cancellation_token: CancellationToken,
+    ) -> CodeResult:
+        """The result of all blocks of the complete message."""
+        run = self._runs.pop(stream_id, _Run())
+        # Blocks published late for this message are not run again.
+        self._collected[stream_id] = None
+        if len(self._collected) > 1000:
+            del self._collected[next(iter(self._collected))]
+        self.stats.messages += 1
+        self.stats.blocks += len(code_blocks)
+        if not run.started:
+            return await self._code_executor.execute_code_blocks(
+                code_blocks, cancellation_token
+            )
+        self.stats.early_blocks += len(run.started)
+        self.stats.head_start_seconds += time.perf_counter() - min(
+            run.started.values()
+        )
+        for index, code_block in enumerate(code_blocks):
+            self._start(run, index, code_block, cancellation_token)
+        results = [
+            await run.result(index) for index in range(len(code_blocks))
+        ]
+        ran = [result for result in results if result is not None]
+        return CommandLineCodeResult(
+            exit_code=next(
+                (result.exit_code for result in ran if result.exit_code), 0
+            ),
+            output="".join(result.output for result in ran),
+            code_file=next(
+                (
+                    getattr(result, "code_file", None)
+                    for result in reversed(ran)
+                    if getattr(result, "code_file", None)
+                ),
+                None,
+            ),
+        )
+
+    def _start(
+        self,
+        run: _Run,
+        index: int,
+        code_block: CodeBlock,
+        cancellation_token: CancellationToken,
+    ) -> None:
+        if index in run.started:
+            return
+        run.started[index] = time.perf_counter()
+        task = asyncio.create_task(
+            self._run(run, index, code_block, cancellation_token)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(
+        self,
+        run: _Run,
+        index: int,
+        code_block: CodeBlock,
+        cancellation_token: CancellationToken,
+    ) -> None:
+        future = run.result(index)
+        try:
+            if index > 0:
+                previous = await run.result(index - 1)
+                if previous is None or previous.exit_code != 0:
+                    future.set_result(None)
+                    return
+            future.set_result(
+                await self._code_executor.execute_code_blocks(
+                    [code_block], cancellation_token
+                )
+            )
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
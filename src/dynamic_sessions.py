@@ -0,0 +1,529 @@
+"""
+Asynchronous, session-affine code execution in Azure Container Apps dynamic
+sessions.
+
+The RemoteExecutor of 08 used to build a SessionsPythonREPLTool for every
+message and call its blocking `invoke`, which stalls the event loop of the
+SingleThreadedAgentRuntime, and every other agent in the process, for the
+whole remote execution. Its `session_id` is a class default, so every
+conversation of the process shared one session.
+
+DynamicSessionsPool talks to the session pool management API with the
+process-wide httpx pool of chat_services.py instead, so requests are
+asynchronous and reuse their keep-alive connections:
+
+- `pool.executor(conversation)` returns a RemoteExecutor pinned to one
+  session of that conversation, so variables and files of earlier blocks
+  are still there. Conversations have separate sessions and run in parallel;
+  the blocks of one conversation run one at a time.
+- The `cancellation_token` aborts the request. The service cannot stop code
+  that is already running, so a cancelled or timed out session is given up
+  and the conversation continues in a new one, like a restarted kernel of
+  kernel_pool.py.
+- Files in the session's `/mnt/data` can be uploaded, listed and downloaded.
+- The log of each block is passed to the listener of live_output.py as
+  soon as it arrives.
+- With `batch=True`, the executor sends all blocks of a message in one
+  request: a program that runs them one after another in the session,
+  separates their output with delimiters and records the exit code of each.
+  The response is split back into the log of each block, so a message of
+  five blocks costs one round trip and one session call instead of five.
+- Requests are authenticated with a Microsoft Entra token of
+  DefaultAzureCredential, fetched in a thread and cached until shortly before
+  it expires, or with a fixed token such as the one that
+  fake_sessions_server.py accepts.
+
+    sessions = DynamicSessionsPool(pool_management_endpoint, timeout=60)
+    executor = sessions.executor("remote_coding_agents", batch=True)
+    ...
+    await sessions.close()
+"""
+
+import asyncio
+import json
+import logging
+import time
+import urllib.parse
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from autogen_core import CancellationToken
+from autogen_core.code_executor import CodeBlock, CodeExecutor, CodeResult
+from langchain_azure_dynamic_sessions.tools.sessions import RemoteFileMetadata
+
+from chat_services import get_http_client
+from live_output import emit_output
+
+logger = logging.getLogger(__name__)
+
+API_VERSION = "2024-02-02-preview"
+TOKEN_SCOPE = "https://dynamicsessions.io/.default"
+REPLACED = "The session was replaced and its state was lost."
+# Seconds to wait for the response beyond the execution timeout.
+RESPONSE_MARGIN_SECONDS = 10.0
+
+# Runs the blocks of a batch in the session. After each block, a delimiter
+# line with its index, exit code and the JSON of its result (the value of a
+# final expression, as the service returns for a single block) is written to
+# stdout, and one with its index to stderr. Each delimiter is preceded by a
+# newline, which is removed again when the output is split.
+BATCH_PROGRAM = r"""
+def __run_batch__(blocks, marker):
+    import ast, json, sys, traceback
+
+    namespace = globals()
+    for index, code in enumerate(blocks):
+        exit_code, result = 0, None
+        try:
+            tree = ast.parse(code, f"<block {index + 1}>")
+            last = None
+            if tree.body and isinstance(tree.body[-1], ast.Expr):
+                last = ast.Expression(tree.body.pop().value)
+            exec(compile(tree, f"<block {index + 1}>", "exec"), namespace)
+            if last is not None:
+                result = eval(
+                    compile(last, f"<block {index + 1}>", "eval"), namespace
+                )
+        except SystemExit as error:
+            if error.code is None or isinstance(error.code, int):
+                exit_code = error.code or 0
+            else:
+                print(error.code, file=sys.stderr)
+                exit_code = 1
+        except BaseException as error:
+            traceback.print_exception(
+                type(error), error, error.__traceback__.tb_next
+            )
+            exit_code = 1
+        if hasattr(result, "savefig"):
+            result = {"type": "image", "format": "png"}
+        try:
+            encoded = json.dumps(result)
+        except (TypeError, ValueError):
+            encoded = json.dumps(repr(result))
+        sys.stdout.flush()
+        sys.stderr.flush()
+        print(f"\n{marker} {index} {exit_code} {encoded}", flush=True)
+        print(f"\n{marker} {index}", file=sys.stderr, flush=True)
+        if exit_code:
+            break
+"""
+
+
+def entra_token_provider() -> Callable[[], Awaitable[str]]:
+    """
+    An access token provider for DefaultAzureCredential.
+
+    The token is fetched in a thread, since azure-identity blocks, and reused
+    until five minutes before it expires.
+    """
+    from azure.identity import DefaultAzureCredential
+
+    credential = DefaultAzureCredential()
+    token = None
+    lock = asyncio.Lock()
+
+    async def provider() -> str:
+        nonlocal token
+        async with lock:
+            if token is None or token.expires_on < time.time() + 300:
+                token = await asyncio.to_thread(
+                    credential.get_token, TOKEN_SCOPE
+                )
+            return token.token
+
+    return provider
+
+
+def static_token_provider(token: str) -> Callable[[], Awaitable[str]]:
+    """An access token provider that always returns the same token."""
+
+    async def provider() -> str:
+        return token
+
+    return provider
+
+
+@dataclass
+class DynamicSessionsStats:
+    executions: int = 0
+    batched_blocks: int = 0
+    sessions: int = 0
+    replaced_sessions: int = 0
+    errors: int = 0
+    execution_seconds: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"executions={self.executions} "
+            f"batched_blocks={self.batched_blocks} sessions={self.sessions} "
+            f"replaced_sessions={self.replaced_sessions} "
+            f"errors={self.errors} "
+            f"execution_seconds={self.execution_seconds:.2f}"
+        )
+
+
+@dataclass
+class _Session:
+    identifier: str
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class DynamicSessionsPool:
+    """
+    Per-conversation sessions of an Azure Container Apps session pool.
+
+    Args:
+        pool_management_endpoint: Management endpoint of the session pool.
+        timeout: Seconds a request may take before the session is given up.
+        access_token_provider: Returns the bearer token of a request;
+            defaults to a Microsoft Entra token of DefaultAzureCredential.
+        http_client: Client the requests are sent with; defaults to the
+            shared pool of chat_services.py.
+    """
+
+    def __init__(
+        self,
+        pool_management_endpoint: str,
+        timeout: float = 60,
+        access_token_provider: Optional[Callable[[], Awaitable[str]]] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ) -> None:
+        self.pool_management_endpoint = pool_management_endpoint
+        self.timeout = timeout
+        self._access_token_provider = access_token_provider
+        self._http_client = http_client
+        self._sessions: Dict[str, _Session] = {}
+        self.stats = DynamicSessionsStats()
+
+    def executor(
+        self, conversation: str, batch: bool = False
+    ) -> "RemoteExecutor":
+        return RemoteExecutor(self, conversation, batch)
+
+    def session_id(self, conversation: str) -> str:
+        """The identifier of the session a conversation is pinned to."""
+        return self._session(conversation).identifier
+
+    async def execute(
+        self,
+        conversation: str,
+        code: str,
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> Dict[str, Any]:
+        """
+        Run Python code in the session of a conversation.
+
+        Returns the `properties` of the response: `status`, `stdout`,
+        `stderr`, `result` and `executionTimeInMilliseconds`.
+        """
+        session = self._session(conversation)
+        async with session.lock:
+            started = time.perf_counter()
+            body = {
+                "properties": {
+                    "codeInputType": "inline",
+                    "executionType": "synchronous",
+                    "code": code,
+                }
+            }
+            request = asyncio.ensure_future(
+                self._request(
+                    "POST",
+                    "code/execute",
+                    session.identifier,
+                    json=body,
+                    timeout=self.timeout + RESPONSE_MARGIN_SECONDS,
+                )
+            )
+            if cancellation_token is not None:
+                cancellation_token.link_future(request)
+            try:
+                response = await request
+            except (asyncio.CancelledError, httpx.TimeoutException):
+                # The session may still be running the code; start over.
+                self._replace(conversation)
+                raise
+            finally:
+                self.stats.executions += 1
+                self.stats.execution_seconds += time.perf_counter() - started
+            return response.json().get("properties", {})
+
+    async def upload_file(
+        self, conversation: str, data: bytes, remote_file_path: str
+    ) -> RemoteFileMetadata:
+        """Upload a file to `/mnt/data` of the session of a conversation."""
+        response = await self._request(
+            "POST",
+            "files/upload",
+            self.session_id(conversation),
+            files=[
+                (
+                    "file",
+                    (remote_file_path, data, "application/octet-stream"),
+                )
+            ],
+        )
+        return RemoteFileMetadata.from_dict(response.json()["value"][0])
+
+    async def list_files(self, conversation: str) -> List[RemoteFileMetadata]:
+        response = await self._request(
+            "GET", "files", self.session_id(conversation)
+        )
+        return [
+            RemoteFileMetadata.from_dict(entry)
+            for entry in response.json()["value"]
+        ]
+
+    async def download_file(
+        self, conversation: str, remote_file_path: str
+    ) -> bytes:
+        """The content of a file in `/mnt/data` of the session."""
+        response = await self._request(
+            "GET",
+            "files/content/" + urllib.parse.quote(remote_file_path),
+            self.session_id(conversation),
+        )
+        return response.content
+
+    async def restart(self, conversation: str) -> None:
+        """Move a conversation to a new session without its state."""
+        self._replace(conversation)
+
+    async def close(self) -> None:
+        """Forget the sessions; the service deletes them once idle."""
+        self._sessions.clear()
+
+    def _session(self, conversation: str) -> _Session:
+        session = self._sessions.get(conversation)
+        if session is None:
+            session = _Session(f"{conversation}-{uuid.uuid4().hex[:12]}")
+            self._sessions[conversation] = session
+            self.stats.sessions += 1
+        return session
+
+    def _replace(self, conversation: str) -> None:
+        if self._sessions.pop(conversation, None) is not None:
+            logger.info("Replacing the session of %s.", conversation)
+            self.stats.replaced_sessions += 1
+
+    def _url(self, path: str, session_id: str) -> str:
+        endpoint = self.pool_management_endpoint
+        if not endpoint.endswith("/"):
+            endpoint += "/"
+        separator = "&" if "?" in endpoint else "?"
+        query = urllib.parse.urlencode(
+            {"identifier": session_id, "api-version": API_VERSION}
+        )
+        return f"{endpoint}{path}{separator}{query}"
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        session_id: str,
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        if self._access_token_provider is None:
+            self._access_token_provider = entra_token_provider()
+        token = await self._access_token_provider()
+        client = self._http_client or get_http_client()
+        response = await client.request(
+            method,
+            self._url(path, session_id),
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=timeout
+            if timeout is not None
+            else httpx.USE_CLIENT_DEFAULT,
+            **kwargs,
+        )
+        if response.is_error:
+            self.stats.errors += 1
+        response.raise_for_status()
+        return response
+
+
+class RemoteExecutor(CodeExecutor):
+    """
+    Runs the code blocks of one conversation in its dynamic session.
+
+    Blocks run in order until the first one that fails, as with
+    LocalCommandLineCodeExecutor. The log of a block is the JSON of the
+    result, stdout and stderr that the service returns, without the data of
+    images. `restart()` moves the conversation to a new session.
+
+    With `batch`, all blocks of a call are sent in one request, and the
+    timeout of the pool applies to all of them together.
+    """
+
+    def __init__(
+        self,
+        pool: DynamicSessionsPool,
+        conversation: str,
+        batch: bool = False,
+    ) -> None:
+        self._pool = pool
+        self._conversation = conversation
+        self._batch = batch
+
+    @property
+    def pool_management_endpoint(self) -> str:
+        return self._pool.pool_management_endpoint
+
+    async def execute_code_blocks(
+        self,
+        code_blocks: List[CodeBlock],
+        cancellation_token: CancellationToken,
+    ) -> CodeResult:
+        if self._batch and len(code_blocks) > 1:
+            return await self._execute_batch(code_blocks, cancellation_token)
+        logs: List[str] = []
+        exit_code = 0
+        emitted = 0
+        for i, code_block in enumerate(code_blocks):
+            logs.append(
+                f"\n--- Executing code block {i + 1}/{len(code_blocks)} ---\n"
+            )
+            try:
+                properties = await self._pool.execute(
+                    self._conversation, code_block.code, cancellation_token
+                )
+            except asyncio.CancelledError:
+                if not cancellation_token.is_cancelled():
+                    raise
+                logs.append(f"Cancelled. {REPLACED}\n")
+                exit_code = 125
+                break
+            except httpx.TimeoutException:
+                logs.append(f"Timeout. {REPLACED}\n")
+                exit_code = 124
+                break
+            except Exception as e:
+                logs.append(f"Error executing code block {i + 1}: {e}\n")
+                exit_code = 1
+                break
+            logs.append(_format(properties))
+            # Pass each block on as it finishes (see live_output.py).
+            await emit_output("".join(logs[emitted:]))
+            emitted = len(logs)
+            if properties.get("status", "Success") != "Success":
+                exit_code = 1
+                break
+        await emit_output("".join(logs[emitted:]))
+        return CodeResult(exit_code=exit_code, output="".join(logs))
+
+    async def _execute_batch(
+        self,
+        code_blocks: List[CodeBlock],
+        cancellation_token: CancellationToken,
+    ) -> CodeResult:
+        marker = f"--- batch {uuid.uuid4().hex} ---"
+        program = (
+            BATCH_PROGRAM
+            + f"__run_batch__({[block.code for block in code_blocks]!r}, "
+            + f"{marker!r})\n"
+        )
+        headers = [
+            f"\n--- Executing code block {i + 1}/{len(code_blocks)} ---\n"
+            for i in range(len(code_blocks))
+        ]
+        logs = [headers[0]]
+        exit_code = 0
+        try:
+            properties = await self._pool.execute(
+                self._conversation, program, cancellation_token
+            )
+        except asyncio.CancelledError:
+            if not cancellation_token.is_cancelled():
+                raise
+            logs.append(f"Cancelled. {REPLACED}\n")
+            exit_code = 125
+        except httpx.TimeoutException:
+            logs.append(f"Timeout. {REPLACED}\n")
+            exit_code = 124
+        except Exception as e:
+            logs.append(f"Error executing code: {e}\n")
+            exit_code = 1
+        else:
+            self._pool.stats.batched_blocks += len(code_blocks)
+            logs = []
+            for header, block_properties in zip(
+                headers, split_batch(properties, marker, len(code_blocks))
+            ):
+                logs.append(header)
+                logs.append(_format(block_properties))
+                exit_code = block_properties["exit_code"]
+        await emit_output("".join(logs))
+        return CodeResult(exit_code=exit_code, output="".join(logs))
+
+    async def restart(self) -> None:
+        await self._pool.restart(self._conversation)
+
+
+def split_batch(
+    properties: Dict[str, Any], marker: str, blocks: int
+) -> List[Dict[str, Any]]:
+    """
+    The `result`, `stdout`, `stderr` and `exit_code` of each block that ran
+    in a batch of `blocks` blocks.
+
+    A block without its delimiter, because the batch was stopped while it
+    ran, gets the output after the last delimiter and exit code 1; the
+    blocks after it did not run and are left out.
+    """
+    separator = f"\n{marker} "
+    stdout = (properties.get("stdout") or "").split(separator)
+    stderr = (properties.get("stderr") or "").split(separator)
+
+    def body(parts: List[str], index: int) -> str:
+        # Every part but the first starts with the rest of a delimiter line.
+        if index >= len(parts):
+            return ""
+        return parts[index] if index == 0 else parts[index].partition("\n")[2]
+
+    results: List[Dict[str, Any]] = []
+    for index in range(min(len(stdout), blocks)):
+        if index + 1 < len(stdout):
+            line = stdout[index + 1].partition("\n")[0]
+            _, exit_code, result = line.split(" ", 2)
+            results.append(
+                {
+                    "result": json.loads(result),
+                    "stdout": body(stdout, index),
+                    "stderr": body(stderr, index),
+                    "exit_code": int(exit_code),
+                }
+            )
+        elif (
+            body(stdout, index)
+            or body(stderr, index)
+            or properties.get("status", "Success") != "Success"
+        ):
+            results.append(
+                {
+                    "result": properties.get("result"),
+                    "stdout": body(stdout, index),
+                    "stderr": body(stderr, index),
+                    "exit_code": 1,
+                }
+            )
+    return results
+
+
+def _format(properties: Dict[str, Any]) -> str:
+    """The block log SessionsPythonREPLTool used to return."""
+    result = properties.get("result")
+    if isinstance(result, dict) and result.get("type") == "image":
+        result = dict(result)
+        result.pop("base64_data", None)
+    return json.dumps(
+        {
+            "result": result,
+            "stdout": properties.get("stdout"),
+            "stderr": properties.get("stderr"),
+        },
+        indent=2,
+    )
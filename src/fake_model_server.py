@@ -0,0 +1,498 @@
+"""
+Offline stand-in for the Azure OpenAI chat completions API.
+
+The server answers `POST /openai/deployments/{deployment}/chat/completions`
+(and the plain OpenAI `/v1/chat/completions`) with scripted or rule-based
+responses, as JSON or as a server-sent event stream, including tool calls.
+Latency is simulated from configurable distributions for time to first
+token (TTFT) and tokens per second, so orchestration overhead can be
+load-tested at high concurrency without network access.
+
+Run it and point the scripts at it:
+
+    python fake_model_server.py --port 8000 --ttft lognormal:0.4,0.5 \
+        --tokens-per-second normal:60,15
+    AZURE_OPENAI_URL=http://127.0.0.1:8000 AZURE_OPENAI_API_KEY=offline \
+        python 02_two_agents.py
+
+Distributions are written as `const:X` (or just `X`), `uniform:LOW,HIGH`,
+`normal:MEAN,STDDEV`, `lognormal:MEDIAN,SIGMA` or `exponential:MEAN`; all
+values are in seconds or tokens per second, and samples are clipped at 0.
+A tokens-per-second rate of 0 streams without delay.
+
+Responses come from rules (see DEFAULT_RULES), checked in order against the
+last message of each request. `--rules` loads a JSON list of rules instead:
+
+    [
+        {"match": "(?i)joke", "content": "Why did the agent cross the road?"},
+        {"role": "tool", "content": "The result is {last_message}. FINISH"},
+        {"tools": true, "tool_calls": "auto"},
+        {"responses": [{"content": "First"}, {"content": "Second. FINISH"}]}
+    ]
+
+A rule matches when all of its conditions hold: `match` (regex searched in
+the last message), `role` (role of the last message), `tools` (whether the
+request offers tools) and `max_assistant_turns` (assistant messages already
+in the history). It answers with `content` and/or `tool_calls`, or with the
+next entry of `responses`, which makes a script. `"tool_calls": "auto"`
+calls the first offered tool with arguments built from its JSON schema.
+`{last_message}` in `content` is replaced with the last message.
+
+Token counts in `usage` are approximate (about four characters per prompt
+token, one token per word of the response). `GET /stats` reports request
+counters and the peak number of concurrent requests.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+Distribution = Callable[[], float]
+
+DEFAULT_RULES: List[Dict[str, Any]] = [
+    # Answer tool results and finish, so tool-calling agents stop.
+    {"role": "tool", "content": "The tool returned {last_message}. FINISH"},
+    {"tools": True, "tool_calls": "auto"},
+    # Coding tasks get one runnable block, then the conversation ends.
+    {
+        "match": r"(?i)\b(code|python|script|plot|chart|program)\b",
+        "max_assistant_turns": 0,
+        "content": (
+            "Here is the code:\n\n"
+            "```python\n"
+            "print('Hello from the offline model')\n"
+            "```\n"
+        ),
+    },
+    {"content": "This is an offline response. FINISH"},
+]
+
+
+def parse_distribution(spec: str) -> Distribution:
+    """Parse a distribution such as `lognormal:0.5,0.3` into a sampler."""
+    name, _, args = spec.partition(":")
+    if not args:
+        value = float(name)
+        return lambda: value
+    params = [float(arg) for arg in args.split(",")]
+    samplers: Dict[str, Callable[..., float]] = {
+        "const": lambda value: value,
+        "uniform": random.uniform,
+        "normal": random.gauss,
+        "lognormal": lambda median, sigma: random.lognormvariate(
+            math.log(median), sigma
+        ),
+        "exponential": lambda mean: random.expovariate(1.0 / mean),
+    }
+    if name not in samplers:
+        raise ValueError(f"Unknown distribution: {spec}")
+    sampler = samplers[name]
+    return lambda: max(sampler(*params), 0.0)
+
+
+@dataclass
+class FakeModelSettings:
+    ttft: Distribution = lambda: 0.0
+    tokens_per_second: Distribution = lambda: 0.0
+    rules: List[Dict[str, Any]] = field(
+        default_factory=lambda: list(DEFAULT_RULES)
+    )
+    rate_limit_probability: float = 0.0
+    retry_after_ms: int = 1000
+    # Azure reports the model version, not the deployment name.
+    model: str = "gpt-4o-2024-08-06"
+
+
+@dataclass
+class FakeModelStats:
+    requests: int = 0
+    streamed_requests: int = 0
+    tool_call_responses: int = 0
+    rate_limited: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+
+
+def _text(content: Any) -> str:
+    """Flatten message content, which may be a list of parts."""
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") for part in content if isinstance(part, dict)
+        )
+    return content or ""
+
+
+def _example_arguments(schema: Dict[str, Any]) -> Any:
+    """A value that satisfies a (simple) JSON schema."""
+    if "default" in schema:
+        return schema["default"]
+    if schema.get("enum"):
+        return schema["enum"][0]
+    if "anyOf" in schema:
+        return _example_arguments(schema["anyOf"][0])
+    kind = schema.get("type", "object")
+    if kind == "object":
+        properties = schema.get("properties", {})
+        required = schema.get("required", list(properties))
+        return {
+            name: _example_arguments(properties[name])
+            for name in required
+            if name in properties
+        }
+    return {
+        "string": "example",
+        "integer": 1,
+        "number": 1.0,
+        "boolean": True,
+        "array": [],
+        "null": None,
+    }.get(kind)
+
+
+class RuleEngine:
+    """Picks the response for a request from an ordered list of rules."""
+
+    def __init__(self, rules: List[Dict[str, Any]]) -> None:
+        self._rules = rules
+        self._script_positions: Dict[int, int] = {}
+
+    def respond(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        messages = body.get("messages", [])
+        last = messages[-1] if messages else {}
+        last_text = _text(last.get("content"))
+        tools = body.get("tools") or []
+        assistant_turns = sum(
+            1 for message in messages if message.get("role") == "assistant"
+        )
+        for index, rule in enumerate(self._rules):
+            if "match" in rule and not re.search(rule["match"], last_text):
+                continue
+            if "role" in rule and last.get("role") != rule["role"]:
+                continue
+            if "tools" in rule and bool(tools) != rule["tools"]:
+                continue
+            if assistant_turns > rule.get("max_assistant_turns", 1 << 30):
+                continue
+            if "responses" in rule:
+                position = self._script_positions.get(index, 0)
+                self._script_positions[index] = position + 1
+                rule = rule["responses"][position % len(rule["responses"])]
+            return self._render(rule, last_text, tools)
+        return self._render({"content": ""}, last_text, tools)
+
+    def _render(
+        self,
+        rule: Dict[str, Any],
+        last_text: str,
+        tools: List[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        content = rule.get("content")
+        if content is not None:
+            content = content.replace("{last_message}", last_text)
+        tool_calls = rule.get("tool_calls") or []
+        if tool_calls == "auto":
+            function = tools[0]["function"] if tools else {}
+            tool_calls = [
+                {
+                    "name": function.get("name", ""),
+                    "arguments": _example_arguments(
+                        function.get("parameters", {})
+                    ),
+                }
+            ]
+        return {
+            "content": content,
+            "tool_calls": [
+                {
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {
+                        "name": call["name"],
+                        "arguments": (
+                            call["arguments"]
+                            if isinstance(call.get("arguments"), str)
+                            else json.dumps(call.get("arguments", {}))
+                        ),
+                    },
+                }
+                for call in tool_calls
+            ],
+        }
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"\s*\S+|\s+", text)
+
+
+def create_app(settings: Optional[FakeModelSettings] = None) -> FastAPI:
+    """Build the FastAPI app serving the fake chat completions API."""
+    settings = settings or FakeModelSettings()
+    engine = RuleEngine(settings.rules)
+    stats = FakeModelStats()
+    app = FastAPI(title="Fake Azure OpenAI")
+    app.state.stats = stats
+
+    @app.get("/stats")
+    async def get_stats() -> Dict[str, int]:
+        return stats.__dict__
+
+    @app.post("/v1/chat/completions")
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(request: Request) -> Any:
+        body = await request.json()
+        stats.requests += 1
+        if random.random() < settings.rate_limit_probability:
+            stats.rate_limited += 1
+            return JSONResponse(
+                {
+                    "error": {
+                        "code": "429",
+                        "message": "Rate limit is exceeded.",
+                    }
+                },
+                status_code=429,
+                headers={
+                    "retry-after-ms": str(settings.retry_after_ms),
+                    "retry-after": str(
+                        max(settings.retry_after_ms // 1000, 1)
+                    ),
+                },
+            )
+        model = settings.model
+        response = engine.respond(body)
+        if response["tool_calls"]:
+            stats.tool_call_responses += 1
+        prompt_tokens = sum(
+            len(_text(message.get("content"))) // 4 + 4
+            for message in body.get("messages", [])
+        )
+        pieces = _tokens(response["content"] or "")
+        for call in response["tool_calls"]:
+            pieces += _tokens(call["function"]["arguments"])
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(pieces),
+            "total_tokens": prompt_tokens + len(pieces),
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        finish_reason = "tool_calls" if response["tool_calls"] else "stop"
+        ttft = settings.ttft()
+        tokens_per_second = settings.tokens_per_second()
+        delay = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+
+        if not body.get("stream"):
+            with _in_flight(stats):
+                await asyncio.sleep(ttft + delay * len(pieces))
+            message: Dict[str, Any] = {
+                "role": "assistant",
+                "content": response["content"],
+            }
+            if response["tool_calls"]:
+                message["tool_calls"] = response["tool_calls"]
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": message,
+                        "finish_reason": finish_reason,
+                        "logprobs": None,
+                    }
+                ],
+                "usage": usage,
+            }
+
+        stats.streamed_requests += 1
+        include_usage = (body.get("stream_options") or {}).get(
+            "include_usage", False
+        )
+
+        def chunk(delta: Dict[str, Any], finish: Optional[str] = None) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": delta,
+                        "finish_reason": finish,
+                        "logprobs": None,
+                    }
+                ],
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def events() -> AsyncIterator[str]:
+            with _in_flight(stats):
+                await asyncio.sleep(ttft)
+                yield chunk({"role": "assistant", "content": ""})
+                for piece in _tokens(response["content"] or ""):
+                    yield chunk({"content": piece})
+                    if delay:
+                        await asyncio.sleep(delay)
+                for index, call in enumerate(response["tool_calls"]):
+                    yield chunk({"tool_calls": [{"index": index, **call}]})
+                    if delay:
+                        await asyncio.sleep(
+                            delay * len(_tokens(call["function"]["arguments"]))
+                        )
+                yield chunk({}, finish_reason)
+                if include_usage:
+                    payload = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [],
+                        "usage": usage,
+                    }
+                    yield f"data: {json.dumps(payload)}\n\n"
+                yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+@contextlib.contextmanager
+def _in_flight(stats: FakeModelStats) -> Iterator[None]:
+    stats.in_flight += 1
+    stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+    try:
+        yield
+    finally:
+        stats.in_flight -= 1
+
+
+@contextlib.contextmanager
+def running_server(
+    settings: Optional[FakeModelSettings] = None,
+    host: str = "127.0.0.1",
+    port: int = 0,
+) -> Iterator[str]:
+    """
+    Run the fake server in a background thread and yield its base URL.
+
+    Port 0 picks a free port. Useful for benchmarks and tests that start the
+    server from the same process.
+    """
+    with running_app(create_app(settings), host, port) as url:
+        yield url
+
+
+@contextlib.contextmanager
+def running_app(
+    app: FastAPI, host: str = "127.0.0.1", port: int = 0, **config: Any
+) -> Iterator[str]:
+    """
+    Serve an app with uvicorn in a background thread and yield its base URL.
+
+    `config` is passed on to uvicorn.Config, e.g. `ssl_certfile`; the URL
+    is https when a certificate is given.
+    """
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app,
+            host=host,
+            port=port,
+            log_level="warning",
+            backlog=4096,
+            **config,
+        )
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Server failed to start.")
+        time.sleep(0.01)
+    bound_port = server.servers[0].sockets[0].getsockname()[1]
+    scheme = "https" if config.get("ssl_certfile") else "http"
+    try:
+        yield f"{scheme}://{host}:{bound_port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Offline stand-in for Azure OpenAI chat completions."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--ttft", default="0", help="Time to first token distribution."
+    )
+    parser.add_argument(
+        "--tokens-per-second",
+        default="0",
+        help="Streaming speed distribution; 0 means no delay.",
+    )
+    parser.add_argument("--rules", help="JSON file with a list of rules.")
+    parser.add_argument(
+        "--rate-limit-probability",
+        type=float,
+        default=0.0,
+        help="Share of requests answered with 429.",
+    )
+    parser.add_argument("--retry-after-ms", type=int, default=1000)
+    parser.add_argument(
+        "--model",
+        default=FakeModelSettings.model,
+        help="Model name reported in responses.",
+    )
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    rules = list(DEFAULT_RULES)
+    if args.rules:
+        with open(args.rules, encoding="utf-8") as file:
+            rules = json.load(file)
+    settings = FakeModelSettings(
+        ttft=parse_distribution(args.ttft),
+        tokens_per_second=parse_distribution(args.tokens_per_second),
+        rules=rules,
+        rate_limit_probability=args.rate_limit_probability,
+        retry_after_ms=args.retry_after_ms,
+        model=args.model,
+    )
+    uvicorn.run(
+        create_app(settings),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+        backlog=4096,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,496 @@
+"""
+Offline stand-in for the Azure Container Apps dynamic sessions pool API.
+
+RemoteExecutor (08, dynamic_sessions.py) and the Semantic Kernel
+SessionsPythonTool (09) need a session pool in Azure. This server answers
+the same pool management API locally, so remote execution can be run and
+load-tested without network access:
+
+- `POST /code/execute` runs `properties.code` in the session named by the
+  `identifier` query parameter and returns its `status`, `stdout`,
+  `stderr`, `result` (the value of a final expression, as in the service)
+  and `executionTimeInMilliseconds`,
+- `POST /files/upload`, `GET /files` and `GET /files/content/{name}`
+  upload, list and download the files of the session.
+
+Every session is a Python kernel of kernel_pool.py (a process that keeps its
+variables between requests, capped at `--max-memory-mb`) with its own
+directory, which plays the role of `/mnt/data`: the code runs there, and
+`/mnt/data` in the code refers to it. This isolates sessions from each other
+but is not a security boundary like the Hyper-V sandbox of the service. A
+session is created on its first request, which waits for a `--cold-start`
+sample, and removed after `--session-idle-seconds` without requests. Every
+request waits for a `--latency` sample. Distributions are written as in
+fake_model_server.py (`const:X`, `uniform:LOW,HIGH`, `normal:MEAN,STDDEV`,
+`lognormal:MEDIAN,SIGMA` or `exponential:MEAN`, in seconds).
+
+Any bearer token is accepted. SessionsPythonTool only talks to https
+endpoints; `--self-signed DIR` writes a certificate for 127.0.0.1 to DIR and
+serves https with it, and `SSL_CERT_FILE=DIR/cert.pem` makes httpx trust it:
+
+    python fake_sessions_server.py --port 8100 --cold-start 2 \
+        --latency lognormal:0.05,0.5
+    ACA_POOL_MANAGEMENT_ENDPOINT=http://127.0.0.1:8100 \
+        ACA_ACCESS_TOKEN=offline python 08_...py
+
+`GET /stats` reports request counters and the peak number of concurrent
+executions.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import hashlib
+import json
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request, UploadFile
+from fastapi.responses import JSONResponse, Response
+
+from fake_model_server import Distribution, parse_distribution
+from kernel_pool import KernelPool
+
+MNT_DATA = "/mnt/data"
+CONVERSATION = "session"
+
+# Defined in the kernel of a session and called for every request: runs the
+# code in the kernel's namespace with stderr going to a file of its own, and
+# writes the value of a final expression as JSON.
+SESSION_RUN = r"""
+def __session_run__(code, stderr_path, result_path):
+    import ast, base64, io, json, sys, traceback
+
+    namespace = globals()
+    result, status = None, "Success"
+    previous = sys.stderr
+    with open(stderr_path, "w", encoding="utf-8") as stderr:
+        sys.stderr = stderr
+        try:
+            tree = ast.parse(code, "<session>")
+            last = None
+            if tree.body and isinstance(tree.body[-1], ast.Expr):
+                last = ast.Expression(tree.body.pop().value)
+            exec(compile(tree, "<session>", "exec"), namespace)
+            if last is not None:
+                result = eval(compile(last, "<session>", "eval"), namespace)
+        except Exception:
+            status = "Failure"
+            error_type, error, tb = sys.exc_info()
+            traceback.print_exception(error_type, error, tb.tb_next)
+        finally:
+            sys.stdout.flush()
+            sys.stderr = previous
+    if hasattr(result, "savefig"):
+        image = io.BytesIO()
+        result.savefig(image, format="png")
+        result = {
+            "type": "image",
+            "format": "png",
+            "base64_data": base64.b64encode(image.getvalue()).decode(),
+        }
+    try:
+        encoded = json.dumps({"status": status, "result": result})
+    except (TypeError, ValueError):
+        encoded = json.dumps({"status": status, "result": repr(result)})
+    with open(result_path, "w", encoding="utf-8") as file:
+        file.write(encoded)
+"""
+
+
+@dataclass
+class FakeSessionsSettings:
+    cold_start: Distribution = lambda: 0.0
+    latency: Distribution = lambda: 0.0
+    timeout: float = 220.0
+    session_idle_seconds: float = 300.0
+    max_sessions: int = 100
+    max_memory_mb: int = 2048
+    root: Optional[str] = None
+
+
+@dataclass
+class FakeSessionsStats:
+    requests: int = 0
+    executions: int = 0
+    failed_executions: int = 0
+    sessions_created: int = 0
+    sessions_removed: int = 0
+    uploads: int = 0
+    downloads: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+
+
+@dataclass
+class _Session:
+    directory: Path
+    pool: KernelPool
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class SessionStore:
+    """The sessions of the server, created on first use and removed idle."""
+
+    def __init__(
+        self, settings: FakeSessionsSettings, stats: FakeSessionsStats
+    ) -> None:
+        self._settings = settings
+        self._stats = stats
+        self._root = Path(
+            settings.root or tempfile.mkdtemp(prefix="fake_sessions_")
+        )
+        self._sessions: Dict[str, _Session] = {}
+        self._reaper: Optional["asyncio.Task[None]"] = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def get(self, identifier: str) -> _Session:
+        session = self._sessions.get(identifier)
+        if session is None:
+            if len(self._sessions) >= self._settings.max_sessions:
+                raise OverflowError("The session pool is full.")
+            name = hashlib.sha256(identifier.encode()).hexdigest()[:32]
+            directory = self._root / name
+            directory.mkdir(parents=True, exist_ok=True)
+            session = self._sessions[identifier] = _Session(
+                directory,
+                KernelPool(
+                    work_dir=directory,
+                    timeout=self._settings.timeout,
+                    idle_seconds=0,
+                    max_kernels=1,
+                    max_memory_mb=self._settings.max_memory_mb,
+                ),
+            )
+            self._stats.sessions_created += 1
+            if self._reaper is None:
+                self._reaper = asyncio.create_task(self._remove_idle_forever())
+            await asyncio.sleep(self._settings.cold_start())
+            session.ready.set()
+        await session.ready.wait()
+        session.last_used = time.monotonic()
+        return session
+
+    async def remove_idle(self) -> None:
+        now = time.monotonic()
+        for identifier, session in list(self._sessions.items()):
+            if now - session.last_used > self._settings.session_idle_seconds:
+                await self._remove(identifier)
+
+    async def close(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for identifier in list(self._sessions):
+            await self._remove(identifier)
+
+    async def _remove(self, identifier: str) -> None:
+        session = self._sessions.pop(identifier)
+        await session.pool.close()
+        shutil.rmtree(session.directory, ignore_errors=True)
+        self._stats.sessions_removed += 1
+
+    async def _remove_idle_forever(self) -> None:
+        while True:
+            await asyncio.sleep(
+                min(self._settings.session_idle_seconds / 2, 30)
+            )
+            await self.remove_idle()
+
+
+def _file_path(directory: Path, name: str) -> Path:
+    """A file of a session, by its name relative to `/mnt/data`."""
+    name = name.removeprefix(MNT_DATA).lstrip("/")
+    path = (directory / name).resolve()
+    if not name or not path.is_relative_to(directory.resolve()):
+        raise ValueError(f"Invalid file name: {name}")
+    return path
+
+
+def _file_entry(directory: Path, path: Path) -> Dict[str, Any]:
+    stat = path.stat()
+    modified = datetime.datetime.fromtimestamp(
+        stat.st_mtime, datetime.timezone.utc
+    )
+    return {
+        "properties": {
+            "filename": path.relative_to(directory).as_posix(),
+            "size": stat.st_size,
+            "lastModifiedTime": modified.isoformat(),
+        }
+    }
+
+
+async def _run(session: _Session, code: str) -> Tuple[str, str, str, Any]:
+    """Run code in a session; returns status, stdout, stderr and result."""
+    directory = str(session.directory)
+    scratch = session.pool.work_dir / ".session"
+    scratch.mkdir(exist_ok=True)
+    stderr_path, result_path = scratch / "stderr", scratch / "result.json"
+    result_path.unlink(missing_ok=True)
+    request = (
+        SESSION_RUN
+        + f"__session_run__({code.replace(MNT_DATA, directory)!r}, "
+        + f"{str(stderr_path)!r}, {str(result_path)!r})\n"
+    )
+    exit_code, stdout = await session.pool.run(
+        CONVERSATION, request, str(scratch / "code.py")
+    )
+    stderr = (
+        stderr_path.read_text(encoding="utf-8", errors="replace")
+        if stderr_path.exists()
+        else ""
+    )
+    if result_path.exists():
+        reply = json.loads(result_path.read_text(encoding="utf-8"))
+        status, result = reply["status"], reply["result"]
+    else:
+        # The kernel died, timed out or the code exited.
+        status, result = "Failure", None
+    if exit_code != 0:
+        status = "Failure"
+    return (
+        status,
+        stdout.replace(directory, MNT_DATA),
+        stderr.replace(directory, MNT_DATA),
+        result,
+    )
+
+
+def create_app(settings: Optional[FakeSessionsSettings] = None) -> FastAPI:
+    """Build the FastAPI app serving the fake session pool API."""
+    settings = settings or FakeSessionsSettings()
+    stats = FakeSessionsStats()
+    sessions = SessionStore(settings, stats)
+    app = FastAPI(title="Fake Azure Container Apps dynamic sessions")
+    app.state.stats = stats
+    app.state.sessions = sessions
+    app.router.add_event_handler("shutdown", sessions.close)
+
+    @app.middleware("http")
+    async def session_requests(request: Request, call_next: Any) -> Any:
+        if request.url.path == "/stats":
+            return await call_next(request)
+        stats.requests += 1
+        authorization = request.headers.get("authorization", "")
+        if not authorization.startswith("Bearer "):
+            return _error(401, "A bearer token is required.")
+        identifier = request.query_params.get("identifier")
+        if not identifier:
+            return _error(400, "The identifier query parameter is required.")
+        try:
+            request.state.session = await sessions.get(identifier)
+        except OverflowError as error:
+            return _error(429, str(error))
+        await asyncio.sleep(settings.latency())
+        return await call_next(request)
+
+    @app.get("/stats")
+    async def get_stats() -> Dict[str, int]:
+        return {**stats.__dict__, "sessions": len(sessions)}
+
+    @app.post("/code/execute")
+    @app.post("/code/execute/")
+    async def execute(request: Request) -> Any:
+        body = await request.json()
+        properties = body.get("properties", {})
+        code = properties.get("code")
+        if not isinstance(code, str):
+            return _error(400, "properties.code is required.")
+        stats.executions += 1
+        started = time.perf_counter()
+        with _in_flight(stats):
+            status, stdout, stderr, result = await _run(
+                request.state.session, code
+            )
+        if status != "Success":
+            stats.failed_executions += 1
+        return {
+            "properties": {
+                "status": status,
+                "stdout": stdout,
+                "stderr": stderr,
+                "result": result,
+                "executionTimeInMilliseconds": round(
+                    (time.perf_counter() - started) * 1000
+                ),
+            }
+        }
+
+    @app.post("/files/upload")
+    async def upload(request: Request, file: UploadFile) -> Any:
+        directory = request.state.session.directory
+        try:
+            path = _file_path(directory, file.filename or "")
+        except ValueError as error:
+            return _error(400, str(error))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(await file.read())
+        stats.uploads += 1
+        return {"value": [_file_entry(directory, path)]}
+
+    @app.get("/files")
+    async def list_files(request: Request) -> Any:
+        directory = request.state.session.directory
+        return {
+            "value": [
+                _file_entry(directory, path)
+                for path in sorted(directory.rglob("*"))
+                if path.is_file() and ".session" not in path.parts
+            ]
+        }
+
+    @app.get("/files/content/{name:path}")
+    async def download(request: Request, name: str) -> Any:
+        try:
+            path = _file_path(request.state.session.directory, name)
+        except ValueError as error:
+            return _error(400, str(error))
+        if not path.is_file():
+            return _error(404, f"File not found: {name}")
+        stats.downloads += 1
+        return Response(
+            path.read_bytes(), media_type="application/octet-stream"
+        )
+
+    return app
+
+
+def _error(status_code: int, message: str) -> JSONResponse:
+    return JSONResponse(
+        {"error": {"code": str(status_code), "message": message}},
+        status_code=status_code,
+    )
+
+
+@contextlib.contextmanager
+def _in_flight(stats: FakeSessionsStats) -> Iterator[None]:
+    stats.in_flight += 1
+    stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+    try:
+        yield
+    finally:
+        stats.in_flight -= 1
+
+
+def self_signed_certificate(directory: str) -> Tuple[str, str]:
+    """Write a certificate and key for 127.0.0.1 and localhost."""
+    import ipaddress
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .add_extension(
+            x509.SubjectAlternativeName(
+                [
+                    x509.DNSName("localhost"),
+                    x509.IPAddress(ipaddress.ip_address("127.0.0.1")),
+                ]
+            ),
+            critical=False,
+        )
+        .add_extension(
+            x509.BasicConstraints(ca=True, path_length=None), critical=True
+        )
+        .sign(key, hashes.SHA256())
+    )
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    cert_file = str(Path(directory) / "cert.pem")
+    key_file = str(Path(directory) / "key.pem")
+    Path(cert_file).write_bytes(
+        certificate.public_bytes(serialization.Encoding.PEM)
+    )
+    Path(key_file).write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    return cert_file, key_file
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Offline stand-in for the Azure Container Apps dynamic "
+        "sessions pool management API."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument(
+        "--cold-start",
+        default="0",
+        help="Distribution of the delay of a session's first request.",
+    )
+    parser.add_argument(
+        "--latency",
+        default="0",
+        help="Distribution of the delay added to every request.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=220.0,
+        help="Seconds an execution may run, as in the service.",
+    )
+    parser.add_argument("--session-idle-seconds", type=float, default=300.0)
+    parser.add_argument("--max-sessions", type=int, default=100)
+    parser.add_argument("--max-memory-mb", type=int, default=2048)
+    parser.add_argument(
+        "--root", help="Directory of the session directories; default temp."
+    )
+    parser.add_argument(
+        "--self-signed",
+        metavar="DIR",
+        help="Serve https with a certificate written to DIR.",
+    )
+    args = parser.parse_args()
+
+    settings = FakeSessionsSettings(
+        cold_start=parse_distribution(args.cold_start),
+        latency=parse_distribution(args.latency),
+        timeout=args.timeout,
+        session_idle_seconds=args.session_idle_seconds,
+        max_sessions=args.max_sessions,
+        max_memory_mb=args.max_memory_mb,
+        root=args.root,
+    )
+    ssl: Dict[str, str] = {}
+    if args.self_signed:
+        cert_file, key_file = self_signed_certificate(args.self_signed)
+        ssl = {"ssl_certfile": cert_file, "ssl_keyfile": key_file}
+        print(f"Serving https; set SSL_CERT_FILE={cert_file} to trust it.")
+    uvicorn.run(
+        create_app(settings),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+        backlog=4096,
+        **ssl,  # type: ignore
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+"""
+A code executor that forks every Python block from a warm fork server.
+
+LocalCommandLineCodeExecutor starts a new interpreter for every code block,
+and the blocks of 05 spend most of their time importing matplotlib, pandas
+and yfinance before they do anything. KernelPool (kernel_pool.py) avoids
+that by keeping state between blocks, which is not always wanted.
+ForkServerCodeExecutor keeps every block isolated and still skips the
+imports:
+
+- A fork server process is started once and imports the modules in
+  `preload`. Modules that are not installed are skipped with a warning.
+- Each Python block runs in a child forked from the server, in a fresh
+  namespace. The child shares the server's memory copy-on-write, so the
+  preloaded modules are already imported, and it exits when the block ends;
+  nothing a block does is seen by the next one.
+- Children are reseeded (`random` and, if preloaded, `numpy.random`), so
+  they do not all draw the same random numbers.
+- A block that times out or is cancelled is killed with its process group.
+  If the server itself dies, it is started again for the next block.
+
+Like LocalCommandLineCodeExecutor, blocks are written to `work_dir` and run
+with `work_dir` as current directory, and other languages than Python run
+in a new process. Forking needs POSIX: on Windows every block runs in a new
+process, as with LocalCommandLineCodeExecutor.
+
+`python benchmark_code_executors.py` compares the executors.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import tempfile
+import time
+import warnings
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from autogen_core import CancellationToken
+from autogen_core.code_executor import CodeBlock, CodeExecutor
+from autogen_ext.code_executors._common import CommandLineCodeResult
+from autogen_ext.code_executors.local import LocalCommandLineCodeExecutor
+
+from kernel_pool import PYTHON_LANGUAGES, write_code_file
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRELOAD = ("numpy", "pandas", "matplotlib.pyplot", "yfinance")
+
+# The fork server. Requests come in as JSON lines on a copy of stdin; for
+# each one a child is forked that runs the code with stdout and stderr
+# redirected to the request's output file. Replies go out on a copy of
+# stdout: first which modules were preloaded, then for every request the pid
+# of its child and later its exit code. SIGCHLD wakes up the select loop
+# through a pipe, so children are reaped as soon as they exit.
+SERVER = r"""
+import json, os, random, select, signal, sys, traceback
+
+requests = os.dup(0)
+replies = os.fdopen(os.dup(1), "w", encoding="utf-8")
+os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+
+
+def reply(message):
+    replies.write(json.dumps(message) + "\n")
+    replies.flush()
+
+
+preloaded, failed = [], {}
+for module in json.loads(sys.argv[1]):
+    try:
+        __import__(module)
+        preloaded.append(module)
+    except Exception as error:
+        failed[module] = f"{type(error).__name__}: {error}"
+wakeup_read, wakeup_write = os.pipe()
+os.set_blocking(wakeup_write, False)
+signal.set_wakeup_fd(wakeup_write)
+signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+
+def run(request):
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    for fd in (requests, wakeup_read, wakeup_write):
+        os.close(fd)
+    os.setpgid(0, 0)
+    random.seed()
+    if "numpy" in sys.modules:
+        sys.modules["numpy"].random.seed()
+    output = os.open(request["output"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    os.dup2(output, 1)
+    os.dup2(output, 2)
+    os.close(output)
+    exit_code = 0
+    sys.argv = [request["filename"]]
+    namespace = {
+        "__name__": "__main__",
+        "__file__": request["filename"],
+        "__builtins__": __builtins__,
+    }
+    try:
+        exec(compile(request["code"], request["filename"], "exec"), namespace)
+    except SystemExit as error:
+        if error.code is None or isinstance(error.code, int):
+            exit_code = error.code or 0
+        else:
+            print(error.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException as error:
+        # Leave out the frame of this function.
+        traceback.print_exception(
+            type(error), error, error.__traceback__.tb_next
+        )
+        exit_code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(exit_code)
+
+
+reply({"preloaded": preloaded, "failed": failed})
+children = {}
+buffer = b""
+while True:
+    readable, _, _ = select.select([requests, wakeup_read], [], [])
+    if wakeup_read in readable:
+        os.read(wakeup_read, 4096)
+    if requests in readable:
+        data = os.read(requests, 65536)
+        if not data:
+            break
+        buffer += data
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            request = json.loads(line)
+            pid = os.fork()
+            if pid == 0:
+                run(request)
+            children[pid] = request["id"]
+            reply({"id": request["id"], "pid": pid})
+    while children:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            break
+        exit_code = os.waitstatus_to_exitcode(status)
+        reply({"id": children.pop(pid), "exit_code": exit_code})
+for pid in children:
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+"""
+
+
+@dataclass
+class ForkServerStats:
+    executions: int = 0
+    server_starts: int = 0
+    startup_seconds: float = 0.0
+    execution_seconds: float = 0.0
+    preloaded: List[str] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        return (
+            f"executions={self.executions} "
+            f"server_starts={self.server_starts} "
+            f"startup_seconds={self.startup_seconds:.2f} "
+            f"execution_seconds={self.execution_seconds:.2f} "
+            f"preloaded={','.join(self.preloaded) or '-'}"
+        )
+
+
+@dataclass
+class _Child:
+    pid: "asyncio.Future[int]"
+    exit_code: "asyncio.Future[int]"
+
+
+class ForkServer:
+    """
+    A process that preloads modules and forks a child for every block.
+
+    Args:
+        work_dir: Current directory of the children.
+        preload: Modules to import once in the server.
+        python: Interpreter of the server.
+    """
+
+    def __init__(
+        self,
+        work_dir: Union[Path, str] = ".",
+        preload: Sequence[str] = DEFAULT_PRELOAD,
+        python: str = sys.executable,
+    ) -> None:
+        self.work_dir = Path(work_dir)
+        self.preload = list(preload)
+        self.python = python
+        self.preloaded: List[str] = []
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._reader: Optional["asyncio.Task[None]"] = None
+        self._children: Dict[int, _Child] = {}
+        self._next_id = 0
+        self._scratch = Path(tempfile.mkdtemp(prefix="fork_server_"))
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.returncode is None
+
+    async def start(self) -> None:
+        env = {**os.environ, "PYTHONUNBUFFERED": "1", "MPLBACKEND": "Agg"}
+        self._process = await asyncio.create_subprocess_exec(
+            self.python,
+            "-c",
+            SERVER,
+            json.dumps(self.preload),
+            cwd=self.work_dir,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=env,
+        )
+        assert self._process.stdout is not None
+        ready = json.loads(await self._process.stdout.readline())
+        self.preloaded = ready["preloaded"]
+        for module, error in ready["failed"].items():
+            logger.warning("Could not preload %s: %s", module, error)
+        self._reader = asyncio.create_task(self._read_replies())
+
+    async def run(
+        self,
+        code: str,
+        filename: str,
+        timeout: float,
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> Tuple[int, str]:
+        """
+        Run Python code in a forked child.
+
+        Returns the exit code and the output.
+        """
+        assert self._process is not None and self._process.stdin is not None
+        loop = asyncio.get_running_loop()
+        request_id = self._next_id
+        self._next_id += 1
+        output = self._scratch / f"{request_id}.out"
+        child = self._children[request_id] = _Child(
+            loop.create_future(), loop.create_future()
+        )
+        request = {
+            "id": request_id,
+            "code": code,
+            "filename": filename,
+            "output": str(output),
+        }
+        try:
+            self._process.stdin.write((json.dumps(request) + "\n").encode())
+            await self._process.stdin.drain()
+            waiting = asyncio.ensure_future(
+                asyncio.wait_for(asyncio.shield(child.exit_code), timeout)
+            )
+            if cancellation_token is not None:
+                cancellation_token.link_future(waiting)
+            try:
+                exit_code = await waiting
+                note = ""
+            except asyncio.TimeoutError:
+                exit_code, note = 124, "\n Timeout"
+            except asyncio.CancelledError:
+                exit_code, note = 125, "\n Cancelled"
+            if note:
+                _kill(await child.pid)
+                await child.exit_code
+        except ConnectionError:
+            exit_code = 1
+            note = "\nThe fork server died and will be started again."
+        finally:
+            self._children.pop(request_id, None)
+        try:
+            text = output.read_text(encoding="utf-8", errors="replace")
+            output.unlink()
+        except FileNotFoundError:
+            text = ""
+        return exit_code, text + note
+
+    async def stop(self) -> None:
+        if self._process is not None and self._process.returncode is None:
+            assert self._process.stdin is not None
+            self._process.stdin.close()
+            try:
+                await asyncio.wait_for(self._process.wait(), 5)
+            except asyncio.TimeoutError:
+                self._process.kill()
+                await self._process.wait()
+        if self._reader is not None:
+            await self._reader
+            self._reader = None
+        self._process = None
+
+    def close(self) -> None:
+        """Remove the directory of the output files."""
+        for file in self._scratch.iterdir():
+            file.unlink()
+        self._scratch.rmdir()
+
+    async def _read_replies(self) -> None:
+        assert self._process is not None and self._process.stdout is not None
+        async for line in self._process.stdout:
+            reply = json.loads(line)
+            child = self._children.get(reply["id"])
+            if child is None:
+                continue
+            if "pid" in reply:
+                child.pid.set_result(reply["pid"])
+            else:
+                child.exit_code.set_result(reply["exit_code"])
+        for child in self._children.values():
+            for future in (child.pid, child.exit_code):
+                if not future.done():
+                    future.set_exception(
+                        ConnectionError("The fork server exited.")
+                    )
+
+
+def _kill(pid: int) -> None:
+    """Kill a child and the processes it started."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    except PermissionError:
+        # The child has not made its own process group yet.
+        os.kill(pid, signal.SIGKILL)
+
+
+class ForkServerCodeExecutor(CodeExecutor):
+    """
+    Runs every Python block in a fresh child of a warm fork server.
+
+    Blocks run in order until the first one that fails, as with
+    LocalCommandLineCodeExecutor. The server is started with the first
+    block; `restart()` starts it again and `stop()` stops it.
+
+    Args:
+        work_dir: Directory the blocks are written to and run in.
+        timeout: Seconds a block may run before it is killed.
+        preload: Modules the server imports once for all blocks.
+        python: Interpreter of the server.
+    """
+
+    def __init__(
+        self,
+        work_dir: Union[Path, str] = ".",
+        timeout: float = 60,
+        preload: Sequence[str] = DEFAULT_PRELOAD,
+        python: str = sys.executable,
+    ) -> None:
+        self.work_dir = Path(work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.timeout = timeout
+        self.stats = ForkServerStats()
+        self._server: Optional[ForkServer] = None
+        if hasattr(os, "fork"):
+            self._server = ForkServer(self.work_dir, preload, python)
+        else:
+            warnings.warn(
+                "Forking is not supported on this platform; every block runs "
+                "in a new process.",
+                stacklevel=2,
+            )
+        self._local = LocalCommandLineCodeExecutor(
+            timeout=int(timeout), work_dir=self.work_dir
+        )
+
+    async def execute_code_blocks(
+        self,
+        code_blocks: List[CodeBlock],
+        cancellation_token: CancellationToken,
+    ) -> CommandLineCodeResult:
+        output = ""
+        exit_code = 0
+        code_files: List[str] = []
+        for code_block in code_blocks:
+            if (
+                self._server is None
+                or code_block.language.lower() not in PYTHON_LANGUAGES
+            ):
+                result = await self._local.execute_code_blocks(
+                    [code_block], cancellation_token
+                )
+                exit_code, output = result.exit_code, output + result.output
+                if result.code_file is not None:
+                    code_files.append(result.code_file)
+            else:
+                try:
+                    code_file = write_code_file(code_block.code, self.work_dir)
+                except ValueError:
+                    return CommandLineCodeResult(
+                        exit_code=1,
+                        output="Filename is not in the workspace",
+                        code_file=None,
+                    )
+                code_files.append(str(code_file))
+                exit_code, block_output = await self._run(
+                    code_block.code, str(code_file), cancellation_token
+                )
+                output += block_output
+            if exit_code != 0:
+                break
+        return CommandLineCodeResult(
+            exit_code=exit_code,
+            output=output,
+            code_file=code_files[0] if code_files else None,
+        )
+
+    async def _run(
+        self,
+        code: str,
+        filename: str,
+        cancellation_token: CancellationToken,
+    ) -> Tuple[int, str]:
+        assert self._server is not None
+        if not self._server.running:
+            await self._server.stop()
+            started = time.perf_counter()
+            await self._server.start()
+            self.stats.server_starts += 1
+            self.stats.startup_seconds += time.perf_counter() - started
+            self.stats.preloaded = self._server.preloaded
+        started = time.perf_counter()
+        try:
+            return await self._server.run(
+                code, filename, self.timeout, cancellation_token
+            )
+        finally:
+            self.stats.executions += 1
+            self.stats.execution_seconds += time.perf_counter() - started
+
+    async def restart(self) -> None:
+        """Stop the server; the next block starts it again."""
+        if self._server is not None:
+            await self._server.stop()
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            await self._server.stop()
+            self._server.close()
@@ -0,0 +1,373 @@
+"""
+Referee for the guess-my-number game of 03, and a batch simulation of it.
+
+In 03 the `guesser` agent spends a full model call per turn only to compare
+a guess with the secret number. RefereeAgent gives the same answers ("too
+high", "too low") without a model, instantly, and ends the game with
+"FINISH" when the guess is right, which halves the model calls per game.
+Run 03 with `--referee` to use it.
+
+Run this module to play many games concurrently and see how many turns the
+player needs and how long games take:
+
+    python guessing_game.py --games 2000 --concurrency 200 --player bisect
+    python guessing_game.py --games 100 --judge model --output games.jsonl
+
+- `--judge referee` (default) or `model`: the RefereeAgent or the model-based
+  guesser of 03 answers the guesses.
+- `--player model` (default) uses `settings.llm_config`; `--player bisect`
+  uses an in-process client that bisects the range, so the game can be
+  simulated offline and the timings show the orchestration alone.
+
+Each game is written as one JSON line to `--output`; a summary of turns to
+solve, model calls and latency percentiles goes to stderr.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import statistics
+import sys
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+from autogen_agentchat.agents import AssistantAgent, BaseChatAgent
+from autogen_agentchat.base import Response
+from autogen_agentchat.conditions import (
+    MaxMessageTermination,
+    TextMentionTermination,
+)
+from autogen_agentchat.messages import ChatMessage, TextMessage
+from autogen_agentchat.teams import RoundRobinGroupChat
+from autogen_core import CancellationToken
+from autogen_core.models import (
+    AssistantMessage,
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+)
+from autogen_core.tools import Tool, ToolSchema
+
+LOWEST = 1
+HIGHEST = 100
+TASK = f"I have a number between {LOWEST}-{HIGHEST} in my mind"
+# Whole numbers, not signed: "1-100" is a range, not the numbers 1 and -100.
+NUMBER = re.compile(r"\b\d+\b")
+RANGE = re.compile(r"\b\d+\s*-\s*\d+\b")
+
+
+def parse_guess(text: str) -> Optional[int]:
+    """
+    The last whole number in a message that is not part of a range, which
+    is taken as the guess: "(range 1-100) I guess 50" guesses 50.
+    """
+    numbers = NUMBER.findall(RANGE.sub(" ", text)) or NUMBER.findall(text)
+    return int(numbers[-1]) if numbers else None
+
+
+def judge(guess: Optional[int], number: int) -> str:
+    if guess is None:
+        return f"Please guess a number between {LOWEST} and {HIGHEST}."
+    if guess > number:
+        return "too high"
+    if guess < number:
+        return "too low"
+    return f"{guess} is correct. FINISH"
+
+
+class RefereeAgent(BaseChatAgent):
+    """
+    Answers guesses with 'too high', 'too low' or '<n> is correct. FINISH'.
+
+    The guess is the last number in the latest message of another agent; no
+    model is called.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        number: int,
+        description: str = "Referee of the guess-my-number game.",
+    ) -> None:
+        super().__init__(name, description)
+        self._number = number
+
+    @property
+    def produced_message_types(self) -> Sequence[type[ChatMessage]]:
+        return (TextMessage,)
+
+    async def on_messages(
+        self,
+        messages: Sequence[ChatMessage],
+        cancellation_token: CancellationToken,
+    ) -> Response:
+        guess = next(
+            (
+                parse_guess(message.content)
+                for message in reversed(messages)
+                if isinstance(message, TextMessage)
+                and message.source != self.name
+            ),
+            None,
+        )
+        return Response(
+            chat_message=TextMessage(
+                content=judge(guess, self._number), source=self.name
+            )
+        )
+
+    async def on_reset(self, cancellation_token: CancellationToken) -> None:
+        pass
+
+
+def _bisecting_player_client() -> ChatCompletionClient:
+    # The stub lives with the orchestration benchmark; import it only when
+    # the offline player is used.
+    from benchmark_orchestration import StubChatCompletionClient
+
+    class BisectingPlayerClient(StubChatCompletionClient):
+        """A model stub that plays the game by bisecting the range."""
+
+        async def create(
+            self,
+            messages: Sequence[LLMMessage],
+            *,
+            tools: Sequence[Tool | ToolSchema] = [],
+            json_output: Optional[bool] = None,
+            extra_create_args: Mapping[str, Any] = {},
+            cancellation_token: Optional[CancellationToken] = None,
+        ) -> CreateResult:
+            result = await super().create(messages)
+            return result.model_copy(
+                update={"content": self._reply_to(messages)}
+            )
+
+        def _reply_to(self, messages: Sequence[LLMMessage]) -> str:
+            lowest, highest = LOWEST, HIGHEST
+            guess: Optional[int] = None
+            for message in messages:
+                if not isinstance(message.content, str):
+                    continue
+                if isinstance(message, AssistantMessage):
+                    guess = parse_guess(message.content)
+                    continue
+                answer = message.content.lower()
+                if guess is None:
+                    continue
+                if "too high" in answer:
+                    highest = guess - 1
+                elif "too low" in answer:
+                    lowest = guess + 1
+                elif "correct" in answer:
+                    return "FINISH"
+            return f"My guess is {(lowest + max(lowest, highest)) // 2}."
+
+    return BisectingPlayerClient()
+
+
+@dataclass
+class GameResult:
+    number: int
+    solved: bool
+    turns: int
+    model_calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    seconds: float
+
+
+async def play(
+    player_client: ChatCompletionClient,
+    judge_client: Optional[ChatCompletionClient],
+    number: int,
+    max_messages: int,
+) -> GameResult:
+    """
+    Play one game as in 03. Without `judge_client` a RefereeAgent answers.
+    """
+    player = AssistantAgent(
+        "player",
+        model_client=player_client,
+        system_message="I have a number in my mind, and you will try to "
+        "guess it. If I say 'too high', you should guess a lower number. If "
+        "I say 'too low', you should guess a higher number. If the number is "
+        "guessed, say 'FINISH'.",
+    )
+    if judge_client is None:
+        guesser: BaseChatAgent = RefereeAgent("guesser", number)
+    else:
+        guesser = AssistantAgent(
+            "guesser",
+            model_client=judge_client,
+            system_message="You are playing a game of guess-my-number. You "
+            f"have the number {number} in your mind, and I will try to guess "
+            "it. If I guess too high, say 'too high', if I guess too low, say "
+            "'too low'. ",
+        )
+    team = RoundRobinGroupChat(
+        [player, guesser],
+        termination_condition=TextMentionTermination("FINISH")
+        | MaxMessageTermination(max_messages),
+    )
+    started = time.perf_counter()
+    result = await team.run(task=TASK)
+    seconds = time.perf_counter() - started
+
+    guesses = [
+        parse_guess(message.content)
+        for message in result.messages
+        if isinstance(message, TextMessage) and message.source == "player"
+    ]
+    solved = number in guesses
+    usages = [
+        message.models_usage
+        for message in result.messages
+        if message.models_usage is not None
+    ]
+    return GameResult(
+        number=number,
+        solved=solved,
+        turns=guesses.index(number) + 1 if solved else len(guesses),
+        model_calls=len(usages),
+        prompt_tokens=sum(usage.prompt_tokens for usage in usages),
+        completion_tokens=sum(usage.completion_tokens for usage in usages),
+        seconds=seconds,
+    )
+
+
+def _percentile(values: Sequence[float], percentile: float) -> float:
+    ordered = sorted(values)
+    index = min(int(percentile * len(ordered)), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(results: Sequence[GameResult], wall_seconds: float) -> str:
+    solved = [result for result in results if result.solved]
+    lines = [
+        f"games: {len(results)}, solved: {len(solved)}, "
+        f"wall time: {wall_seconds:.2f} s "
+        f"({len(results) / max(wall_seconds, 1e-9):.1f} games/s)",
+        f"model calls per game: "
+        f"{statistics.mean(r.model_calls for r in results):.2f}, "
+        f"tokens per game: "
+        f"{statistics.mean(r.prompt_tokens for r in results):.0f} prompt / "
+        f"{statistics.mean(r.completion_tokens for r in results):.0f} "
+        "completion",
+    ]
+    if solved:
+        turns = [result.turns for result in solved]
+        lines.append(
+            f"turns to solve: mean {statistics.mean(turns):.2f}, "
+            f"p50 {_percentile(turns, 0.5)}, p90 {_percentile(turns, 0.9)}, "
+            f"max {max(turns)}"
+        )
+        counts = Counter(turns)
+        width = max(counts.values())
+        for turn in sorted(counts):
+            bar = "#" * max(1, round(40 * counts[turn] / width))
+            lines.append(f"  {turn:>3} turns {counts[turn]:>6}  {bar}")
+    seconds = [result.seconds * 1000 for result in results]
+    per_turn = [
+        result.seconds * 1000 / result.turns
+        for result in results
+        if result.turns
+    ]
+    lines.append(
+        f"game latency ms: p50 {_percentile(seconds, 0.5):.1f}, "
+        f"p95 {_percentile(seconds, 0.95):.1f}, "
+        f"p99 {_percentile(seconds, 0.99):.1f}, max {max(seconds):.1f}"
+    )
+    if per_turn:
+        lines.append(
+            f"latency per turn ms: p50 {_percentile(per_turn, 0.5):.1f}, "
+            f"p95 {_percentile(per_turn, 0.95):.1f}"
+        )
+    return "\n".join(lines)
+
+
+async def simulate(options: argparse.Namespace) -> List[GameResult]:
+    model_client: Optional[ChatCompletionClient] = None
+    if "model" in (options.player, options.judge):
+        from settings import llm_config
+
+        model_client = ChatCompletionClient.load_component(llm_config)
+    player_client = (
+        _bisecting_player_client()
+        if options.player == "bisect"
+        else model_client
+    )
+    judge_client = model_client if options.judge == "model" else None
+    assert player_client is not None
+
+    numbers = random.Random(options.seed)
+    semaphore = asyncio.Semaphore(options.concurrency)
+
+    async def one_game(number: int) -> GameResult:
+        async with semaphore:
+            return await play(
+                player_client, judge_client, number, options.max_messages
+            )
+
+    games = [
+        one_game(numbers.randint(LOWEST, HIGHEST))
+        for _ in range(options.games)
+    ]
+    return await asyncio.gather(*games)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Play the guess-my-number game of 03 many times."
+    )
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=100,
+        help="Games played at the same time (default 100).",
+    )
+    parser.add_argument(
+        "--judge",
+        choices=("referee", "model"),
+        default="referee",
+        help="Who answers the guesses (default referee).",
+    )
+    parser.add_argument(
+        "--player",
+        choices=("model", "bisect"),
+        default="model",
+        help="Who guesses: the model of settings.llm_config or an offline "
+        "bisecting stub (default model).",
+    )
+    parser.add_argument(
+        "--max-messages",
+        type=int,
+        default=40,
+        help="Stop a game after this many messages (default 40).",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="Write one JSON line per game here.")
+    options = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    results = asyncio.run(simulate(options))
+    wall_seconds = time.perf_counter() - started
+
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as file:
+            for result in results:
+                record: Dict[str, Any] = {
+                    "judge": options.judge,
+                    "player": options.player,
+                    **asdict(result),
+                }
+                file.write(json.dumps(record) + "\n")
+    print(summarize(results, wall_seconds), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Run several intervention handlers of an autogen-core runtime in order.
+
+SingleThreadedAgentRuntime in autogen-core 0.4.4 passes the original message
+to every intervention handler and keeps the result of the last one, so a
+handler that replaces a message (BudgetGuard, LoopGuard) is overruled by the
+handlers after it. InterventionChain passes each handler's result on to the
+next one and stops at DropMessage:
+
+    runtime = SingleThreadedAgentRuntime(
+        intervention_handlers=[InterventionChain(budget_guard, loop_guard)]
+    )
+"""
+
+from typing import Any
+
+from autogen_core import (
+    AgentId,
+    DropMessage,
+    InterventionHandler,
+    MessageContext,
+)
+
+
+class InterventionChain(InterventionHandler):
+    def __init__(self, *handlers: InterventionHandler) -> None:
+        self._handlers = handlers
+
+    async def on_send(
+        self,
+        message: Any,
+        *,
+        message_context: MessageContext,
+        recipient: AgentId,
+    ) -> Any:
+        for handler in self._handlers:
+            message = await handler.on_send(
+                message, message_context=message_context, recipient=recipient
+            )
+            if message is DropMessage or isinstance(message, DropMessage):
+                break
+        return message
+
+    async def on_publish(
+        self, message: Any, *, message_context: MessageContext
+    ) -> Any:
+        for handler in self._handlers:
+            message = await handler.on_publish(
+                message, message_context=message_context
+            )
+            if message is DropMessage or isinstance(message, DropMessage):
+                break
+        return message
+
+    async def on_response(
+        self, message: Any, *, sender: AgentId, recipient: AgentId | None
+    ) -> Any:
+        for handler in self._handlers:
+            message = await handler.on_response(
+                message, sender=sender, recipient=recipient
+            )
+            if message is DropMessage or isinstance(message, DropMessage):
+                break
+        return message
@@ -0,0 +1,463 @@
+"""
+A pool of long-lived, per-conversation Python kernels for code execution.
+
+LocalCommandLineCodeExecutor starts a new interpreter for every code block,
+so every fix-and-retry cycle of 04 and 05 imports pandas and matplotlib and
+loads its data again. KernelPool keeps one Python process per conversation
+alive instead and runs each block in it with `exec`, in a namespace that is
+kept between blocks: imports, data frames and downloads of earlier blocks
+are still there, and a retry costs milliseconds of interpreter time instead
+of seconds.
+
+- A kernel is started on the first block of a conversation and reused for
+  the following ones. Blocks of one conversation run one at a time.
+- Kernels idle for `idle_seconds` are stopped in the background, and the
+  least recently used one is stopped when a new kernel would exceed
+  `max_kernels`. When every kernel is running a block, the new one is
+  started anyway and a warning is logged.
+- Memory is capped at `max_memory_mb`: on POSIX as a hard address space
+  limit (allocations beyond it raise MemoryError), and everywhere the kernel
+  is restarted after a block that leaves it above the cap.
+- A kernel that crashes, times out or is cancelled is killed; the output so
+  far is returned with a note that its state was lost, and a fresh kernel is
+  started for the next block.
+
+Like LocalCommandLineCodeExecutor, blocks are written to `work_dir` (as
+`tmp_code_<sha256>.py` or the `# filename:` of the block) and run with
+`work_dir` as current directory; other languages than Python are passed on
+to a LocalCommandLineCodeExecutor. `KernelPool.executor(conversation)`
+returns a CodeExecutor for one conversation:
+
+    pool = KernelPool(work_dir=generated_directory, timeout=60, **kernel_pool)
+    executor = pool.executor("coding_agents")
+    ...
+    await pool.close()
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from autogen_core import CancellationToken
+from autogen_core.code_executor import CodeBlock, CodeExecutor
+from autogen_ext.code_executors._common import (
+    CommandLineCodeResult,
+    get_file_name_from_content,
+)
+from autogen_ext.code_executors.local import LocalCommandLineCodeExecutor
+
+logger = logging.getLogger(__name__)
+
+PYTHON_LANGUAGES = {"python", "py", "python3"}
+RESTARTED = "The kernel was restarted and its state was lost."
+
+# The kernel process. Requests come in as JSON lines on a copy of stdin and
+# replies go out on a copy of stdout, starting with an empty one once it is
+# ready; stdin itself is /dev/null, and stdout and stderr (file descriptors 1
+# and 2, so output of C extensions and child processes too) go to the output
+# file named in each request.
+KERNEL = r"""
+import json, os, sys, traceback
+
+requests = os.fdopen(os.dup(0), "r", encoding="utf-8")
+replies = os.fdopen(os.dup(1), "w", encoding="utf-8")
+os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+max_memory_mb = int(sys.argv[1])
+if max_memory_mb and sys.platform != "darwin":
+    try:
+        import resource
+
+        limit = max_memory_mb * 2**20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def memory_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return 0.0
+
+
+namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+replies.write("{}\n")
+replies.flush()
+for line in requests:
+    request = json.loads(line)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with open(request["output"], "wb") as output:
+        os.dup2(output.fileno(), 1)
+        os.dup2(output.fileno(), 2)
+    exit_code = 0
+    namespace["__file__"] = sys.argv[0] = request["filename"]
+    try:
+        exec(compile(request["code"], request["filename"], "exec"), namespace)
+    except SystemExit as error:
+        if error.code is None or isinstance(error.code, int):
+            exit_code = error.code or 0
+        else:
+            print(error.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException as error:
+        # Leave out the frame of this loop.
+        traceback.print_exception(
+            type(error), error, error.__traceback__.tb_next
+        )
+        exit_code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    reply = {"exit_code": exit_code, "memory_mb": memory_mb()}
+    replies.write(json.dumps(reply) + "\n")
+    replies.flush()
+"""
+
+
+def code_file_path(code: str, work_dir: Path) -> Path:
+    """
+    Where LocalCommandLineCodeExecutor would write Python code in `work_dir`.
+
+    The file is named after the `# filename:` comment of the code, or
+    `tmp_code_<sha256>.py`. Raises ValueError for a file outside `work_dir`.
+    """
+    filename = get_file_name_from_content(code, work_dir)
+    if filename is None:
+        filename = f"tmp_code_{sha256(code.encode()).hexdigest()}.py"
+    return (work_dir / filename).resolve()
+
+
+def write_code_file(code: str, work_dir: Path) -> Path:
+    code_file = code_file_path(code, work_dir)
+    code_file.write_text(code, encoding="utf-8")
+    return code_file
+
+
+@dataclass
+class KernelPoolStats:
+    executions: int = 0
+    kernel_starts: int = 0
+    restarts: int = 0
+    evictions: int = 0
+    startup_seconds: float = 0.0
+    execution_seconds: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"executions={self.executions} "
+            f"kernel_starts={self.kernel_starts} "
+            f"restarts={self.restarts} "
+            f"evictions={self.evictions} "
+            f"startup_seconds={self.startup_seconds:.2f} "
+            f"execution_seconds={self.execution_seconds:.2f}"
+        )
+
+
+@dataclass
+class _Kernel:
+    process: asyncio.subprocess.Process
+    output: Path
+    last_used: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class KernelPool:
+    """
+    Per-conversation Python kernels that keep their state between blocks.
+
+    Args:
+        work_dir: Directory the blocks are written to and run in.
+        timeout: Seconds a block may run before its kernel is killed.
+        idle_seconds: Kernels unused for this long are stopped.
+        max_kernels: Most kernels alive at the same time.
+        max_memory_mb: Memory cap of a kernel; 0 for no cap.
+        python: Interpreter of the kernels.
+    """
+
+    def __init__(
+        self,
+        work_dir: Union[Path, str] = ".",
+        timeout: float = 60,
+        idle_seconds: float = 600,
+        max_kernels: int = 8,
+        max_memory_mb: int = 2048,
+        python: str = sys.executable,
+    ) -> None:
+        self.work_dir = Path(work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self.max_kernels = max_kernels
+        self.max_memory_mb = max_memory_mb
+        self.python = python
+        self.stats = KernelPoolStats()
+        self._kernels: Dict[str, _Kernel] = {}
+        # Held while the kernel of a conversation starts, so that concurrent
+        # first blocks of it share one kernel.
+        self._starting: Dict[str, asyncio.Lock] = {}
+        self._scratch = Path(tempfile.mkdtemp(prefix="kernel_pool_"))
+        self._reaper: Optional["asyncio.Task[None]"] = None
+        self._local = LocalCommandLineCodeExecutor(
+            timeout=int(timeout), work_dir=self.work_dir
+        )
+
+    def executor(self, conversation: str) -> "KernelCodeExecutor":
+        return KernelCodeExecutor(self, conversation)
+
+    async def run(
+        self,
+        conversation: str,
+        code: str,
+        filename: str,
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> Tuple[int, str]:
+        """
+        Run Python code in the kernel of a conversation.
+
+        Returns the exit code and the output.
+        """
+        kernel = await self._kernel(conversation)
+        async with kernel.lock:
+            if kernel.process.returncode is not None:
+                # It died while idle, e.g. killed by the memory limit.
+                await self.restart(conversation)
+                return await self.run(
+                    conversation, code, filename, cancellation_token
+                )
+            started = time.perf_counter()
+            try:
+                return await self._run(
+                    conversation, kernel, code, filename, cancellation_token
+                )
+            finally:
+                kernel.last_used = time.monotonic()
+                self.stats.executions += 1
+                self.stats.execution_seconds += time.perf_counter() - started
+
+    async def _run(
+        self,
+        conversation: str,
+        kernel: _Kernel,
+        code: str,
+        filename: str,
+        cancellation_token: Optional[CancellationToken],
+    ) -> Tuple[int, str]:
+        assert kernel.process.stdin is not None
+        assert kernel.process.stdout is not None
+        request = {
+            "code": code,
+            "filename": filename,
+            "output": str(kernel.output),
+        }
+        kernel.process.stdin.write((json.dumps(request) + "\n").encode())
+        reply_task = asyncio.ensure_future(
+            asyncio.wait_for(kernel.process.stdout.readline(), self.timeout)
+        )
+        if cancellation_token is not None:
+            cancellation_token.link_future(reply_task)
+        try:
+            await kernel.process.stdin.drain()
+            line = await reply_task
+        except asyncio.TimeoutError:
+            output = self._read_output(kernel)
+            await self._stop(conversation, restart=True)
+            return 124, f"{output}\n Timeout. {RESTARTED}"
+        except asyncio.CancelledError:
+            output = self._read_output(kernel)
+            await self._stop(conversation, restart=True)
+            return 125, f"{output}\n Cancelled. {RESTARTED}"
+        except ConnectionError:
+            line = b""
+        output = self._read_output(kernel)
+        if not line:
+            returncode = await kernel.process.wait()
+            await self._stop(conversation, restart=True)
+            return 1, (
+                f"{output}\nThe kernel died with exit code {returncode}. "
+                f"{RESTARTED}"
+            )
+        reply = json.loads(line)
+        if self.max_memory_mb and reply["memory_mb"] > self.max_memory_mb:
+            await self._stop(conversation, restart=True)
+            output += (
+                f"\nThe kernel used {reply['memory_mb']:.0f} MB, more than "
+                f"{self.max_memory_mb} MB. {RESTARTED}"
+            )
+        return reply["exit_code"], output
+
+    async def run_local(
+        self, code_block: CodeBlock, cancellation_token: CancellationToken
+    ) -> CommandLineCodeResult:
+        """Run a block of another language in a new process."""
+        return await self._local.execute_code_blocks(
+            [code_block], cancellation_token
+        )
+
+    async def restart(self, conversation: str) -> None:
+        """Stop the kernel of a conversation; the next block starts anew."""
+        await self._stop(conversation, restart=True)
+
+    async def evict_idle(self) -> None:
+        """Stop the kernels that have been idle for `idle_seconds`."""
+        now = time.monotonic()
+        for conversation, kernel in list(self._kernels.items()):
+            if (
+                not kernel.lock.locked()
+                and now - kernel.last_used > self.idle_seconds
+            ):
+                logger.info("Stopping the idle kernel of %s.", conversation)
+                self.stats.evictions += 1
+                await self._stop(conversation)
+
+    async def close(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for conversation in list(self._kernels):
+            await self._stop(conversation)
+        self._starting.clear()
+        for file in self._scratch.iterdir():
+            file.unlink()
+        self._scratch.rmdir()
+
+    async def _kernel(self, conversation: str) -> _Kernel:
+        kernel = self._kernels.get(conversation)
+        if kernel is not None:
+            return kernel
+        async with self._starting.setdefault(conversation, asyncio.Lock()):
+            # Another block of the conversation may have started it.
+            kernel = self._kernels.get(conversation)
+            if kernel is None:
+                kernel = await self._start(conversation)
+            return kernel
+
+    async def _start(self, conversation: str) -> _Kernel:
+        if len(self._kernels) >= self.max_kernels:
+            idle = [
+                (kernel.last_used, name)
+                for name, kernel in self._kernels.items()
+                if not kernel.lock.locked()
+            ]
+            if idle:
+                self.stats.evictions += 1
+                await self._stop(min(idle)[1])
+            else:
+                logger.warning(
+                    "All %d kernels are busy; starting one more for %s.",
+                    len(self._kernels),
+                    conversation,
+                )
+        started = time.perf_counter()
+        env = {**os.environ, "PYTHONUNBUFFERED": "1", "MPLBACKEND": "Agg"}
+        process = await asyncio.create_subprocess_exec(
+            self.python,
+            "-c",
+            KERNEL,
+            str(self.max_memory_mb),
+            cwd=self.work_dir,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=env,
+        )
+        assert process.stdout is not None
+        # The kernel says it is ready with an empty reply.
+        await process.stdout.readline()
+        output = self._scratch / f"{process.pid}.out"
+        kernel = self._kernels[conversation] = _Kernel(process, output)
+        self.stats.kernel_starts += 1
+        self.stats.startup_seconds += time.perf_counter() - started
+        if self._reaper is None and self.idle_seconds > 0:
+            self._reaper = asyncio.create_task(self._evict_idle_forever())
+        return kernel
+
+    async def _evict_idle_forever(self) -> None:
+        while True:
+            await asyncio.sleep(min(self.idle_seconds / 2, 30))
+            await self.evict_idle()
+
+    async def _stop(self, conversation: str, restart: bool = False) -> None:
+        kernel = self._kernels.pop(conversation, None)
+        if kernel is None:
+            return
+        if restart:
+            self.stats.restarts += 1
+        if kernel.process.returncode is None:
+            kernel.process.kill()
+        await kernel.process.wait()
+        kernel.output.unlink(missing_ok=True)
+
+    @staticmethod
+    def _read_output(kernel: _Kernel) -> str:
+        try:
+            return kernel.output.read_text(encoding="utf-8", errors="replace")
+        except FileNotFoundError:
+            return ""
+
+
+class KernelCodeExecutor(CodeExecutor):
+    """
+    Runs the code blocks of one conversation in its kernel of a KernelPool.
+
+    Blocks run in order until the first one that fails, as with
+    LocalCommandLineCodeExecutor; `restart()` discards the kernel's state.
+    """
+
+    def __init__(self, pool: KernelPool, conversation: str) -> None:
+        self._pool = pool
+        self._conversation = conversation
+
+    async def execute_code_blocks(
+        self,
+        code_blocks: List[CodeBlock],
+        cancellation_token: CancellationToken,
+    ) -> CommandLineCodeResult:
+        output = ""
+        exit_code = 0
+        code_files: List[str] = []
+        for code_block in code_blocks:
+            if code_block.language.lower() not in PYTHON_LANGUAGES:
+                result = await self._pool.run_local(
+                    code_block, cancellation_token
+                )
+                exit_code, output = result.exit_code, output + result.output
+                if result.code_file is not None:
+                    code_files.append(result.code_file)
+            else:
+                try:
+                    code_file = write_code_file(
+                        code_block.code, self._pool.work_dir
+                    )
+                except ValueError:
+                    return CommandLineCodeResult(
+                        exit_code=1,
+                        output="Filename is not in the workspace",
+                        code_file=None,
+                    )
+                code_files.append(str(code_file))
+                exit_code, block_output = await self._pool.run(
+                    self._conversation,
+                    code_block.code,
+                    str(code_file),
+                    cancellation_token,
+                )
+                output += block_output
+            if exit_code != 0:
+                break
+        return CommandLineCodeResult(
+            exit_code=exit_code,
+            output=output,
+            code_file=code_files[0] if code_files else None,
+        )
+
+    async def restart(self) -> None:
+        await self._pool.restart(self._conversation)
@@ -0,0 +1,312 @@
+"""
+Pass the output of code on while it runs, and stop it at its first traceback.
+
+LocalCommandLineCodeExecutor (04, 05) reads the output of a block once its
+process has exited, which may take until the timeout, and RemoteExecutor
+(08) returns once all blocks have run. A slow script shows no sign of life,
+and a traceback it prints early, e.g. for a failed download that it catches
+before going on, only reaches the model when the script is done.
+
+- `streaming_output(listener)` sets the listener of the code executed
+  within it, also through wrappers such as CachedCodeExecutor and
+  ParallelCodeExecutor and in tasks started within it. The listener is
+  called with the text of the output as it arrives.
+- LiveCommandLineCodeExecutor runs blocks like LocalCommandLineCodeExecutor,
+  but reads stdout and stderr while the block runs (Python unbuffered) and
+  passes them on every `flush_seconds`. The output is returned in the order
+  it arrived, and what arrived before a timeout is kept.
+- With `fail_fast`, a block that has printed a complete Python traceback
+  and has not exited `grace_seconds` later is killed with the processes it
+  started, and the output so far is returned with exit code 1. The model
+  sees the error and can fix the code while the script would otherwise
+  still be running.
+- RemoteExecutor (dynamic_sessions.py) passes on the log of each block as
+  soon as its response arrives; the session API has no partial output.
+
+04 prints the output as it arrives; 05 and 08 print it and publish it as
+OutputMessage. Enable it with LIVE_OUTPUT=1 (see settings.py).
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import os
+import signal
+import sys
+from dataclasses import dataclass
+from hashlib import sha256
+from pathlib import Path
+from typing import Awaitable, Callable, Iterator, List, Optional, Tuple, Union
+
+from autogen_core import CancellationToken
+from autogen_core.code_executor import CodeBlock, CodeExecutor
+from autogen_ext.code_executors._common import (
+    CommandLineCodeResult,
+    get_file_name_from_content,
+    lang_to_cmd,
+    silence_pip,
+)
+from autogen_ext.code_executors.local import LocalCommandLineCodeExecutor
+
+from kernel_pool import PYTHON_LANGUAGES
+
+TRACEBACK = "Traceback (most recent call last):"
+STOPPED = "Stopped at the first traceback."
+
+OutputListener = Callable[[str], Awaitable[None]]
+
+_listener: contextvars.ContextVar[Optional[OutputListener]] = (
+    contextvars.ContextVar("output_listener", default=None)
+)
+
+
+@contextlib.contextmanager
+def streaming_output(listener: Optional[OutputListener]) -> Iterator[None]:
+    """Pass the output of code executed within to `listener`."""
+    token = _listener.set(listener)
+    try:
+        yield
+    finally:
+        _listener.reset(token)
+
+
+async def emit_output(text: str) -> None:
+    """Pass output to the listener of the current context, if any."""
+    listener = _listener.get()
+    if listener is not None and text:
+        await listener(text)
+
+
+@dataclass
+class OutputMessage:
+    """Output of the code of a message, published while it runs."""
+
+    run_id: str
+    text: str
+
+
+class TracebackDetector:
+    """
+    Finds the ends of Python tracebacks in streamed output.
+
+    A traceback ends with the first line after its header that is not
+    indented: the exception and its message.
+    """
+
+    def __init__(self) -> None:
+        self._partial = ""
+        self._in_traceback = False
+        self.tracebacks = 0
+
+    def feed(self, text: str) -> bool:
+        """Whether a traceback ended in `text`."""
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        ended = False
+        for line in lines:
+            line = line.rstrip("\r")
+            if line.lstrip().startswith(TRACEBACK):
+                self._in_traceback = True
+            elif self._in_traceback and line and not line[0].isspace():
+                self._in_traceback = False
+                self.tracebacks += 1
+                ended = True
+        return ended
+
+
+@dataclass
+class LiveOutputStats:
+    blocks: int = 0
+    chunks: int = 0
+    tracebacks: int = 0
+    stopped: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"blocks={self.blocks} chunks={self.chunks} "
+            f"tracebacks={self.tracebacks} stopped={self.stopped}"
+        )
+
+
+def _kill(process: asyncio.subprocess.Process) -> None:
+    """Kill a block and the processes it started."""
+    if process.returncode is not None:
+        return
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+class LiveCommandLineCodeExecutor(CodeExecutor):
+    """
+    LocalCommandLineCodeExecutor that passes output on while a block runs.
+
+    Blocks run in order until the first one that fails. Python blocks run
+    with the current interpreter, shell blocks with their shell.
+
+    Args:
+        timeout: Seconds a block may run before it is killed.
+        work_dir: Directory the blocks are written to and run in.
+        fail_fast: Stop a block once it has printed a traceback.
+        grace_seconds: Time a block has to exit by itself after a traceback,
+            e.g. to print the rest of a chained traceback.
+        flush_seconds: Output is passed on at most this often.
+    """
+
+    SUPPORTED_LANGUAGES = LocalCommandLineCodeExecutor.SUPPORTED_LANGUAGES
+
+    def __init__(
+        self,
+        timeout: float = 60,
+        work_dir: Union[Path, str] = ".",
+        fail_fast: bool = False,
+        grace_seconds: float = 0.5,
+        flush_seconds: float = 0.2,
+    ) -> None:
+        self.timeout = timeout
+        self.work_dir = Path(work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.fail_fast = fail_fast
+        self.grace_seconds = grace_seconds
+        self.flush_seconds = flush_seconds
+        self.stats = LiveOutputStats()
+
+    async def execute_code_blocks(
+        self,
+        code_blocks: List[CodeBlock],
+        cancellation_token: CancellationToken,
+    ) -> CommandLineCodeResult:
+        output = ""
+        exit_code = 0
+        code_files: List[str] = []
+        for code_block in code_blocks:
+            language = code_block.language.lower()
+            code = silence_pip(code_block.code, language)
+            if language in PYTHON_LANGUAGES:
+                language = "python"
+            if language not in self.SUPPORTED_LANGUAGES:
+                exit_code = 1
+                output += f"\nunknown language {language}"
+                break
+            try:
+                filename = get_file_name_from_content(code, self.work_dir)
+            except ValueError:
+                return CommandLineCodeResult(
+                    exit_code=1,
+                    output="Filename is not in the workspace",
+                    code_file=None,
+                )
+            if filename is None:
+                extension = "py" if language == "python" else language
+                code_hash = sha256(code.encode()).hexdigest()
+                filename = f"tmp_code_{code_hash}.{extension}"
+            code_file = (self.work_dir / filename).resolve()
+            code_file.write_text(code, encoding="utf-8")
+            code_files.append(str(code_file))
+            program = (
+                sys.executable
+                if language == "python"
+                else lang_to_cmd(language)
+            )
+            exit_code, block_output = await self._run(
+                program, code_file, cancellation_token
+            )
+            output += block_output
+            if exit_code != 0:
+                break
+        return CommandLineCodeResult(
+            exit_code=exit_code,
+            output=output,
+            code_file=code_files[0] if code_files else None,
+        )
+
+    async def restart(self) -> None:
+        pass
+
+    async def _run(
+        self,
+        program: str,
+        code_file: Path,
+        cancellation_token: CancellationToken,
+    ) -> Tuple[int, str]:
+        self.stats.blocks += 1
+        process = await asyncio.create_subprocess_exec(
+            program,
+            str(code_file),
+            cwd=self.work_dir,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, "PYTHONUNBUFFERED": "1"},
+            # A process group of its own, so it can be killed with its
+            # children.
+            start_new_session=os.name == "posix",
+        )
+        received: List[str] = []
+        pending: List[str] = []
+        stop_timer: List[asyncio.TimerHandle] = []
+        stopped = False
+        loop = asyncio.get_running_loop()
+
+        def stop() -> None:
+            nonlocal stopped
+            if process.returncode is None:
+                stopped = True
+                _kill(process)
+
+        async def read(stream: Optional[asyncio.StreamReader]) -> None:
+            assert stream is not None
+            detector = TracebackDetector()
+            while chunk := await stream.read(65536):
+                text = chunk.decode(errors="replace")
+                received.append(text)
+                pending.append(text)
+                if detector.feed(text):
+                    self.stats.tracebacks += 1
+                    if self.fail_fast and not stop_timer:
+                        stop_timer.append(
+                            loop.call_later(self.grace_seconds, stop)
+                        )
+
+        async def flush() -> None:
+            if pending:
+                text = "".join(pending)
+                pending.clear()
+                self.stats.chunks += 1
+                await emit_output(text)
+
+        async def flush_forever() -> None:
+            while True:
+                await asyncio.sleep(self.flush_seconds)
+                await flush()
+
+        finished = asyncio.ensure_future(
+            asyncio.gather(read(process.stdout), read(process.stderr))
+        )
+        cancellation_token.link_future(finished)
+        flusher = asyncio.create_task(flush_forever())
+        exit_code = 0
+        note = ""
+        try:
+            await asyncio.wait_for(finished, self.timeout)
+            exit_code = await process.wait()
+        except asyncio.TimeoutError:
+            exit_code, note = 124, "\n Timeout"
+        except asyncio.CancelledError:
+            exit_code, note = 125, "\n Cancelled"
+        finally:
+            flusher.cancel()
+            for timer in stop_timer:
+                timer.cancel()
+            _kill(process)
+            await process.wait()
+        if stopped:
+            self.stats.stopped += 1
+            exit_code, note = 1, f"\n{STOPPED}"
+        pending.append(note)
+        await flush()
+        return exit_code, "".join(received) + note
@@ -0,0 +1,269 @@
+"""
+Detect agents that repeat themselves, and end or nudge the conversation.
+
+The code writer and executor of 04 and 05 sometimes re-submit the same
+failing code and get the same error back, over and over. LoopDetector keeps
+a rolling window of fingerprints of each agent's recent messages and notices
+when an agent sends the same message again:
+
+- A fingerprint is a short hash of the normalized message: for messages with
+  fenced code blocks only the code counts, so a re-submission with different
+  prose is still a repeat. Whitespace, case, memory addresses and the names
+  of the executor's temporary files are normalized away.
+- Per agent, a deque of the last `window` fingerprints and a Counter of them
+  are updated in O(1) per message.
+
+Two ways to act on it:
+
+- LoopTermination is a termination condition for autogen-agentchat teams
+  (04) that ends the run when an agent has sent the same message
+  `max_repeats` times within its window. It composes with the others:
+  `TextMentionTermination("FINISH") | LoopTermination(**loop_detection)`.
+- LoopGuard is an intervention handler for the autogen-core runtime of 05.
+  The first `max_nudges` times an agent hits `max_repeats`, the repeated
+  message is delivered with a note asking for a different approach; after
+  that, the message is replaced with a LoopDetected notice that no agent
+  handles, so the conversation ends.
+
+`LoopDetector.stats` counts the loops detected, the repeated messages that
+cost a model call, the nudges and the prevented calls: every turn that is
+cut off is at least one model call or code run that does not happen.
+"""
+
+import hashlib
+import logging
+import re
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence
+
+from autogen_agentchat.base import TerminatedException, TerminationCondition
+from autogen_agentchat.messages import AgentEvent, ChatMessage, StopMessage
+from autogen_core import Component, DefaultInterventionHandler, MessageContext
+from pydantic import BaseModel
+from typing_extensions import Self
+
+logger = logging.getLogger(__name__)
+
+CODE_BLOCK = re.compile(r"```[\w+\-]*\s*\n([\s\S]*?)```")
+VOLATILE = re.compile(r"0x[0-9a-fA-F]+|tmp_code_[0-9a-fA-F]+")
+WHITESPACE = re.compile(r"\s+")
+
+NUDGE = (
+    "Note: this is the same message as {count} times before, so the last "
+    "attempts did not get anywhere. Try a different approach."
+)
+
+
+def fingerprint(text: str) -> str:
+    """A short hash of the message that ignores prose around code blocks."""
+    blocks = CODE_BLOCK.findall(text)
+    normalized = "\n".join(blocks) if blocks else text
+    normalized = VOLATILE.sub("#", normalized)
+    normalized = WHITESPACE.sub(" ", normalized).strip().lower()
+    return hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest()
+
+
+@dataclass
+class LoopStats:
+    loops_detected: int = 0
+    repeated_calls: int = 0
+    nudges: int = 0
+    prevented_calls: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"loops_detected={self.loops_detected} "
+            f"repeated_calls={self.repeated_calls} "
+            f"nudges={self.nudges} "
+            f"prevented_calls={self.prevented_calls}"
+        )
+
+
+class LoopDetector:
+    """
+    Rolling fingerprints of the last `window` messages of each agent.
+
+    `observe` returns how often the message occurs in the agent's window,
+    including this time.
+    """
+
+    def __init__(self, window: int = 10) -> None:
+        self.window = window
+        self._recent: Dict[str, Deque[str]] = {}
+        self._counts: Dict[str, Counter[str]] = {}
+        self.stats = LoopStats()
+
+    def observe(self, agent: str, text: str, model_call: bool = False) -> int:
+        recent = self._recent.setdefault(agent, deque())
+        counts = self._counts.setdefault(agent, Counter())
+        key = fingerprint(text)
+        if len(recent) == self.window:
+            evicted = recent.popleft()
+            counts[evicted] -= 1
+            if not counts[evicted]:
+                del counts[evicted]
+        recent.append(key)
+        counts[key] += 1
+        if counts[key] > 1 and model_call:
+            self.stats.repeated_calls += 1
+        return counts[key]
+
+    def forget(self, agent: str) -> None:
+        """Start over for an agent, e.g. after it has been nudged."""
+        self._recent.pop(agent, None)
+        self._counts.pop(agent, None)
+
+    def reset(self) -> None:
+        self._recent.clear()
+        self._counts.clear()
+
+
+class LoopTerminationConfig(BaseModel):
+    max_repeats: int = 3
+    window: int = 10
+
+
+class LoopTermination(TerminationCondition, Component[LoopTerminationConfig]):
+    """
+    Terminate a team run when an agent repeats the same message.
+
+    Args:
+        max_repeats: How often an agent may send the same message within
+            its window before the run ends.
+        window: How many recent messages of each agent are remembered.
+    """
+
+    component_config_schema = LoopTerminationConfig
+
+    def __init__(self, max_repeats: int = 3, window: int = 10) -> None:
+        if max_repeats < 2:
+            raise ValueError("max_repeats must be at least 2.")
+        self._max_repeats = max_repeats
+        self.detector = LoopDetector(window)
+        self._terminated = False
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    async def __call__(
+        self, messages: Sequence[AgentEvent | ChatMessage]
+    ) -> StopMessage | None:
+        if self._terminated:
+            raise TerminatedException(
+                "Termination condition has already been reached"
+            )
+        for message in messages:
+            if not isinstance(getattr(message, "content", None), str):
+                continue
+            count = self.detector.observe(
+                message.source,
+                message.content,
+                model_call=message.models_usage is not None,
+            )
+            if count >= self._max_repeats:
+                self._terminated = True
+                self.detector.stats.loops_detected += 1
+                self.detector.stats.prevented_calls += 1
+                return StopMessage(
+                    content=f"Loop detected: {message.source} sent the same "
+                    f"message {count} times.",
+                    source="LoopTermination",
+                )
+        return None
+
+    async def reset(self) -> None:
+        # The stats add up over runs; the fingerprints are per run.
+        self.detector.reset()
+        self._terminated = False
+
+    def _to_config(self) -> LoopTerminationConfig:
+        return LoopTerminationConfig(
+            max_repeats=self._max_repeats, window=self.detector.window
+        )
+
+    @classmethod
+    def _from_config(cls, config: LoopTerminationConfig) -> Self:
+        return cls(max_repeats=config.max_repeats, window=config.window)
+
+
+@dataclass
+class LoopDetected:
+    """Published by LoopGuard in place of a message that keeps repeating."""
+
+    reason: str
+
+
+class LoopGuard(DefaultInterventionHandler):
+    """
+    Nudges, then stops, agents of an autogen-core runtime that repeat.
+
+    Only published messages with a string `content` are looked at.
+
+    Args:
+        nudge: Builds the message to deliver instead of a repeated one, from
+            the repeated message and a note; e.g. for 05
+            `lambda message, note: Message(f"{message.content}\\n\\n{note}")`.
+            Without it, a loop is stopped right away.
+        max_repeats: How often an agent may send the same message within
+            its window before the guard steps in.
+        window: How many recent messages of each agent are remembered.
+        max_nudges: How many times an agent is nudged before it is stopped.
+        model_agents: Agent types whose messages each cost a model call,
+            for the `repeated_calls` count.
+    """
+
+    def __init__(
+        self,
+        nudge: Optional[Callable[[Any, str], Any]] = None,
+        max_repeats: int = 3,
+        window: int = 10,
+        max_nudges: int = 1,
+        model_agents: Sequence[str] = (),
+    ) -> None:
+        self._nudge = nudge
+        self._model_agents = set(model_agents)
+        self._max_repeats = max_repeats
+        self._max_nudges = max_nudges if nudge is not None else 0
+        self._nudged: Counter[str] = Counter()
+        self._stopped: Dict[str, str] = {}
+        self.detector = LoopDetector(window)
+
+    @property
+    def stats(self) -> LoopStats:
+        return self.detector.stats
+
+    @property
+    def reasons(self) -> List[str]:
+        """Why agents were stopped, one reason per stopped agent."""
+        return list(self._stopped.values())
+
+    async def on_publish(
+        self, message: Any, *, message_context: MessageContext
+    ) -> Any:
+        content = getattr(message, "content", None)
+        if message_context.sender is None or not isinstance(content, str):
+            return message
+        agent = message_context.sender.type
+        if agent in self._stopped:
+            self.stats.prevented_calls += 1
+            return LoopDetected(self._stopped[agent])
+        count = self.detector.observe(
+            agent, content, model_call=agent in self._model_agents
+        )
+        if count < self._max_repeats:
+            return message
+        self.stats.loops_detected += 1
+        if self._nudged[agent] < self._max_nudges:
+            assert self._nudge is not None
+            self._nudged[agent] += 1
+            self.stats.nudges += 1
+            self.detector.forget(agent)
+            logger.info("Loop detected: nudging %s.", agent)
+            return self._nudge(message, NUDGE.format(count=count - 1))
+        reason = f"Loop detected: {agent} sent the same message {count} times."
+        logger.warning("%s Stopping the agents.", reason)
+        self._stopped[agent] = reason
+        self.stats.prevented_calls += 1
+        return LoopDetected(reason)
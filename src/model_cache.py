@@ -0,0 +1,432 @@
+"""
+Persistent response cache for ChatCompletionClient.
+
+CachedChatCompletionClient wraps any model client loaded from a component
+config and stores its responses in a local SQLite database, so replaying the
+same workload does not pay Azure OpenAI latency and tokens again.
+
+The cache key is a SHA-256 over the canonical JSON of the full message
+history, the model configuration (secrets removed), the tools and the create
+arguments. Entries are evicted least-recently-used once `max_entries` is
+exceeded, and expire after `ttl_seconds` when it is set.
+
+The wrapper is enabled through `settings.llm_config` (see MODEL_CACHE_PATH in
+settings.py), so the scripts keep calling
+`ChatCompletionClient.load_component(llm_config)` unchanged.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import warnings
+from typing import (
+    Any,
+    AsyncGenerator,
+    Dict,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+)
+
+from autogen_core import CancellationToken, Component, ComponentModel
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelCapabilities,  # type: ignore
+    ModelInfo,
+    RequestUsage,
+)
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+# Keys that never take part in the cache key, so rotating a secret does not
+# invalidate the cache and secrets are not hashed into it.
+SECRET_CONFIG_KEYS = {"api_key", "azure_ad_token", "azure_ad_token_provider"}
+
+CacheMode = Literal["read_write", "read_only", "write_only"]
+
+
+class SQLiteCacheStore:
+    """
+    A CacheStore backed by a single SQLite file, with LRU eviction and TTL.
+
+    Values are stored as strings; the caller is responsible for serialization.
+    The store is safe to share between threads of one process.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: Optional[int] = 10000,
+        ttl_seconds: Optional[float] = None,
+    ) -> None:
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at "
+            "ON responses (accessed_at)"
+        )
+        self._connection.commit()
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return default
+            value, created_at = row
+            if (
+                self.ttl_seconds is not None
+                and now - created_at > self.ttl_seconds
+            ):
+                self._connection.execute(
+                    "DELETE FROM responses WHERE key = ?", (key,)
+                )
+                self._connection.commit()
+                return default
+            self._connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                (now, key),
+            )
+            self._connection.commit()
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if self.max_entries is not None:
+                # Drop the least recently used entries above the size limit.
+                self._connection.execute(
+                    """DELETE FROM responses WHERE key IN (
+                        SELECT key FROM responses
+                        ORDER BY accessed_at DESC
+                        LIMIT -1 OFFSET ?
+                    )""",
+                    (self.max_entries,),
+                )
+            self._connection.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class CachedChatCompletionClientConfig(BaseModel):
+    client: ComponentModel
+    path: str = "./.model_cache/responses.sqlite"
+    max_entries: Optional[int] = 10000
+    ttl_seconds: Optional[float] = None
+    mode: CacheMode = "read_write"
+
+
+class CachedChatCompletionClient(
+    ChatCompletionClient, Component[CachedChatCompletionClientConfig]
+):
+    """
+    A ChatCompletionClient that caches the responses of another client on disk.
+
+    Modes:
+        read_write: serve hits from the cache, store every miss (read-through
+            and write-through).
+        read_only: serve hits from the cache, never store new responses.
+        write_only: always call the model and refresh the cached response.
+
+    Cache hits are returned with `cached=True` and do not add to the usage of
+    the wrapped client.
+
+    Args:
+        client: The model client to wrap.
+        store: Where responses are kept.
+        mode: One of "read_write", "read_only" or "write_only".
+        client_config: Component config of the wrapped client. It is used to
+            build the cache key and to dump this component back to config.
+    """
+
+    component_type = "model"
+    component_config_schema = CachedChatCompletionClientConfig
+
+    def __init__(
+        self,
+        client: ChatCompletionClient,
+        store: SQLiteCacheStore,
+        mode: CacheMode = "read_write",
+        client_config: Optional[ComponentModel] = None,
+    ) -> None:
+        self._client = client
+        self._store = store
+        self._mode = mode
+        self._client_config = client_config
+        self._client_fingerprint = client_fingerprint(client, client_config)
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_key(
+        self,
+        messages: Sequence[LLMMessage],
+        tools: Sequence[Tool | ToolSchema],
+        json_output: Optional[bool],
+        extra_create_args: Mapping[str, Any],
+        stream: bool,
+    ) -> str:
+        return request_key(
+            self._client_fingerprint,
+            messages,
+            tools,
+            json_output,
+            extra_create_args,
+            stream,
+        )
+
+    def _lookup(self, cache_key: str) -> Optional[str]:
+        if self._mode == "write_only":
+            return None
+        value = self._store.get(cache_key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        cache_key = self._cache_key(
+            messages, tools, json_output, extra_create_args, stream=False
+        )
+        cached_value = self._lookup(cache_key)
+        if cached_value is not None:
+            result = CreateResult.model_validate_json(cached_value)
+            result.cached = True
+            return result
+
+        result = await self._client.create(
+            messages,
+            tools=tools,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+        if self._mode != "read_only":
+            self._store.set(cache_key, result.model_dump_json())
+        return result
+
+    def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        async def _generator() -> AsyncGenerator[
+            Union[str, CreateResult], None
+        ]:
+            cache_key = self._cache_key(
+                messages, tools, json_output, extra_create_args, stream=True
+            )
+            cached_value = self._lookup(cache_key)
+            if cached_value is not None:
+                for chunk in _decode_stream(cached_value):
+                    if isinstance(chunk, CreateResult):
+                        chunk.cached = True
+                    yield chunk
+                return
+
+            chunks: List[Union[str, CreateResult]] = []
+            async for chunk in self._client.create_stream(
+                messages,
+                tools=tools,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            ):
+                chunks.append(chunk)
+                yield chunk
+            # Only complete streams are stored, so an interrupted stream is
+            # never replayed as if it had finished.
+            if self._mode != "read_only":
+                self._store.set(cache_key, _encode_stream(chunks))
+
+        return _generator()
+
+    def actual_usage(self) -> RequestUsage:
+        return self._client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self._client.total_usage()
+
+    def count_tokens(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+    ) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+    ) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> ModelCapabilities:  # type: ignore
+        warnings.warn(
+            "capabilities is deprecated, use model_info instead",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return self._client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+    def _to_config(self) -> CachedChatCompletionClientConfig:
+        client_config = self._client_config or self._client.dump_component()
+        return CachedChatCompletionClientConfig(
+            client=client_config,
+            path=self._store.path,
+            max_entries=self._store.max_entries,
+            ttl_seconds=self._store.ttl_seconds,
+            mode=self._mode,
+        )
+
+    @classmethod
+    def _from_config(
+        cls, config: CachedChatCompletionClientConfig
+    ) -> "CachedChatCompletionClient":
+        client = ChatCompletionClient.load_component(config.client)
+        store = SQLiteCacheStore(
+            config.path,
+            max_entries=config.max_entries,
+            ttl_seconds=config.ttl_seconds,
+        )
+        return cls(
+            client, store, mode=config.mode, client_config=config.client
+        )
+
+
+def client_fingerprint(
+    client: ChatCompletionClient, client_config: Optional[ComponentModel]
+) -> Dict[str, Any]:
+    """Describe the wrapped model and its parameters without any secrets."""
+    if client_config is None:
+        try:
+            client_config = client.dump_component()
+        except (NotImplementedError, TypeError, AttributeError):
+            return {
+                "provider": type(client).__qualname__,
+                "model_info": dict(client.model_info),
+            }
+    config = _without_secrets(client_config.config)
+    return {"provider": client_config.provider, "config": config}
+
+
+def _without_secrets(value: Any) -> Any:
+    """Drop secret keys also from the configs of wrapped clients."""
+    if isinstance(value, BaseModel):
+        value = value.model_dump()
+    if isinstance(value, Mapping):
+        return {
+            key: _without_secrets(item)
+            for key, item in value.items()
+            if key not in SECRET_CONFIG_KEYS
+        }
+    if isinstance(value, (list, tuple)):
+        return [_without_secrets(item) for item in value]
+    return value
+
+
+def request_key(
+    fingerprint: Mapping[str, Any],
+    messages: Sequence[LLMMessage],
+    tools: Sequence[Tool | ToolSchema],
+    json_output: Optional[bool],
+    extra_create_args: Mapping[str, Any],
+    stream: bool,
+) -> str:
+    """SHA-256 over the canonical JSON of one model request."""
+    data = {
+        "client": fingerprint,
+        "messages": [message.model_dump() for message in messages],
+        "tools": [
+            (tool.schema if isinstance(tool, Tool) else tool) for tool in tools
+        ],
+        "json_output": json_output,
+        "extra_create_args": dict(extra_create_args),
+        "stream": stream,
+    }
+    serialized_data = json.dumps(
+        data, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(serialized_data.encode()).hexdigest()
+
+
+def _encode_stream(chunks: Sequence[Union[str, CreateResult]]) -> str:
+    return json.dumps(
+        [
+            {"result": chunk.model_dump(mode="json")}
+            if isinstance(chunk, CreateResult)
+            else {"text": chunk}
+            for chunk in chunks
+        ]
+    )
+
+
+def _decode_stream(value: str) -> List[Union[str, CreateResult]]:
+    return [
+        CreateResult.model_validate(chunk["result"])
+        if "result" in chunk
+        else chunk["text"]
+        for chunk in json.loads(value)
+    ]
@@ -0,0 +1,218 @@
+"""
+Single-flight coalescing of identical in-flight model requests.
+
+When many conversations share the same opening (the same task sent to many
+teams or agents at once), identical requests race to the API together.
+CoalescingChatCompletionClient sends only the first of them upstream; every
+identical request that arrives while it is in flight waits for the same
+response. Requests are identical when the canonical hash of their messages,
+model configuration, tools and create arguments matches (the same key as the
+response cache in model_cache.py).
+
+`saved_calls` counts the requests that were answered without a call of
+their own. A waiter that is cancelled does not cancel the shared call unless
+it was the last one waiting for it.
+
+Coalescing is enabled through `settings.llm_config` (see MODEL_COALESCE in
+settings.py). Only `create` is coalesced; `create_stream` is passed through.
+"""
+
+import asyncio
+import warnings
+from typing import (
+    Any,
+    AsyncGenerator,
+    Dict,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+)
+
+from autogen_core import CancellationToken, Component, ComponentModel
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelCapabilities,  # type: ignore
+    ModelInfo,
+    RequestUsage,
+)
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+from model_cache import client_fingerprint, request_key
+
+
+class _InFlight:
+    def __init__(self, task: "asyncio.Task[CreateResult]") -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class CoalescingChatCompletionClientConfig(BaseModel):
+    client: ComponentModel
+
+
+class CoalescingChatCompletionClient(
+    ChatCompletionClient, Component[CoalescingChatCompletionClientConfig]
+):
+    """
+    A ChatCompletionClient that merges identical concurrent requests into one
+    upstream call and fans the response out to every caller.
+
+    Counters: `upstream_calls` (requests sent to the wrapped client) and
+    `saved_calls` (requests answered by another caller's in-flight call).
+
+    Args:
+        client: The client to wrap.
+        client_config: Component config of the wrapped client. It is used to
+            build the request key and to dump this component back to config.
+    """
+
+    component_type = "model"
+    component_config_schema = CoalescingChatCompletionClientConfig
+
+    def __init__(
+        self,
+        client: ChatCompletionClient,
+        client_config: Optional[ComponentModel] = None,
+    ) -> None:
+        self._client = client
+        self._client_config = client_config
+        self._client_fingerprint = client_fingerprint(client, client_config)
+        self._in_flight: Dict[str, _InFlight] = {}
+        self.upstream_calls = 0
+        self.saved_calls = 0
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        key = request_key(
+            self._client_fingerprint,
+            messages,
+            tools,
+            json_output,
+            extra_create_args,
+            stream=False,
+        )
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None and (
+            in_flight.task.done() or in_flight.task.cancelling()
+        ):
+            # Its last waiter left; joining it would only be cancelled.
+            in_flight = None
+        leader = in_flight is None
+        if in_flight is None:
+            self.upstream_calls += 1
+            in_flight = _InFlight(
+                asyncio.ensure_future(
+                    self._client.create(
+                        messages,
+                        tools=tools,
+                        json_output=json_output,
+                        extra_create_args=extra_create_args,
+                    )
+                )
+            )
+            self._in_flight[key] = in_flight
+            in_flight.task.add_done_callback(
+                lambda _: self._forget(key, in_flight)
+            )
+        else:
+            self.saved_calls += 1
+
+        in_flight.waiters += 1
+        # Each caller waits on its own shield, so cancelling one caller does
+        # not cancel the call the others are waiting for.
+        waiter = asyncio.shield(in_flight.task)
+        if cancellation_token is not None:
+            cancellation_token.link_future(waiter)
+        try:
+            result = await waiter
+        finally:
+            in_flight.waiters -= 1
+            if in_flight.waiters == 0 and not in_flight.task.done():
+                # Forget it before it is cancelled, so that a new request
+                # for the key starts its own call.
+                self._forget(key, in_flight)
+                in_flight.task.cancel()
+        # Followers get their own copy so no caller sees another's edits.
+        return result if leader else result.model_copy(deep=True)
+
+    def _forget(self, key: str, in_flight: _InFlight) -> None:
+        # A newer call for the key may have taken its place.
+        if self._in_flight.get(key) is in_flight:
+            del self._in_flight[key]
+
+    def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        return self._client.create_stream(
+            messages,
+            tools=tools,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+
+    def actual_usage(self) -> RequestUsage:
+        return self._client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self._client.total_usage()
+
+    def count_tokens(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+    ) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+    ) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> ModelCapabilities:  # type: ignore
+        warnings.warn(
+            "capabilities is deprecated, use model_info instead",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return self._client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+    def _to_config(self) -> CoalescingChatCompletionClientConfig:
+        return CoalescingChatCompletionClientConfig(
+            client=self._client_config or self._client.dump_component()
+        )
+
+    @classmethod
+    def _from_config(
+        cls, config: CoalescingChatCompletionClientConfig
+    ) -> "CoalescingChatCompletionClient":
+        return cls(
+            ChatCompletionClient.load_component(config.client),
+            client_config=config.client,
+        )
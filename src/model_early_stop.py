@@ -0,0 +1,314 @@
+"""
+Stop generation as soon as a stop phrase such as "FINISH" is streamed.
+
+TextMentionTermination("FINISH") in 02/03/04 only fires once the whole
+message has been generated, so every token after "FINISH" is generated and
+billed for nothing. AssistantAgent in autogen-agentchat 0.4.4 does not
+stream, so no termination condition ever sees the token deltas. Instead,
+EarlyStopChatCompletionClient streams every request itself, watches the
+deltas and closes the stream the moment a stop phrase appears. The message
+it returns ends with the stop phrase, so TextMentionTermination fires on it
+and the team run ends right away.
+
+Counters: `early_stops`, `stopped_completion_tokens` (tokens generated in
+responses that were cut short) and `saved_completion_tokens`, an estimate
+of the tokens not generated: the mean length of responses that ran to
+completion minus what was generated before the stop. Token counts of cut
+responses are approximate, one per streamed delta.
+
+Early stopping is enabled through `settings.llm_config` (see
+MODEL_STOP_PHRASES in settings.py).
+"""
+
+import logging
+import warnings
+from typing import (
+    Any,
+    AsyncGenerator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+)
+
+from autogen_core import CancellationToken, Component, ComponentModel
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelCapabilities,  # type: ignore
+    ModelInfo,
+    RequestUsage,
+)
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+from chat_context import estimate_tokens
+from chat_services import closing_stream
+
+logger = logging.getLogger(__name__)
+
+
+class EarlyStopChatCompletionClientConfig(BaseModel):
+    client: ComponentModel
+    stop_phrases: List[str] = ["FINISH"]
+
+
+class EarlyStopChatCompletionClient(
+    ChatCompletionClient, Component[EarlyStopChatCompletionClientConfig]
+):
+    """
+    A ChatCompletionClient that cuts responses off after a stop phrase.
+
+    Both `create` and `create_stream` stream from the wrapped client; the
+    content of a cut response ends with the stop phrase.
+
+    Args:
+        client: The client to wrap.
+        stop_phrases: Phrases that end generation, matched case-sensitively
+            like TextMentionTermination.
+        client_config: Component config of the wrapped client.
+    """
+
+    component_type = "model"
+    component_config_schema = EarlyStopChatCompletionClientConfig
+
+    def __init__(
+        self,
+        client: ChatCompletionClient,
+        stop_phrases: Sequence[str] = ("FINISH",),
+        client_config: Optional[ComponentModel] = None,
+    ) -> None:
+        if not stop_phrases or not all(stop_phrases):
+            raise ValueError("Stop phrases must be non-empty strings.")
+        self._client = client
+        self._stop_phrases = list(stop_phrases)
+        self._window = max(len(phrase) for phrase in self._stop_phrases) - 1
+        self._client_config = client_config
+        self._stopped_usage = RequestUsage(
+            prompt_tokens=0, completion_tokens=0
+        )
+        self._complete_responses = 0
+        self._complete_completion_tokens = 0
+        self.early_stops = 0
+        self.stopped_completion_tokens = 0
+        self.saved_completion_tokens = 0
+
+    def _find_stop(self, tail: str, delta: str) -> Optional[int]:
+        """
+        End offset of the first stop phrase in `tail + delta`, if any.
+
+        Only the last `len(phrase) - 1` characters before the delta are kept,
+        so each delta is checked in time proportional to its own length.
+        """
+        window = tail + delta
+        ends = [
+            index + len(phrase)
+            for phrase in self._stop_phrases
+            if (index := window.find(phrase)) >= 0
+        ]
+        return min(ends) - len(tail) if ends else None
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        result: Optional[CreateResult] = None
+        async for chunk in self.create_stream(
+            messages,
+            tools=tools,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        ):
+            if isinstance(chunk, CreateResult):
+                result = chunk
+        assert result is not None
+        return result
+
+    def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        async def _generator() -> AsyncGenerator[
+            Union[str, CreateResult], None
+        ]:
+            deltas: List[str] = []
+            tail = ""
+            # Closing the HTTP response of a cut stream is what makes the
+            # service stop generating; autogen leaves it open.
+            stream = closing_stream(
+                self._client.create_stream(
+                    messages,
+                    tools=tools,
+                    json_output=json_output,
+                    extra_create_args=extra_create_args,
+                    cancellation_token=cancellation_token,
+                )
+            )
+            try:
+                async for chunk in stream:
+                    if isinstance(chunk, CreateResult):
+                        yield self._completed(chunk, messages, tools, deltas)
+                        return
+                    end = self._find_stop(tail, chunk)
+                    if end is None:
+                        deltas.append(chunk)
+                        tail = (
+                            (tail + chunk)[-self._window :]
+                            if self._window
+                            else ""
+                        )
+                        yield chunk
+                        continue
+                    deltas.append(chunk[:end])
+                    yield chunk[:end]
+                    yield self._stopped(messages, tools, deltas)
+                    return
+            finally:
+                await stream.aclose()
+
+        return _generator()
+
+    def _prompt_tokens(
+        self,
+        messages: Sequence[LLMMessage],
+        tools: Sequence[Tool | ToolSchema],
+    ) -> int:
+        try:
+            return self._client.count_tokens(messages, tools=tools)
+        except Exception:
+            # E.g. tiktoken cannot download its encoding offline; an
+            # estimate keeps the budgets of cut responses close.
+            return sum(map(estimate_tokens, messages))
+
+    def _completed(
+        self,
+        result: CreateResult,
+        messages: Sequence[LLMMessage],
+        tools: Sequence[Tool | ToolSchema],
+        deltas: List[str],
+    ) -> CreateResult:
+        if deltas and isinstance(result.content, list) and not result.content:
+            # autogen 0.4.4 mistakes a text response of one delta for an
+            # empty list of tool calls.
+            result = result.model_copy(update={"content": "".join(deltas)})
+        if deltas and result.usage.completion_tokens == 0:
+            # Streams only carry usage when the service is asked for it.
+            result = result.model_copy(
+                update={
+                    "usage": RequestUsage(
+                        prompt_tokens=result.usage.prompt_tokens
+                        or self._prompt_tokens(messages, tools),
+                        completion_tokens=len(deltas),
+                    )
+                }
+            )
+        if isinstance(result.content, str):
+            self._complete_responses += 1
+            self._complete_completion_tokens += result.usage.completion_tokens
+        return result
+
+    def _stopped(
+        self,
+        messages: Sequence[LLMMessage],
+        tools: Sequence[Tool | ToolSchema],
+        deltas: List[str],
+    ) -> CreateResult:
+        usage = RequestUsage(
+            prompt_tokens=self._prompt_tokens(messages, tools),
+            completion_tokens=len(deltas),
+        )
+        self._stopped_usage = RequestUsage(
+            prompt_tokens=self._stopped_usage.prompt_tokens
+            + usage.prompt_tokens,
+            completion_tokens=self._stopped_usage.completion_tokens
+            + usage.completion_tokens,
+        )
+        saved = 0
+        if self._complete_responses:
+            mean = self._complete_completion_tokens / self._complete_responses
+            saved = max(round(mean) - len(deltas), 0)
+        self.early_stops += 1
+        self.stopped_completion_tokens += len(deltas)
+        self.saved_completion_tokens += saved
+        logger.info(
+            "Stopped generation after %d tokens, about %d tokens saved.",
+            len(deltas),
+            saved,
+        )
+        return CreateResult(
+            finish_reason="stop",
+            content="".join(deltas),
+            usage=usage,
+            cached=False,
+        )
+
+    def actual_usage(self) -> RequestUsage:
+        return _add_usage(self._client.actual_usage(), self._stopped_usage)
+
+    def total_usage(self) -> RequestUsage:
+        return _add_usage(self._client.total_usage(), self._stopped_usage)
+
+    def count_tokens(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+    ) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+    ) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> ModelCapabilities:  # type: ignore
+        warnings.warn(
+            "capabilities is deprecated, use model_info instead",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return self._client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+    def _to_config(self) -> EarlyStopChatCompletionClientConfig:
+        return EarlyStopChatCompletionClientConfig(
+            client=self._client_config or self._client.dump_component(),
+            stop_phrases=self._stop_phrases,
+        )
+
+    @classmethod
+    def _from_config(
+        cls, config: EarlyStopChatCompletionClientConfig
+    ) -> "EarlyStopChatCompletionClient":
+        return cls(
+            ChatCompletionClient.load_component(config.client),
+            stop_phrases=config.stop_phrases,
+            client_config=config.client,
+        )
+
+
+def _add_usage(first: RequestUsage, second: RequestUsage) -> RequestUsage:
+    return RequestUsage(
+        prompt_tokens=first.prompt_tokens + second.prompt_tokens,
+        completion_tokens=first.completion_tokens + second.completion_tokens,
+    )
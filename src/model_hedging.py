@@ -0,0 +1,295 @@
+"""
+Hedged requests for ChatCompletionClient.
+
+In a RoundRobinGroupChat every turn waits on one model call, so a single slow
+p99 response stalls the whole conversation. HedgedChatCompletionClient fires
+a duplicate request when the first one has not returned after a configurable
+percentile of the observed latency, returns whichever answers first and
+cancels the other. Only the latency of first requests is observed, so
+hedging does not lower the percentile it is timed by.
+
+Hedges cost tokens, so they are capped: at most `max_hedge_ratio` of all
+requests may be hedged (10% by default), and nothing is hedged until
+`min_samples` latencies have been observed.
+
+The duplicate goes to `hedge_client` when one is configured (for example a
+deployment in another region), otherwise to the same client. When the
+wrapped client is a RoutedChatCompletionClient, the router picks the
+deployment for each copy.
+
+Hedging is enabled through `settings.llm_config` (see MODEL_HEDGE_PERCENTILE
+in settings.py). Only `create` is hedged; `create_stream` is passed through.
+"""
+
+import asyncio
+import time
+import warnings
+from typing import (
+    Any,
+    AsyncGenerator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+)
+
+from autogen_core import CancellationToken, Component, ComponentModel
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelCapabilities,  # type: ignore
+    ModelInfo,
+    RequestUsage,
+)
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+from model_router import LatencyStats
+
+
+class HedgedChatCompletionClientConfig(BaseModel):
+    client: ComponentModel
+    hedge_client: Optional[ComponentModel] = None
+    percentile: float = 0.95
+    max_hedge_ratio: float = 0.1
+    min_samples: int = 20
+    min_delay_seconds: float = 0.5
+
+
+class HedgedChatCompletionClient(
+    ChatCompletionClient, Component[HedgedChatCompletionClientConfig]
+):
+    """
+    A ChatCompletionClient that hedges slow requests with a duplicate.
+
+    Counters: `requests`, `hedges` (duplicates sent), `hedge_wins` (the
+    duplicate answered first) and `hedges_skipped` (a hedge was due but the
+    budget was used up).
+
+    Args:
+        client: The client every request is sent to first.
+        hedge_client: Where duplicates are sent; defaults to `client`.
+        percentile: Latency percentile after which a duplicate is sent.
+        max_hedge_ratio: Upper bound for hedges / requests.
+        min_samples: Latencies to observe before hedging starts.
+        min_delay_seconds: Never hedge earlier than this.
+    """
+
+    component_type = "model"
+    component_config_schema = HedgedChatCompletionClientConfig
+
+    def __init__(
+        self,
+        client: ChatCompletionClient,
+        hedge_client: Optional[ChatCompletionClient] = None,
+        percentile: float = 0.95,
+        max_hedge_ratio: float = 0.1,
+        min_samples: int = 20,
+        min_delay_seconds: float = 0.5,
+        client_config: Optional[ComponentModel] = None,
+        hedge_client_config: Optional[ComponentModel] = None,
+    ) -> None:
+        self._client = client
+        self._hedge_client = hedge_client or client
+        self._percentile = percentile
+        self._max_hedge_ratio = max_hedge_ratio
+        self._min_samples = min_samples
+        self._min_delay_seconds = min_delay_seconds
+        self._client_config = client_config
+        self._hedge_client_config = hedge_client_config
+        self.latency = LatencyStats()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None while still learning."""
+        if len(self.latency) < self._min_samples:
+            return None
+        delay = self.latency.quantile(self._percentile)
+        return max(delay or 0.0, self._min_delay_seconds)
+
+    def _hedge_allowed(self) -> bool:
+        return self.hedges + 1 <= self._max_hedge_ratio * self.requests
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        self.requests += 1
+        started = time.monotonic()
+        tasks: List["asyncio.Task[CreateResult]"] = []
+
+        def send(client: ChatCompletionClient) -> "asyncio.Task[CreateResult]":
+            task = asyncio.ensure_future(
+                client.create(
+                    messages,
+                    tools=tools,
+                    json_output=json_output,
+                    extra_create_args=extra_create_args,
+                )
+            )
+            if cancellation_token is not None:
+                cancellation_token.link_future(task)
+            tasks.append(task)
+            return task
+
+        def record(primary: "asyncio.Task[CreateResult]") -> None:
+            # Only the primary's latency is recorded: with hedged latencies
+            # the percentile, and so the hedge delay, would keep falling. A
+            # primary that lost to the hedge took at least this long.
+            if primary.cancelled():
+                if not any(
+                    task.done()
+                    and not task.cancelled()
+                    and task.exception() is None
+                    for task in tasks[1:]
+                ):
+                    return
+            elif primary.exception() is not None:
+                return
+            self.latency.record(time.monotonic() - started)
+
+        try:
+            primary = send(self._client)
+            primary.add_done_callback(record)
+            delay = self.hedge_delay()
+            if delay is not None:
+                await asyncio.wait({primary}, timeout=delay)
+                if not primary.done():
+                    if self._hedge_allowed():
+                        self.hedges += 1
+                        send(self._hedge_client)
+                    else:
+                        self.hedges_skipped += 1
+            return await self._first_result(tasks)
+        finally:
+            # The copy that lost the race is cancelled here.
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _first_result(
+        self, tasks: List["asyncio.Task[CreateResult]"]
+    ) -> CreateResult:
+        """Return the first successful result, or raise the last error."""
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.cancelled():
+                    error = error or asyncio.CancelledError()
+                elif task.exception() is not None:
+                    error = task.exception()
+                else:
+                    if task is not tasks[0]:
+                        self.hedge_wins += 1
+                    return task.result()
+        assert error is not None
+        raise error
+
+    def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        return self._client.create_stream(
+            messages,
+            tools=tools,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+
+    def actual_usage(self) -> RequestUsage:
+        return self._client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        if self._hedge_client is self._client:
+            return self._client.total_usage()
+        usage = self._client.total_usage()
+        hedge_usage = self._hedge_client.total_usage()
+        return RequestUsage(
+            prompt_tokens=usage.prompt_tokens + hedge_usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens
+            + hedge_usage.completion_tokens,
+        )
+
+    def count_tokens(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+    ) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+    ) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> ModelCapabilities:  # type: ignore
+        warnings.warn(
+            "capabilities is deprecated, use model_info instead",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return self._client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+    def _to_config(self) -> HedgedChatCompletionClientConfig:
+        hedge_client_config = None
+        if self._hedge_client is not self._client:
+            hedge_client_config = (
+                self._hedge_client_config
+                or self._hedge_client.dump_component()
+            )
+        return HedgedChatCompletionClientConfig(
+            client=self._client_config or self._client.dump_component(),
+            hedge_client=hedge_client_config,
+            percentile=self._percentile,
+            max_hedge_ratio=self._max_hedge_ratio,
+            min_samples=self._min_samples,
+            min_delay_seconds=self._min_delay_seconds,
+        )
+
+    @classmethod
+    def _from_config(
+        cls, config: HedgedChatCompletionClientConfig
+    ) -> "HedgedChatCompletionClient":
+        return cls(
+            ChatCompletionClient.load_component(config.client),
+            hedge_client=(
+                ChatCompletionClient.load_component(config.hedge_client)
+                if config.hedge_client is not None
+                else None
+            ),
+            percentile=config.percentile,
+            max_hedge_ratio=config.max_hedge_ratio,
+            min_samples=config.min_samples,
+            min_delay_seconds=config.min_delay_seconds,
+            client_config=config.client,
+            hedge_client_config=config.hedge_client,
+        )
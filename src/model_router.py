@@ -0,0 +1,396 @@
+"""
+Latency-aware routing across several model deployments.
+
+RoutedChatCompletionClient holds one client per deployment (for example the
+same gpt-4o model in several regions or resources) and sends each request to
+the deployment with the lowest recent p50 latency that still has spare quota.
+Latency samples decay exponentially with age, so a region that slows down
+stops receiving traffic within a few half-lives and wins it back once it
+recovers. When a deployment fails with a rate limit, a server error, a timeout
+or a connection error, the request is retried on the next one and the failing
+deployment is put on a cool-down that grows with repeated errors. Other
+errors, such as a prompt that exceeds the context length, are raised at once:
+every deployment would reject the request the same way.
+
+Routing is enabled through `settings.llm_config` (see AZURE_OPENAI_DEPLOYMENTS
+in settings.py).
+"""
+
+import asyncio
+import time
+import warnings
+from collections import deque
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    AsyncGenerator,
+    Deque,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import httpx
+from autogen_core import CancellationToken, Component, ComponentModel
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelCapabilities,  # type: ignore
+    ModelInfo,
+    RequestUsage,
+)
+from autogen_core.tools import Tool, ToolSchema
+from openai import APIConnectionError
+from pydantic import BaseModel
+
+from batch_completion import TokenBucket, is_rate_limit_error
+
+
+def is_deployment_error(error: BaseException) -> bool:
+    """Whether another deployment may succeed where this one failed."""
+    if is_rate_limit_error(error):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code >= 500
+    return isinstance(
+        error,
+        (
+            APIConnectionError,
+            httpx.TransportError,
+            asyncio.TimeoutError,
+            ConnectionError,
+        ),
+    )
+
+
+class LatencyStats:
+    """Exponentially decayed latency samples of one deployment."""
+
+    def __init__(
+        self, half_life_seconds: float = 60.0, max_samples: int = 256
+    ) -> None:
+        self.half_life_seconds = half_life_seconds
+        self._samples: Deque[Tuple[float, float]] = deque(maxlen=max_samples)
+
+    def record(self, latency: float) -> None:
+        self._samples.append((time.monotonic(), latency))
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Weighted quantile where a sample's weight halves every half-life."""
+        if not self._samples:
+            return None
+        now = time.monotonic()
+        weighted = sorted(
+            (latency, 0.5 ** ((now - at) / self.half_life_seconds))
+            for at, latency in self._samples
+        )
+        threshold = q * sum(weight for _, weight in weighted)
+        cumulative = 0.0
+        for latency, weight in weighted:
+            cumulative += weight
+            if cumulative >= threshold:
+                return latency
+        return weighted[-1][0]
+
+    def p50(self) -> Optional[float]:
+        return self.quantile(0.5)
+
+
+@dataclass
+class Deployment:
+    name: str
+    client: ChatCompletionClient
+    config: Optional[ComponentModel] = None
+    quota: Optional[TokenBucket] = None
+    latency: LatencyStats = field(default_factory=LatencyStats)
+    consecutive_failures: int = 0
+    unavailable_until: float = 0.0
+    requests: int = 0
+    failures: int = 0
+
+    def available(self, now: float) -> bool:
+        return now >= self.unavailable_until
+
+    def spare_quota(self, tokens: int) -> bool:
+        return self.quota is None or self.quota.available() >= tokens
+
+
+class DeploymentConfig(BaseModel):
+    name: Optional[str] = None
+    client: ComponentModel
+    tokens_per_minute: Optional[int] = None
+
+
+class RoutedChatCompletionClientConfig(BaseModel):
+    deployments: List[DeploymentConfig]
+    half_life_seconds: float = 60.0
+    base_cooldown_seconds: float = 5.0
+    max_cooldown_seconds: float = 300.0
+
+
+class RoutedChatCompletionClient(
+    ChatCompletionClient, Component[RoutedChatCompletionClientConfig]
+):
+    """
+    A ChatCompletionClient that routes every request to the fastest
+    deployment with spare quota and fails over to the others on errors.
+
+    Deployments without latency samples yet are tried first, so every
+    deployment gets measured. Token usage is reported summed over all
+    deployments.
+
+    Args:
+        deployments: The deployments to route between, in fallback order.
+        base_cooldown_seconds: How long a failing deployment is skipped the
+            first time; doubles with each consecutive failure.
+        max_cooldown_seconds: Upper bound for the cool-down.
+    """
+
+    component_type = "model"
+    component_config_schema = RoutedChatCompletionClientConfig
+
+    def __init__(
+        self,
+        deployments: Sequence[Deployment],
+        base_cooldown_seconds: float = 5.0,
+        max_cooldown_seconds: float = 300.0,
+    ) -> None:
+        if not deployments:
+            raise ValueError("At least one deployment is required.")
+        self._deployments = list(deployments)
+        self._base_cooldown_seconds = base_cooldown_seconds
+        self._max_cooldown_seconds = max_cooldown_seconds
+
+    @property
+    def deployments(self) -> List[Deployment]:
+        return list(self._deployments)
+
+    def _route(self, messages: Sequence[LLMMessage]) -> List[Deployment]:
+        """Deployments in the order they should be tried for one request."""
+        now = time.monotonic()
+        try:
+            tokens = self._deployments[0].client.count_tokens(messages)
+        except Exception:
+            tokens = 0
+
+        def rank(deployment: Deployment) -> Tuple[int, int, float]:
+            p50 = deployment.latency.p50()
+            return (
+                0 if deployment.available(now) else 1,
+                0 if deployment.spare_quota(tokens) else 1,
+                -1.0 if p50 is None else p50,
+            )
+
+        return sorted(self._deployments, key=rank)
+
+    def _record_success(
+        self, deployment: Deployment, latency: float, usage: RequestUsage
+    ) -> None:
+        deployment.latency.record(latency)
+        deployment.consecutive_failures = 0
+        deployment.unavailable_until = 0.0
+        if deployment.quota is not None:
+            deployment.quota.adjust(
+                usage.prompt_tokens + usage.completion_tokens
+            )
+
+    def _record_failure(self, deployment: Deployment) -> None:
+        deployment.failures += 1
+        deployment.consecutive_failures += 1
+        cooldown = min(
+            self._base_cooldown_seconds
+            * 2 ** (deployment.consecutive_failures - 1),
+            self._max_cooldown_seconds,
+        )
+        deployment.unavailable_until = time.monotonic() + cooldown
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        last_error: Optional[Exception] = None
+        for deployment in self._route(messages):
+            deployment.requests += 1
+            started = time.monotonic()
+            try:
+                result = await deployment.client.create(
+                    messages,
+                    tools=tools,
+                    json_output=json_output,
+                    extra_create_args=extra_create_args,
+                    cancellation_token=cancellation_token,
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                if not is_deployment_error(error):
+                    raise
+                self._record_failure(deployment)
+                last_error = error
+                continue
+            self._record_success(
+                deployment, time.monotonic() - started, result.usage
+            )
+            return result
+        assert last_error is not None
+        raise last_error
+
+    def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        async def _generator() -> AsyncGenerator[
+            Union[str, CreateResult], None
+        ]:
+            last_error: Optional[Exception] = None
+            for deployment in self._route(messages):
+                deployment.requests += 1
+                started = time.monotonic()
+                stream = deployment.client.create_stream(
+                    messages,
+                    tools=tools,
+                    json_output=json_output,
+                    extra_create_args=extra_create_args,
+                    cancellation_token=cancellation_token,
+                )
+                # Fail over only until the first chunk has been handed out;
+                # after that the caller has seen partial output.
+                try:
+                    first_chunk = await stream.__anext__()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as error:
+                    if not is_deployment_error(error):
+                        raise
+                    self._record_failure(deployment)
+                    last_error = error
+                    continue
+                # Time to first chunk is what the caller waits for.
+                latency = time.monotonic() - started
+                yield first_chunk
+                chunk = first_chunk
+                async for chunk in stream:
+                    yield chunk
+                if isinstance(chunk, CreateResult):
+                    self._record_success(deployment, latency, chunk.usage)
+                return
+            assert last_error is not None
+            raise last_error
+
+        return _generator()
+
+    def actual_usage(self) -> RequestUsage:
+        return _sum_usage(d.client.actual_usage() for d in self._deployments)
+
+    def total_usage(self) -> RequestUsage:
+        return _sum_usage(d.client.total_usage() for d in self._deployments)
+
+    def count_tokens(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+    ) -> int:
+        return self._deployments[0].client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+    ) -> int:
+        return self._deployments[0].client.remaining_tokens(
+            messages, tools=tools
+        )
+
+    @property
+    def capabilities(self) -> ModelCapabilities:  # type: ignore
+        warnings.warn(
+            "capabilities is deprecated, use model_info instead",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return self._deployments[0].client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._deployments[0].client.model_info
+
+    def _to_config(self) -> RoutedChatCompletionClientConfig:
+        return RoutedChatCompletionClientConfig(
+            deployments=[
+                DeploymentConfig(
+                    name=deployment.name,
+                    client=deployment.config
+                    or deployment.client.dump_component(),
+                    tokens_per_minute=(
+                        int(deployment.quota.capacity)
+                        if deployment.quota is not None
+                        else None
+                    ),
+                )
+                for deployment in self._deployments
+            ],
+            half_life_seconds=self._deployments[0].latency.half_life_seconds,
+            base_cooldown_seconds=self._base_cooldown_seconds,
+            max_cooldown_seconds=self._max_cooldown_seconds,
+        )
+
+    @classmethod
+    def _from_config(
+        cls, config: RoutedChatCompletionClientConfig
+    ) -> "RoutedChatCompletionClient":
+        deployments = [
+            Deployment(
+                name=deployment.name or _deployment_name(deployment.client),
+                client=ChatCompletionClient.load_component(deployment.client),
+                config=deployment.client,
+                quota=(
+                    TokenBucket(deployment.tokens_per_minute)
+                    if deployment.tokens_per_minute
+                    else None
+                ),
+                latency=LatencyStats(config.half_life_seconds),
+            )
+            for deployment in config.deployments
+        ]
+        return cls(
+            deployments,
+            base_cooldown_seconds=config.base_cooldown_seconds,
+            max_cooldown_seconds=config.max_cooldown_seconds,
+        )
+
+
+def _deployment_name(client_config: ComponentModel) -> str:
+    endpoint = client_config.config.get("azure_endpoint", "")
+    model = client_config.config.get("model", "")
+    return f"{endpoint}/{model}"
+
+
+def _sum_usage(usages: Any) -> RequestUsage:
+    total = RequestUsage(prompt_tokens=0, completion_tokens=0)
+    for usage in usages:
+        total = RequestUsage(
+            prompt_tokens=total.prompt_tokens + usage.prompt_tokens,
+            completion_tokens=total.completion_tokens
+            + usage.completion_tokens,
+        )
+    return total
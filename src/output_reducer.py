@@ -0,0 +1,290 @@
+"""
+Fit the output of code into a token budget before it enters the chat.
+
+The Executor of 05 published the output of a message verbatim, and the
+Assistant added it to its chat history, where it is sent with every later
+`create()`. Progress bars, a training loop that logs every step or a printed
+data frame can be tens of thousands of tokens, of which the model needs the
+first lines, the last lines and the error. `chat_context.trim_output` only
+cuts characters once the output is in the history. OutputReducer shortens it
+before it is published:
+
+- Output within `max_tokens` is kept as it is.
+- Otherwise the steps below are applied in order until it fits: lines
+  rewritten with carriage returns are reduced to what a terminal would
+  show, runs of progress bars to their last line and repeated lines to one
+  with a count; runs of lines that differ only in their numbers, such as the
+  rows of a data frame or the epochs of a training log, to their first and
+  last lines; and what is left to its first and last lines.
+- The last Python traceback is always kept, with its innermost and
+  outermost frames (`chat_context.trim_traceback`), after the other output.
+- The full output is written to `outputs/output_<hash>.txt` in the work
+  directory, and the shortened output starts with a line that names that
+  file, so the model can read it in its next code block.
+
+Tokens are estimated at four characters per token, as in chat_context.py;
+pass `count_tokens` to count them with a tokenizer. Enable it with
+OUTPUT_REDUCER=1 (see settings.py).
+"""
+
+import re
+from dataclasses import dataclass
+from hashlib import sha256
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple, Union
+
+from chat_context import TRACEBACK_HEADER, _head_and_tail, trim_traceback
+
+# A percentage, a bar of at least four block or line characters, or a count
+# with a unit or rate, as printed by tqdm, pip, keras and curl.
+PROGRESS = re.compile(
+    r"\d{1,3}(?:\.\d+)?%|[█▉▊▋▌▍▎▏━─#=>]{4,}|"
+    r"\d+(?:\.\d+)?/\d+(?:\.\d+)?\s*(?:[kMG]?i?B|it|steps?)\b|"
+    r"\d+(?:\.\d+)?\s*(?:it|[kMG]?i?B)/s\b"
+)
+NUMBER = re.compile(r"[-+]?\d+(?:[.,:]\d+)*(?:e[-+]?\d+)?")
+SPACES = re.compile(r"\s+")
+# Runs shorter than this are left as they are.
+MIN_RUN = 3
+
+
+def estimate_text_tokens(text: str) -> int:
+    """About four characters per token."""
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class ReducedOutput:
+    text: str
+    # Path of the full output, relative to the work directory, if stored.
+    reference: Optional[str]
+    original_tokens: int
+    tokens: int
+
+
+@dataclass
+class OutputReducerStats:
+    outputs: int = 0
+    reduced: int = 0
+    stored: int = 0
+    original_tokens: int = 0
+    sent_tokens: int = 0
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.sent_tokens
+
+    def __str__(self) -> str:
+        return (
+            f"outputs={self.outputs} reduced={self.reduced} "
+            f"stored={self.stored} original_tokens={self.original_tokens} "
+            f"sent_tokens={self.sent_tokens} "
+            f"saved_tokens={self.saved_tokens}"
+        )
+
+
+def terminal_lines(output: str) -> List[str]:
+    """The lines of `output` as a terminal shows them after `\\r` rewrites."""
+    lines = []
+    for line in output.split("\n"):
+        if "\r" in line:
+            # The last rewrite that is not empty, e.g. of "\r\n" endings.
+            line = next(
+                (part for part in reversed(line.split("\r")) if part), ""
+            )
+        lines.append(line)
+    return lines
+
+
+def collapse_repeats(lines: List[str]) -> List[str]:
+    """Keep the last line of a run of progress bars and one of equal lines."""
+    result: List[str] = []
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        end = index + 1
+        while end < len(lines) and lines[end] == line:
+            end += 1
+        if end - index > 1:
+            result.append(line)
+            result.append(f"[previous line repeated {end - index - 1} times]")
+            index = end
+            continue
+        end = index
+        while end < len(lines) and lines[end] and PROGRESS.search(lines[end]):
+            end += 1
+        if end - index >= MIN_RUN:
+            result.append(f"[{end - index - 1} progress lines collapsed]")
+            result.append(lines[end - 1])
+            index = end
+            continue
+        result.append(line)
+        index += 1
+    return result
+
+
+def collapse_similar(lines: List[str]) -> List[str]:
+    """Keep the first and last lines of runs that differ only in numbers."""
+    # Numbers of other widths change the alignment of columns.
+    shapes = [SPACES.sub(" ", NUMBER.sub("#", line)) for line in lines]
+    result: List[str] = []
+    index = 0
+    while index < len(lines):
+        end = index + 1
+        while end < len(lines) and shapes[end] == shapes[index]:
+            end += 1
+        # Two first lines, e.g. a header and a row, and the last one.
+        if end - index > MIN_RUN + 1 and "#" in shapes[index]:
+            result.extend(lines[index : index + 2])
+            result.append(f"... [{end - index - 3} similar lines] ...")
+            result.append(lines[end - 1])
+        else:
+            result.extend(lines[index:end])
+        index = end
+    return result
+
+
+def split_traceback(output: str) -> Tuple[str, str]:
+    """The output without its last traceback, and the traceback."""
+    start = output.rfind(TRACEBACK_HEADER)
+    if start < 0:
+        return output, ""
+    start = output.rfind("\n", 0, start) + 1
+    lines = output[start:].split("\n")
+    # The traceback ends with the exception: the first line that is not
+    # indented, other than the note of a recursion. Output that follows,
+    # such as stdout after stderr, is not part of it.
+    end = next(
+        (
+            index + 1
+            for index, line in enumerate(lines[1:], 1)
+            if line
+            and not line[0].isspace()
+            and not line.startswith("[Previous line repeated")
+        ),
+        len(lines),
+    )
+    traceback = "\n".join(lines[:end])
+    rest = output[:start] + "\n".join(lines[end:])
+    return rest, traceback
+
+
+class OutputReducer:
+    """
+    Shortens the output of code to about `max_tokens` tokens.
+
+    Args:
+        max_tokens: Tokens the reduced output may take, including the
+            traceback and the line that names the full output.
+        work_dir: Directory the code runs in; the full output is stored in
+            its `outputs` directory.
+        store: Whether to store the full output of reduced output.
+        keep_frames: Frames kept of a long traceback.
+        count_tokens: Counts the tokens of a text.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 1000,
+        work_dir: Union[Path, str] = ".",
+        store: bool = True,
+        keep_frames: int = 4,
+        count_tokens: Callable[[str], int] = estimate_text_tokens,
+    ) -> None:
+        self.max_tokens = max_tokens
+        self.work_dir = Path(work_dir)
+        self.store = store
+        self.keep_frames = keep_frames
+        self.count_tokens = count_tokens
+        self.stats = OutputReducerStats()
+
+    def reduce(self, output: str) -> ReducedOutput:
+        original_tokens = self.count_tokens(output)
+        self.stats.outputs += 1
+        self.stats.original_tokens += original_tokens
+        if original_tokens <= self.max_tokens:
+            self.stats.sent_tokens += original_tokens
+            return ReducedOutput(
+                output, None, original_tokens, original_tokens
+            )
+        reference = self._store(output) if self.store else None
+        note = (
+            f"[Output shortened from about {original_tokens} tokens; the "
+            f"full output is in {reference}]"
+            if reference
+            else f"[Output shortened from about {original_tokens} tokens]"
+        )
+        rest, traceback = split_traceback(output)
+        budget = self.max_tokens - self.count_tokens(note)
+        if traceback:
+            traceback = trim_traceback(traceback, self.keep_frames)
+            if self.count_tokens(traceback) > budget // 2:
+                traceback = _head_and_tail(traceback, budget // 2 * 4)
+            budget -= self.count_tokens(traceback)
+        body = "\n".join(self._fit(terminal_lines(rest.strip("\n")), budget))
+        text = "\n".join(part for part in (note, body, traceback) if part)
+        tokens = self.count_tokens(text)
+        self.stats.reduced += 1
+        self.stats.sent_tokens += tokens
+        return ReducedOutput(text, reference, original_tokens, tokens)
+
+    def _fit(self, lines: List[str], max_tokens: int) -> List[str]:
+        for step in (collapse_repeats, collapse_similar):
+            if self._lines_tokens(lines) <= max_tokens:
+                return lines
+            lines = step(lines)
+        if self._lines_tokens(lines) <= max_tokens:
+            return lines
+        return self._head_and_tail_lines(lines, max_tokens)
+
+    def _lines_tokens(self, lines: List[str]) -> int:
+        return self.count_tokens("\n".join(lines))
+
+    def _head_and_tail_lines(
+        self, lines: List[str], max_tokens: int
+    ) -> List[str]:
+        """The first and last lines, two fifths and three fifths of the
+        budget; lines longer than a quarter of it are cut."""
+        max_line = max(max_tokens // 4, 1)
+        lines = [
+            _head_and_tail(line, max_line * 4)
+            if self.count_tokens(line) > max_line
+            else line
+            for line in lines
+        ]
+        # Leave room for the marker.
+        max_tokens -= 12
+        head: List[str] = []
+        used = 0
+        for line in lines:
+            cost = self.count_tokens(line) + 1
+            if used + cost > max_tokens * 2 // 5:
+                break
+            head.append(line)
+            used += cost
+        tail: List[str] = []
+        for line in reversed(lines[len(head) :]):
+            cost = self.count_tokens(line) + 1
+            if used + cost > max_tokens:
+                break
+            tail.append(line)
+            used += cost
+        tail.reverse()
+        omitted = lines[len(head) : len(lines) - len(tail)]
+        if not omitted:
+            return lines
+        marker = (
+            f"... [{len(omitted)} lines, about "
+            f"{self._lines_tokens(omitted)} tokens, omitted] ..."
+        )
+        return head + [marker] + tail
+
+    def _store(self, output: str) -> str:
+        """Write the full output; the same output is stored once."""
+        digest = sha256(output.encode()).hexdigest()[:16]
+        path = self.work_dir / "outputs" / f"output_{digest}.txt"
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(output, encoding="utf-8")
+            self.stats.stored += 1
+        return path.relative_to(self.work_dir).as_posix()
@@ -0,0 +1,252 @@
+"""
+Run the independent code blocks of a message at the same time.
+
+CodeExecutors run the blocks of a message one after another, so a message
+with a setup script and three separate plotting scripts takes the sum of
+their runtimes. ParallelCodeExecutor wraps another executor and runs blocks
+that do not depend on each other concurrently, at most `max_workers` at a
+time.
+
+Block B depends on an earlier block A when:
+
+- A or B is not Python (a shell block is usually setup such as
+  `pip install`, so it waits for the blocks before it and the blocks after
+  it wait for it),
+- B mentions a file that A declares with `# filename:` or mentions too
+  (file names are taken from string literals with an extension or a
+  directory, e.g. `"data/prices.csv"`), or
+- B imports the module that A declares with `# filename:`.
+
+A block runs when the blocks it depends on have succeeded; if one of them
+failed, it is skipped. The output is merged in block order, whatever order
+the blocks finished in, with a header per block that gives its exit code
+and run time, and the exit code is that of the first block that failed.
+The result's `blocks` hold the per-block timings.
+
+Blocks of an executor that keeps state between blocks (kernel_pool.py)
+depend on each other through variables too, so they should not be run in
+parallel.
+"""
+
+import asyncio
+import re
+import time
+from dataclasses import dataclass, field
+from pathlib import PurePosixPath
+from typing import List, Optional, Set
+
+from autogen_core import CancellationToken
+from autogen_core.code_executor import CodeBlock, CodeExecutor
+from autogen_ext.code_executors._common import CommandLineCodeResult
+
+from kernel_pool import PYTHON_LANGUAGES
+
+FILENAME = re.compile(r"^#\s*filename:\s*(\S+)")
+STRING = re.compile(r"""(['"])([^'"\n]+?)\1""")
+FILE_LIKE = re.compile(r"^[\w.\-/]*(/|\.[A-Za-z0-9]{1,5}$)")
+IMPORT = re.compile(
+    r"^\s*(?:from\s+([\w.]+)\s+import|import\s+([\w.,\s]+))", re.M
+)
+
+
+def declared_file(code: str) -> Optional[str]:
+    """The `# filename:` of a block, from its first line."""
+    match = FILENAME.match(code.split("\n", 1)[0])
+    return match.group(1) if match else None
+
+
+def mentioned_files(code: str) -> Set[str]:
+    """File names in string literals, with their directories."""
+    files: Set[str] = set()
+    for _, literal in STRING.findall(code):
+        if not FILE_LIKE.match(literal):
+            continue
+        path = PurePosixPath(literal.removeprefix("./"))
+        files.add(str(path))
+        files.update(str(parent) for parent in path.parents if parent.name)
+    return files
+
+
+def imported_modules(code: str) -> Set[str]:
+    modules: Set[str] = set()
+    for from_module, import_list in IMPORT.findall(code):
+        names = [from_module] if from_module else import_list.split(",")
+        for name in names:
+            name = name.split()[0] if name.split() else ""
+            if name:
+                modules.add(name.split(".")[0])
+    return modules
+
+
+def block_dependencies(code_blocks: List[CodeBlock]) -> List[Set[int]]:
+    """For every block, the indexes of the earlier blocks it depends on."""
+    python = [
+        block.language.lower() in PYTHON_LANGUAGES for block in code_blocks
+    ]
+    files: List[Set[str]] = []
+    modules: List[Optional[str]] = []
+    for block in code_blocks:
+        declared = declared_file(block.code)
+        block_files = mentioned_files(block.code)
+        if declared is not None:
+            block_files.add(declared.removeprefix("./"))
+        files.append(block_files)
+        modules.append(
+            PurePosixPath(declared).stem
+            if declared is not None and declared.endswith(".py")
+            else None
+        )
+    dependencies: List[Set[int]] = []
+    for index, block in enumerate(code_blocks):
+        imports = imported_modules(block.code) if python[index] else set()
+        dependencies.append(
+            {
+                earlier
+                for earlier in range(index)
+                if not python[index]
+                or not python[earlier]
+                or files[index] & files[earlier]
+                or modules[earlier] in imports
+            }
+        )
+    return dependencies
+
+
+@dataclass
+class BlockResult:
+    index: int
+    language: str
+    exit_code: int
+    output: str
+    seconds: float = 0.0
+    skipped: bool = False
+    code_file: Optional[str] = None
+
+
+@dataclass
+class ParallelCodeResult(CommandLineCodeResult):
+    blocks: List[BlockResult] = field(default_factory=list)
+
+    def timings(self) -> str:
+        """One line per block with its exit code and run time."""
+        return "\n".join(
+            f"block {block.index + 1} ({block.language}): "
+            + (
+                "skipped"
+                if block.skipped
+                else f"exit code {block.exit_code}, {block.seconds:.2f} s"
+            )
+            for block in self.blocks
+        )
+
+
+@dataclass
+class ParallelStats:
+    runs: int = 0
+    blocks: int = 0
+    skipped_blocks: int = 0
+    block_seconds: float = 0.0
+    wall_seconds: float = 0.0
+
+    @property
+    def saved_seconds(self) -> float:
+        """Time saved against running the same blocks one after another."""
+        return self.block_seconds - self.wall_seconds
+
+    def __str__(self) -> str:
+        return (
+            f"runs={self.runs} blocks={self.blocks} "
+            f"skipped_blocks={self.skipped_blocks} "
+            f"block_seconds={self.block_seconds:.2f} "
+            f"wall_seconds={self.wall_seconds:.2f} "
+            f"saved_seconds={self.saved_seconds:.2f}"
+        )
+
+
+class ParallelCodeExecutor(CodeExecutor):
+    """
+    Runs independent code blocks of a message concurrently.
+
+    Args:
+        code_executor: Executor that runs each block.
+        max_workers: Most blocks running at the same time.
+    """
+
+    def __init__(
+        self, code_executor: CodeExecutor, max_workers: int = 4
+    ) -> None:
+        self._code_executor = code_executor
+        self._max_workers = max_workers
+        self.stats = ParallelStats()
+
+    async def execute_code_blocks(
+        self,
+        code_blocks: List[CodeBlock],
+        cancellation_token: CancellationToken,
+    ) -> ParallelCodeResult:
+        started = time.perf_counter()
+        dependencies = block_dependencies(code_blocks)
+        workers = asyncio.Semaphore(self._max_workers)
+        tasks: List["asyncio.Task[BlockResult]"] = []
+
+        async def run(index: int) -> BlockResult:
+            block = code_blocks[index]
+            for dependency in sorted(dependencies[index]):
+                if (await tasks[dependency]).exit_code != 0:
+                    return BlockResult(
+                        index, block.language, 1, "", skipped=True
+                    )
+            async with workers:
+                block_started = time.perf_counter()
+                result = await self._code_executor.execute_code_blocks(
+                    [block], cancellation_token
+                )
+                return BlockResult(
+                    index,
+                    block.language,
+                    result.exit_code,
+                    result.output,
+                    seconds=time.perf_counter() - block_started,
+                    code_file=getattr(result, "code_file", None),
+                )
+
+        for index in range(len(code_blocks)):
+            tasks.append(asyncio.create_task(run(index)))
+        blocks = list(await asyncio.gather(*tasks))
+
+        self.stats.runs += 1
+        self.stats.blocks += len(blocks)
+        self.stats.skipped_blocks += sum(block.skipped for block in blocks)
+        self.stats.block_seconds += sum(block.seconds for block in blocks)
+        self.stats.wall_seconds += time.perf_counter() - started
+        return ParallelCodeResult(
+            exit_code=next(
+                (block.exit_code for block in blocks if block.exit_code),
+                0,
+            ),
+            output=_merge(blocks),
+            code_file=next(
+                (block.code_file for block in blocks if block.code_file),
+                None,
+            ),
+            blocks=blocks,
+        )
+
+    async def restart(self) -> None:
+        await self._code_executor.restart()
+
+
+def _merge(blocks: List[BlockResult]) -> str:
+    if len(blocks) == 1:
+        return blocks[0].output
+    sections = []
+    for block in blocks:
+        if block.skipped:
+            header = "skipped, a block it depends on failed"
+        else:
+            header = f"exit code {block.exit_code}, {block.seconds:.2f} s"
+        sections.append(
+            f"--- block {block.index + 1} ({block.language}): {header} ---\n"
+            f"{block.output}"
+        )
+    return "\n".join(sections)
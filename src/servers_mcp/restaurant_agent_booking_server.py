@@ -43,44 +43,27 @@ In both cases, uv will make sure to install semantic-kernel with the mcp extra f
 
 import argparse
 import logging
-import os
+import sys
+from pathlib import Path
 from random import random
 from typing import Annotated, Any, Literal
 
 import anyio
 import dotenv
 from semantic_kernel.agents import ChatCompletionAgent
-from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
 from semantic_kernel.functions import kernel_function
 from semantic_kernel.kernel import Kernel
 
-from settings import llm_config
+# The servers are started from this directory (`uv --directory=...`), so
+# make chat_services and settings in the parent src directory importable.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from chat_services import setup_chat_service  # noqa: E402
 
 logger = logging.getLogger(__name__)
 
 dotenv.load_dotenv()
 
-azure_openai_endpoint = os.getenv("AZURE_OPENAI_URL")
-
-
-def setup_chat_service(kernel: Kernel, service_id: str) -> None:
-    """Set up a chat completion service for the kernel."""
-    deployment_name = llm_config.get("config", {}).get("model", "gpt-4o")
-    endpoint = llm_config.get("config", {}).get(
-        "azure_endpoint", azure_openai_endpoint
-    )
-    api_key = llm_config.get("config", {}).get("api_key", None)
-    api_version = llm_config.get("config", {}).get("api_version", "2024-06-01")
-
-    chat_service = AzureChatCompletion(
-        service_id=service_id,
-        endpoint=endpoint,
-        api_key=api_key,
-        api_version=api_version,
-        deployment_name=deployment_name,
-    )
-    kernel.add_service(chat_service)
-
 
 def parse_arguments():
     parser = argparse.ArgumentParser(
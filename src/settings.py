@@ -1,3 +1,4 @@
+import json
 import os
 
 from dotenv import load_dotenv
@@ -6,8 +7,11 @@ load_dotenv()
 
 
 
-llm_config = {
-    "provider": "AzureOpenAIChatCompletionClient",
+# Plain Azure OpenAI client config. Semantic Kernel services are built from
+# its "config" section; autogen scripts load llm_config below. The provider
+# sends all requests over the process-wide pool in chat_services.py.
+azure_openai_config = {
+    "provider": "chat_services.PooledAzureOpenAIChatCompletionClient",
     "config": {
         "model": "gpt-4o",
         "api_key": os.environ.get("AZURE_OPENAI_API_KEY", ""),
@@ -16,6 +20,259 @@ llm_config = {
     },
 }
 
+llm_config = azure_openai_config
+
+# Set AZURE_OPENAI_DEPLOYMENTS to a JSON list to route requests across several
+# deployments (see model_router.py). Each entry overrides keys of the config
+# above, e.g. [{"azure_endpoint": "https://swedencentral...", "api_key": "...",
+# "tokens_per_minute": 30000}, {"azure_endpoint": "https://eastus2..."}].
+if os.environ.get("AZURE_OPENAI_DEPLOYMENTS"):
+    deployments = []
+    for deployment in json.loads(os.environ["AZURE_OPENAI_DEPLOYMENTS"]):
+        tokens_per_minute = deployment.pop("tokens_per_minute", None)
+        deployments.append(
+            {
+                "client": {
+                    "provider": azure_openai_config["provider"],
+                    "config": {**azure_openai_config["config"], **deployment},
+                },
+                "tokens_per_minute": tokens_per_minute,
+            }
+        )
+    llm_config = {
+        "provider": "model_router.RoutedChatCompletionClient",
+        "config": {"deployments": deployments},
+    }
+
+# Set MODEL_STOP_PHRASES (e.g. FINISH) to stream every request and stop
+# generation as soon as one of these comma-separated phrases appears, instead
+# of generating the rest of the message (see model_early_stop.py).
+if os.environ.get("MODEL_STOP_PHRASES"):
+    llm_config = {
+        "provider": "model_early_stop.EarlyStopChatCompletionClient",
+        "config": {
+            "client": llm_config,
+            "stop_phrases": [
+                phrase.strip()
+                for phrase in os.environ["MODEL_STOP_PHRASES"].split(",")
+                if phrase.strip()
+            ],
+        },
+    }
+
+# Set MODEL_HEDGE_PERCENTILE (e.g. 0.95) to send a duplicate request when a
+# call is slower than that latency percentile (see model_hedging.py).
+# MODEL_HEDGE_MAX_RATIO caps the share of requests that may be hedged.
+if os.environ.get("MODEL_HEDGE_PERCENTILE"):
+    llm_config = {
+        "provider": "model_hedging.HedgedChatCompletionClient",
+        "config": {
+            "client": llm_config,
+            "percentile": float(os.environ["MODEL_HEDGE_PERCENTILE"]),
+            "max_hedge_ratio": float(
+                os.environ.get("MODEL_HEDGE_MAX_RATIO", "0.1")
+            ),
+        },
+    }
+
+# Set MODEL_COALESCE=1 to merge identical requests that are in flight at the
+# same time into a single call (see model_coalescing.py).
+if os.environ.get("MODEL_COALESCE", "").lower() in ("1", "true", "yes"):
+    llm_config = {
+        "provider": "model_coalescing.CoalescingChatCompletionClient",
+        "config": {"client": llm_config},
+    }
+
+# Set MODEL_CACHE_PATH to replay identical requests from a local SQLite cache
+# instead of calling Azure OpenAI again (see model_cache.py).
+if os.environ.get("MODEL_CACHE_PATH"):
+    llm_config = {
+        "provider": "model_cache.CachedChatCompletionClient",
+        "config": {
+            "client": llm_config,
+            "path": os.environ["MODEL_CACHE_PATH"],
+            "max_entries": int(
+                os.environ.get("MODEL_CACHE_MAX_ENTRIES", "10000")
+            ),
+            "ttl_seconds": (
+                float(os.environ["MODEL_CACHE_TTL_SECONDS"])
+                if os.environ.get("MODEL_CACHE_TTL_SECONDS")
+                else None
+            ),
+            # read_write, read_only or write_only
+            "mode": os.environ.get("MODEL_CACHE_MODE", "read_write"),
+        },
+    }
+
+# Tokens-per-minute quota of the Azure OpenAI deployment. batch_completion.py
+# paces requests with it; leave unset to disable token pacing.
+deployment_tokens_per_minute = (
+    int(os.environ["AZURE_OPENAI_TPM"])
+    if os.environ.get("AZURE_OPENAI_TPM")
+    else None
+)
+
+# Estimated price of the model in USD per 1000 tokens, used for cost budgets
+# (see budgets.py). Set MODEL_PRICE_PER_1K_TOKENS to "<prompt>,<completion>";
+# the default is the gpt-4o list price.
+prompt_price, completion_price = os.environ.get(
+    "MODEL_PRICE_PER_1K_TOKENS", "0.0025,0.01"
+).split(",")
+model_price_per_1k_tokens = {
+    "prompt": float(prompt_price),
+    "completion": float(completion_price),
+}
+
+# Budget of one run of the example teams and of the agents in 05 (see
+# budgets.py). A run stops once it has spent RUN_MAX_COST_USD (default 1.0)
+# or any of the optional token and wall-clock limits. Set RUN_MAX_COST_USD to
+# "none" to remove the cost limit.
+run_budget = {
+    "max_prompt_tokens": (
+        int(os.environ["RUN_MAX_PROMPT_TOKENS"])
+        if os.environ.get("RUN_MAX_PROMPT_TOKENS")
+        else None
+    ),
+    "max_completion_tokens": (
+        int(os.environ["RUN_MAX_COMPLETION_TOKENS"])
+        if os.environ.get("RUN_MAX_COMPLETION_TOKENS")
+        else None
+    ),
+    "max_total_tokens": (
+        int(os.environ["RUN_MAX_TOKENS"])
+        if os.environ.get("RUN_MAX_TOKENS")
+        else None
+    ),
+    "max_cost": (
+        None
+        if os.environ.get("RUN_MAX_COST_USD", "").lower() == "none"
+        else float(os.environ.get("RUN_MAX_COST_USD") or "1.0")
+    ),
+    "max_seconds": (
+        float(os.environ["RUN_MAX_SECONDS"])
+        if os.environ.get("RUN_MAX_SECONDS")
+        else None
+    ),
+}
+
+# Loop detection for 04 and 05 (see loop_detection.py): a run is stopped, in
+# 05 after one nudge, when an agent sends the same message LOOP_MAX_REPEATS
+# times within its last LOOP_WINDOW messages.
+loop_detection = {
+    "max_repeats": int(os.environ.get("LOOP_MAX_REPEATS", "3")),
+    "window": int(os.environ.get("LOOP_WINDOW", "10")),
+}
+
+# Chat history of the assistants in 05 and 08 (see chat_context.py): the last
+# CHAT_CONTEXT_WINDOW messages within an estimated CHAT_CONTEXT_MAX_TOKENS are
+# sent, older ones are summarized, and executor output longer than
+# CHAT_CONTEXT_MAX_OUTPUT_CHARS is trimmed.
+chat_context = {
+    "window": int(os.environ.get("CHAT_CONTEXT_WINDOW", "20")),
+    "max_tokens": int(os.environ.get("CHAT_CONTEXT_MAX_TOKENS", "12000")),
+    "max_output_chars": int(
+        os.environ.get("CHAT_CONTEXT_MAX_OUTPUT_CHARS", "4000")
+    ),
+}
+
+# Code execution in 04 and 05: CODE_EXECUTOR=kernel runs the code blocks in a
+# long-lived Python kernel per conversation (see kernel_pool.py) instead of a
+# new interpreter per block. Kernels idle for KERNEL_IDLE_SECONDS are stopped,
+# and each is capped at KERNEL_MAX_MEMORY_MB (0 for no cap).
+# CODE_EXECUTOR=forkserver runs every block in a fresh process forked from a
+# server that has imported the comma-separated FORK_SERVER_PRELOAD modules
+# (see fork_server.py).
+code_executor = os.environ.get("CODE_EXECUTOR", "local")
+kernel_pool = {
+    "idle_seconds": float(os.environ.get("KERNEL_IDLE_SECONDS", "600")),
+    "max_kernels": int(os.environ.get("KERNEL_MAX_KERNELS", "8")),
+    "max_memory_mb": int(os.environ.get("KERNEL_MAX_MEMORY_MB", "2048")),
+}
+fork_server = {
+    "preload": os.environ.get(
+        "FORK_SERVER_PRELOAD", "numpy,pandas,matplotlib.pyplot,yfinance"
+    ).split(","),
+}
+
+# Independent code blocks of one message in 05 run at the same time, at most
+# CODE_PARALLEL_BLOCKS at once (see parallel_blocks.py); 1 runs them one after
+# another. Not used with CODE_EXECUTOR=kernel, whose blocks share state.
+parallel_blocks = {
+    "max_workers": int(os.environ.get("CODE_PARALLEL_BLOCKS", "1")),
+}
+
+# Set CODE_CACHE_PATH to a SQLite file (e.g. ./.code_cache/results.sqlite) to
+# reuse the results of pure code blocks that ran before in 04 and 05 (see
+# code_cache.py). Results with more than CODE_CACHE_MAX_ENTRY_BYTES of output
+# and files are not stored. Not used with CODE_EXECUTOR=kernel or in 08, whose
+# executors keep state between blocks.
+code_cache = (
+    {
+        "path": os.environ["CODE_CACHE_PATH"],
+        "max_entries": int(os.environ.get("CODE_CACHE_MAX_ENTRIES", "1000")),
+        "ttl_seconds": (
+            float(os.environ["CODE_CACHE_TTL_SECONDS"])
+            if os.environ.get("CODE_CACHE_TTL_SECONDS")
+            else None
+        ),
+        "max_entry_bytes": int(
+            os.environ.get("CODE_CACHE_MAX_ENTRY_BYTES", "5000000")
+        ),
+    }
+    if os.environ.get("CODE_CACHE_PATH")
+    else None
+)
+
+# Set CODE_STREAMING=1 to stream the Assistant's responses in 05 and 08 and
+# start every code block as soon as its closing fence arrives, while the rest
+# of the message is generated (see code_stream.py).
+code_streaming = os.environ.get("CODE_STREAMING", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Set REMOTE_BATCHING=1 to send all code blocks of a message to the dynamic
+# session of 08 in one request instead of one request per block (see
+# dynamic_sessions.py). Streamed blocks (CODE_STREAMING) are sent one by one.
+remote_batching = os.environ.get("REMOTE_BATCHING", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Set LIVE_OUTPUT=1 to see the output of code blocks while they run in 04, 05
+# and 08; 05 and 08 also publish it as OutputMessage (see live_output.py).
+# With the local executor of 04 and 05, LIVE_OUTPUT_FAIL_FAST=1 stops a block
+# LIVE_OUTPUT_GRACE_SECONDS after it printed a traceback, so the model can fix
+# the code without waiting for the rest of the script.
+live_output = (
+    {
+        "fail_fast": os.environ.get("LIVE_OUTPUT_FAIL_FAST", "").lower()
+        in ("1", "true", "yes"),
+        "grace_seconds": float(
+            os.environ.get("LIVE_OUTPUT_GRACE_SECONDS", "0.5")
+        ),
+    }
+    if os.environ.get("LIVE_OUTPUT", "").lower() in ("1", "true", "yes")
+    else None
+)
+
+# Set OUTPUT_REDUCER=1 to shorten the output of code in 05 to an estimated
+# OUTPUT_MAX_TOKENS before it is published and added to the chat history (see
+# output_reducer.py). The full output is stored in generated/outputs unless
+# OUTPUT_STORE=0. Keep CHAT_CONTEXT_MAX_OUTPUT_CHARS at about four times
+# OUTPUT_MAX_TOKENS or more, so it is not trimmed again.
+output_reducer = (
+    {
+        "max_tokens": int(os.environ.get("OUTPUT_MAX_TOKENS", "1000")),
+        "store": os.environ.get("OUTPUT_STORE", "1").lower()
+        in ("1", "true", "yes"),
+    }
+    if os.environ.get("OUTPUT_REDUCER", "").lower() in ("1", "true", "yes")
+    else None
+)
+
 # llm_websurfer = {
 #     "temperature": 0,
 #     "cache_seed": None,
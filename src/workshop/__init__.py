@@ -0,0 +1,15 @@
+"""
+Launcher and import-time profiler for the numbered workshop scenarios.
+
+    python -m workshop list
+    python -m workshop run 05
+    python -m workshop run 02 --import-times --import-json 02.json
+
+The launcher itself only imports the standard library. A scenario runs as if
+it were started directly: its top-level imports, and the `load_dotenv()` and
+environment checks of settings.py, run as usual, so `run` alone does not
+start it any faster. `--import-times` runs the scenario under
+`python -X importtime` and prints which packages its startup time goes to, to
+catch startup regressions per scenario. The warm daemon (`serve` and
+`run --warm`) is what avoids paying for the imports on every run.
+"""
@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from workshop.scenarios import SRC_DIR, resolve, run_scenario, scenarios
+
+IMPORT_TIME_LINE = re.compile(
+    r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)"
+)
+
+
+@dataclass
+class ImportProfile:
+    """Import times reported by `python -X importtime`, in microseconds."""
+
+    modules: int = 0
+    total_us: int = 0
+    packages: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    def add(self, line: str) -> bool:
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            return False
+        self_us, _, _, module = match.groups()
+        self.modules += 1
+        self.total_us += int(self_us)
+        self.packages[module.split(".")[0]] += int(self_us)
+        return True
+
+    def to_dict(self, scenario: str) -> Dict[str, object]:
+        return {
+            "scenario": scenario,
+            "modules": self.modules,
+            "total_ms": round(self.total_us / 1000, 1),
+            "packages_ms": {
+                name: round(us / 1000, 1)
+                for name, us in sorted(
+                    self.packages.items(), key=lambda item: -item[1]
+                )
+            },
+        }
+
+
+def profile_imports(name: str, args: List[str]) -> ImportProfile:
+    """Run a scenario under -X importtime and collect the import times."""
+    profile = ImportProfile()
+    process = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-m", "workshop", "run", name]
+        + ["--", *args],
+        cwd=SRC_DIR,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    assert process.stderr is not None
+    for line in process.stderr:
+        # Anything that is not an import time line is the scenario's own.
+        if not line.startswith("import time:") or not (
+            profile.add(line) or "cumulative" in line
+        ):
+            sys.stderr.write(line)
+    process.wait()
+    return profile
+
+
+def print_profile(name: str, profile: ImportProfile, top: int) -> None:
+    print(
+        f"\nImport time for {name}: {profile.total_us / 1000:.1f} ms "
+        f"in {profile.modules} modules",
+        file=sys.stderr,
+    )
+    ranked = sorted(profile.packages.items(), key=lambda item: -item[1])
+    for package, us in ranked[:top]:
+        share = 100 * us / max(profile.total_us, 1)
+        print(
+            f"  {package:<36} {us / 1000:>9.1f} ms {share:>5.1f}%",
+            file=sys.stderr,
+        )
+
+
+def _default_socket_path() -> str:
+    return os.environ.get("WORKSHOP_SOCKET") or os.path.join(
+        tempfile.gettempdir(), f"workshop-{os.getuid()}.sock"
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m workshop",
+        description="Run the numbered workshop scenarios.",
+    )
+    parser.add_argument(
+        "--socket",
+        help="Unix socket of the warm daemon "
+        "(default $WORKSHOP_SOCKET or a per-user file in the temp dir).",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List the scenarios.")
+    serve = commands.add_parser(
+        "serve", help="Start the warm daemon (see workshop/daemon.py)."
+    )
+    serve.add_argument(
+        "--preload",
+        help="Comma-separated scenarios whose imports to preload "
+        "(default all).",
+    )
+    commands.add_parser("stop", help="Stop the warm daemon.")
+    run = commands.add_parser("run", help="Run a scenario, e.g. 05.")
+    run.add_argument("scenario")
+    run.add_argument(
+        "--warm",
+        action="store_true",
+        help="Run the scenario in the warm daemon.",
+    )
+    run.add_argument(
+        "--import-times",
+        action="store_true",
+        help="Report where the scenario's import time goes.",
+    )
+    run.add_argument(
+        "--import-json",
+        help="Also write the import time breakdown to this JSON file.",
+    )
+    run.add_argument(
+        "--top", type=int, default=15, help="Packages to show (default 15)."
+    )
+    run.add_argument(
+        "args", nargs="*", help="Arguments for the scenario, after `--`."
+    )
+    options = parser.parse_args(argv)
+
+    if options.command == "list":
+        for key, path in scenarios().items():
+            print(f"{key}  {path.name}")
+        return
+
+    socket_path = options.socket or _default_socket_path()
+    if options.command == "serve":
+        from workshop.daemon import serve
+
+        preload = options.preload.split(",") if options.preload else None
+        serve(socket_path, preload)
+        return
+    if options.command == "stop":
+        from workshop.client import stop
+
+        sys.exit(stop(socket_path))
+
+    try:
+        path = resolve(options.scenario)
+    except LookupError as error:
+        parser.error(str(error))
+    if options.warm:
+        from workshop.client import run as run_warm
+
+        sys.exit(run_warm(socket_path, options.scenario, options.args))
+    if not (options.import_times or options.import_json):
+        run_scenario(path, options.args)
+        return
+
+    profile = profile_imports(options.scenario, options.args)
+    print_profile(path.stem, profile, options.top)
+    if options.import_json:
+        with open(options.import_json, "w", encoding="utf-8") as file:
+            json.dump(profile.to_dict(path.stem), file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
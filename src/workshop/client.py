@@ -0,0 +1,69 @@
+"""
+Thin client for the warm daemon in workshop/daemon.py.
+
+Only the standard library is imported here, so submitting a run takes
+milliseconds; all the heavy lifting happens in the daemon.
+"""
+
+import json
+import socket
+import sys
+import threading
+from typing import Any, Dict, List
+
+
+def _send(connection: socket.socket, message: Dict[str, Any]) -> None:
+    connection.sendall(json.dumps(message).encode() + b"\n")
+
+
+def _forward_stdin(connection: socket.socket) -> None:
+    try:
+        for line in sys.stdin:
+            _send(connection, {"stdin": line})
+        _send(connection, {"stdin_eof": True})
+    except (OSError, ValueError):
+        pass
+
+
+def submit(socket_path: str, request: Dict[str, Any]) -> int:
+    """Send one request to the daemon, stream its output; return exit code."""
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(
+            f"No workshop daemon on {socket_path}; "
+            "start one with `python -m workshop serve`.",
+            file=sys.stderr,
+        )
+        return 1
+    with connection:
+        _send(connection, request)
+        if "scenario" in request:
+            threading.Thread(
+                target=_forward_stdin, args=(connection,), daemon=True
+            ).start()
+        try:
+            for line in connection.makefile("rb"):
+                message = json.loads(line)
+                if "stdout" in message:
+                    sys.stdout.write(message["stdout"])
+                    sys.stdout.flush()
+                elif "stderr" in message:
+                    sys.stderr.write(message["stderr"])
+                    sys.stderr.flush()
+                elif "exit" in message:
+                    return int(message["exit"])
+        except KeyboardInterrupt:
+            # Closing the connection makes the daemon cancel the run.
+            return 130
+    print("The workshop daemon closed the connection.", file=sys.stderr)
+    return 1
+
+
+def run(socket_path: str, scenario: str, args: List[str]) -> int:
+    return submit(socket_path, {"scenario": scenario, "args": args})
+
+
+def stop(socket_path: str) -> int:
+    return submit(socket_path, {"command": "stop"})
@@ -0,0 +1,364 @@
+"""
+Warm daemon that keeps imports, model clients and MCP sessions resident.
+
+    python -m workshop serve &
+    python -m workshop run 04 --warm
+    python -m workshop stop
+
+The daemon imports what the scenarios import once, then runs each submitted
+scenario in-process: the script's `asyncio.run(...)` is redirected to one
+long-lived event loop, so everything bound to that loop survives between
+runs:
+
+- model clients loaded with `ChatCompletionClient.load_component` are
+  kept per config and handed out again, together with their pooled HTTP
+  connections (see chat_services.py),
+- MCPStdioPlugin servers (for example the two `uv run` servers of 10) stay
+  connected; the script's `async with` no longer starts or stops them.
+
+Output and input of the scenario are streamed over a Unix socket to the thin
+client in workshop/client.py. Runs are serialized: a second client waits for
+the current run to finish. The daemon uses the environment it was started
+with, so restart it after changing `.env`.
+
+Protocol: the client sends one JSON line with the request (`{"scenario":
+"04", "args": []}` or `{"command": "stop"}`), followed by `{"stdin": line}`
+and `{"stdin_eof": true}` lines. The daemon answers with `{"stdout": text}`,
+`{"stderr": text}` and finally `{"exit": code}`.
+"""
+
+import asyncio
+import concurrent.futures
+import importlib
+import io
+import json
+import os
+import queue
+import sys
+import threading
+import traceback
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from workshop.scenarios import (
+    SRC_DIR,
+    imported_modules,
+    resolve,
+    run_scenario,
+    scenarios,
+)
+
+
+class _ClientOutput(io.TextIOBase):
+    """A text stream that forwards writes to the client, from any thread."""
+
+    def __init__(
+        self,
+        stream: str,
+        writer: asyncio.StreamWriter,
+        loop: asyncio.AbstractEventLoop,
+    ) -> None:
+        self._stream = stream
+        self._writer = writer
+        self._loop = loop
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if text and not self._writer.is_closing():
+            line = json.dumps({self._stream: text}).encode() + b"\n"
+            self._loop.call_soon_threadsafe(self._writer.write, line)
+        return len(text)
+
+
+class _ClientInput(io.TextIOBase):
+    """A text stream fed with the lines the client reads from its stdin."""
+
+    def __init__(self) -> None:
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._eof = False
+
+    def feed(self, line: Optional[str]) -> None:
+        self._lines.put(line)
+
+    def readable(self) -> bool:
+        return True
+
+    def readline(self, size: Optional[int] = -1) -> str:
+        if self._eof:
+            return ""
+        line = self._lines.get()
+        if line is None:
+            self._eof = True
+            return ""
+        return line
+
+
+class ResidentSessions:
+    """
+    Long-lived async context managers, entered once and kept open.
+
+    Each session is entered and exited by its own task, as anyio-based
+    clients such as MCP require.
+    """
+
+    def __init__(self) -> None:
+        self._sessions: Dict[str, Tuple[Any, "asyncio.Task[None]"]] = {}
+        self._closing = asyncio.Event()
+
+    async def get(self, key: str, factory: Callable[[], Any]) -> Any:
+        session = self._sessions.get(key)
+        if session is not None and not session[1].done():
+            return session[0]
+        ready: "asyncio.Future[Any]" = (
+            asyncio.get_running_loop().create_future()
+        )
+
+        async def hold() -> None:
+            async with factory() as entered:
+                ready.set_result(entered)
+                await self._closing.wait()
+
+        task = asyncio.create_task(hold())
+        await asyncio.wait({ready, task}, return_when=asyncio.FIRST_COMPLETED)
+        if not ready.done():
+            # Raises the error that stopped the session from starting.
+            task.result()
+        self._sessions[key] = (ready.result(), task)
+        return ready.result()
+
+    async def close(self) -> None:
+        self._closing.set()
+        tasks = [task for _, task in self._sessions.values()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._sessions.clear()
+
+
+class WarmDaemon:
+    """Serves scenario runs over a Unix socket from one warm process."""
+
+    def __init__(
+        self, socket_path: str, preload: Optional[Sequence[str]] = None
+    ) -> None:
+        self._socket_path = socket_path
+        self._preload = preload
+        self._lock = asyncio.Lock()
+        self._sessions = ResidentSessions()
+        self._running: Set["concurrent.futures.Future[Any]"] = set()
+        self._stopped = asyncio.Event()
+        # Scenarios run on their own loop and thread, so a scenario that
+        # blocks its loop (e.g. input() in 07) cannot stall the socket I/O.
+        self._scenario_loop = asyncio.new_event_loop()
+
+    def _log(self, message: str) -> None:
+        print(f"[workshop daemon] {message}", file=sys.__stderr__, flush=True)
+
+    async def serve(self) -> None:
+        threading.Thread(
+            target=self._scenario_loop.run_forever, daemon=True
+        ).start()
+        self._warm_up()
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        server = await asyncio.start_unix_server(
+            self._handle, path=self._socket_path
+        )
+        self._log(f"listening on {self._socket_path}")
+        try:
+            async with server:
+                await self._stopped.wait()
+        finally:
+            await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(
+                    self._sessions.close(), self._scenario_loop
+                )
+            )
+            self._scenario_loop.call_soon_threadsafe(self._scenario_loop.stop)
+            if os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+
+    def _warm_up(self) -> None:
+        """Import what the scenarios import and install the resident hooks."""
+        if str(SRC_DIR) not in sys.path:
+            sys.path.insert(0, str(SRC_DIR))
+        paths = (
+            [resolve(name) for name in self._preload]
+            if self._preload is not None
+            else list(scenarios().values())
+        )
+        modules: List[str] = []
+        for path in paths:
+            modules.extend(imported_modules(path))
+        for module in dict.fromkeys(modules):
+            try:
+                importlib.import_module(module)
+            except Exception as error:
+                self._log(f"not preloaded: {module} ({error})")
+        self._share_model_clients()
+        self._keep_mcp_sessions()
+
+    def _share_model_clients(self) -> None:
+        try:
+            from autogen_core import ComponentModel
+            from autogen_core.models import ChatCompletionClient
+        except ImportError:
+            return
+        load = ChatCompletionClient.load_component
+        clients: Dict[str, Any] = {}
+
+        def load_component(
+            cls: Any, model: Any, expected: Optional[type] = None
+        ) -> Any:
+            if isinstance(model, ComponentModel):
+                model = model.model_dump()
+            # One client per component config, for every run.
+            key = json.dumps(model, sort_keys=True, default=str)
+            if key not in clients:
+                clients[key] = load(model, expected)
+            return clients[key]
+
+        ChatCompletionClient.load_component = classmethod(load_component)  # type: ignore
+
+    def _keep_mcp_sessions(self) -> None:
+        try:
+            import semantic_kernel.connectors.mcp as mcp
+        except ImportError:
+            return
+        base = mcp.MCPStdioPlugin
+        sessions = self._sessions
+
+        class ResidentMCPStdioPlugin(base):  # type: ignore
+            """MCPStdioPlugin whose server stays connected between runs."""
+
+            def __init__(self, *args: Any, **kwargs: Any) -> None:
+                super().__init__(*args, **kwargs)
+                self._init_args = (args, kwargs)
+
+            async def __aenter__(self) -> Any:
+                args, kwargs = self._init_args
+                key = json.dumps([args, kwargs], sort_keys=True, default=str)
+                return await sessions.get(key, lambda: base(*args, **kwargs))
+
+            async def __aexit__(self, *exc_info: Any) -> None:
+                pass
+
+        mcp.MCPStdioPlugin = ResidentMCPStdioPlugin  # type: ignore
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request = json.loads(await reader.readline() or b"{}")
+            if request.get("command") == "stop":
+                self._log("stopping")
+                self._stopped.set()
+                await self._send(writer, {"exit": 0})
+                return
+            async with self._lock:
+                code = await self._run(request, reader, writer)
+            await self._send(writer, {"exit": code})
+        except (ConnectionError, json.JSONDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send(
+        self, writer: asyncio.StreamWriter, message: Dict[str, Any]
+    ) -> None:
+        writer.write(json.dumps(message).encode() + b"\n")
+        await writer.drain()
+
+    async def _run(
+        self,
+        request: Dict[str, Any],
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> int:
+        loop = asyncio.get_running_loop()
+        stdin = _ClientInput()
+        stdout = _ClientOutput("stdout", writer, loop)
+        stderr = _ClientOutput("stderr", writer, loop)
+
+        async def read_client() -> None:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    # The client went away (e.g. Ctrl+C): stop the run.
+                    stdin.feed(None)
+                    for future in list(self._running):
+                        future.cancel()
+                    return
+                message = json.loads(line)
+                if message.get("stdin_eof"):
+                    stdin.feed(None)
+                elif "stdin" in message:
+                    stdin.feed(message["stdin"])
+
+        reading = asyncio.create_task(read_client())
+        try:
+            return await loop.run_in_executor(
+                None,
+                self._execute,
+                request.get("scenario", ""),
+                request.get("args", []),
+                stdin,
+                stdout,
+                stderr,
+            )
+        finally:
+            reading.cancel()
+
+    def _execute(
+        self,
+        scenario: str,
+        args: List[str],
+        stdin: io.TextIOBase,
+        stdout: io.TextIOBase,
+        stderr: io.TextIOBase,
+    ) -> int:
+        """Run one scenario on a worker thread; returns its exit code."""
+        saved = (sys.stdin, sys.stdout, sys.stderr, sys.argv, os.getcwd())
+        saved_run = asyncio.run
+        sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr  # type: ignore
+        asyncio.run = self._run_on_loop  # type: ignore
+        try:
+            run_scenario(resolve(scenario), args)
+            return 0
+        except SystemExit as error:
+            if error.code is None or isinstance(error.code, int):
+                return error.code or 0
+            print(error.code, file=sys.stderr)
+            return 1
+        except (KeyboardInterrupt, concurrent.futures.CancelledError):
+            return 130
+        except BaseException:
+            traceback.print_exc()
+            return 1
+        finally:
+            sys.stdout.flush()
+            asyncio.run = saved_run
+            sys.stdin, sys.stdout, sys.stderr, sys.argv = saved[:4]
+            os.chdir(saved[4])
+
+    def _run_on_loop(self, main: Awaitable[Any], **kwargs: Any) -> Any:
+        """Replacement for asyncio.run that uses the daemon's loop."""
+        future = asyncio.run_coroutine_threadsafe(main, self._scenario_loop)  # type: ignore
+        self._running.add(future)
+        try:
+            return future.result()
+        finally:
+            self._running.discard(future)
+
+
+def serve(socket_path: str, preload: Optional[Sequence[str]] = None) -> None:
+    asyncio.run(WarmDaemon(socket_path, preload).serve())
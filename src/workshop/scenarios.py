@@ -0,0 +1,49 @@
+import ast
+import os
+import runpy
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+SRC_DIR = Path(__file__).resolve().parent.parent
+
+
+def scenarios() -> Dict[str, Path]:
+    """Numbered scripts in src, keyed by their two-digit prefix."""
+    return {
+        path.name[:2]: path for path in sorted(SRC_DIR.glob("[0-9][0-9]_*.py"))
+    }
+
+
+def resolve(name: str) -> Path:
+    found = scenarios()
+    key = name.zfill(2)[:2] if name.isdigit() else name
+    if key in found:
+        return found[key]
+    for path in found.values():
+        if path.stem == name or path.name == name:
+            return path
+    raise LookupError(
+        f"Unknown scenario {name!r}; run `python -m workshop list`."
+    )
+
+
+def imported_modules(path: Path) -> List[str]:
+    """Modules a scenario imports at its top level."""
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    modules: List[str] = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module or "")
+    return [module for module in modules if module]
+
+
+def run_scenario(path: Path, args: List[str]) -> None:
+    """Run a scenario in this interpreter, as `python <script>` would."""
+    os.chdir(SRC_DIR)
+    if str(SRC_DIR) not in sys.path:
+        sys.path.insert(0, str(SRC_DIR))
+    sys.argv = [path.name, *args]
+    runpy.run_path(str(path), run_name="__main__")